@@ -0,0 +1,21 @@
+import contextlib
+
+import pytest
+from src import database
+
+
+@pytest.fixture
+def statement_budget():
+    """Fail the test if the block issues more than `limit` statements on engine.
+
+        with statement_budget(engine, "games", 4):
+            logic.games()
+    """
+    @contextlib.contextmanager
+    def budget(engine, command, limit):
+        database.instrument(engine)
+        with database.count_statements(command) as stats:
+            yield stats
+        assert stats.statements <= limit, f"!{command} issued {stats.statements} statements, budget is {limit}"
+
+    return budget
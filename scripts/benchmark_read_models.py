@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+"""Compare the per-row cost of the read models with loading the same rows as ORM objects.
+
+    python scripts/benchmark_read_models.py --games 2000 --rounds 20
+
+Each listing is read both ways from the same database:
+
+* orm: entities with their relationships loaded up front, as the listings used to.
+* read model: plain rows from Core select() statements mapped to frozen dataclasses (see src/game/readmodels.py).
+"""
+import argparse
+import random
+import sys
+import time
+
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from sqlalchemy import create_engine, select
+from sqlalchemy.orm import Session, selectinload
+from tabulate import tabulate
+
+from src import models
+from src.game import model, readmodels
+from src.game.controller import GameController
+
+PLAYERS = 6
+
+
+def seed(engine, games: int) -> None:
+    rng = random.Random(4)
+    with Session(engine) as session:
+        for player_id in range(1, 21):
+            session.add(model.Player(player_id=player_id, name=f"P{player_id}"))
+        for game_id in range(1, games + 1):
+            finished = game_id % 4 != 0
+            game = model.Game(
+                game_id=game_id,
+                game_state=model.GameState.FINISHED if finished else model.GameState.LOBBY,
+                name=f"G{game_id}",
+            )
+            session.add(game)
+            for player_id in rng.sample(range(1, 21), PLAYERS):
+                session.add(model.GamePlayer(
+                    game_id=game_id, player_id=player_id, faction=f"F{player_id}", points=rng.randint(3, 10),
+                ))
+            if finished:
+                session.flush()
+                GameController().record_result(session, game)
+        session.commit()
+
+
+def orm_games(session: Session, limit: int):
+    games = session.scalars(
+        select(model.Game)
+        .where(model.Game.game_state == model.GameState.FINISHED)
+        .order_by(model.Game.game_finish_time.desc())
+        .limit(limit)
+        .options(
+            selectinload(model.Game.game_players).joinedload(model.GamePlayer.player),
+            selectinload(model.Game.game_players).selectinload(model.GamePlayer.result),
+        )
+    ).all()
+    controller = GameController()
+    return [(game.name, len(game.game_players), controller.winner(session, game).player.name) for game in games]
+
+
+def orm_lobbies(session: Session, limit: int):
+    games = session.scalars(
+        select(model.Game)
+        .where(model.Game.game_state == model.GameState.LOBBY)
+        .order_by(model.Game.lobby_create_time.desc())
+        .options(selectinload(model.Game.game_players))
+    ).all()
+    return [(game.name, len(game.game_players)) for game in games]
+
+
+def timed(engine, fn, limit: int, rounds: int):
+    rows = 0
+    started = time.perf_counter()
+    for _ in range(rounds):
+        # A fresh session per round, as every command gets.
+        with Session(engine) as session:
+            rows += len(fn(session, limit))
+    return rows, time.perf_counter() - started
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--games", type=int, default=2000)
+    parser.add_argument("--rounds", type=int, default=20)
+    args = parser.parse_args()
+
+    engine = create_engine("sqlite://")
+    models.create_all(engine)
+    seed(engine, args.games)
+
+    listings = [
+        ("games", orm_games, readmodels.finished_games),
+        ("lobbies", orm_lobbies, lambda session, limit: readmodels.lobbies(session)),
+    ]
+    table = []
+    for name, orm, read_model in listings:
+        for label, fn in [("orm", orm), ("read model", read_model)]:
+            timed(engine, fn, args.games, 1)
+            rows, elapsed = timed(engine, fn, args.games, args.rounds)
+            table.append([name, label, rows, elapsed * 1000 / args.rounds, elapsed / rows * 1e6])
+
+    print(f"{args.games} games, {PLAYERS} players each")
+    print(tabulate(table, headers=["Listing", "Path", "Rows", "ms/listing", "us/row"], floatfmt=".2f"))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+"""Measure what building statements once saves on the achievement checks, the bot's heaviest read.
+
+    python scripts/benchmark_statements.py --players 8 --games 200 --rounds 5
+
+Every active achievement is checked for every player, as !achievements does, in three ways:
+
+* prebuilt: as the bot runs, rule statements built once and compiled SQL taken from the engine's cache.
+* rebuilt: the rule statements built again for every check, so each check also regenerates its cache key.
+* uncached: rebuilt and compiled again for every check, with the compiled cache turned off.
+"""
+import argparse
+import importlib
+import random
+import sys
+import time
+
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from sqlalchemy import create_engine, select
+from sqlalchemy.orm import Session
+from tabulate import tabulate
+
+from src import database, models
+from src.achievements import listener
+from src.achievements.checker import AchievementChecker
+from src.achievements.model import Achievement
+from src.game import factions, model
+from src.game.controller import GameController
+from src.rating.ratinglogic import RatingLogic
+
+# The package re-exports the rule function under the module's name.
+finish_rule = importlib.import_module("src.achievements.rules.finish")
+
+
+def seed(engine, players: int, games: int) -> None:
+    names = [faction.name for faction in factions.read_factions().factions]
+    rng = random.Random(4)
+    with Session(engine) as session:
+        for player_id in range(1, players + 1):
+            session.add(model.Player(player_id=player_id, name=f"P{player_id}"))
+        for game_id in range(1, games + 1):
+            game = model.Game(game_id=game_id, game_state=model.GameState.FINISHED, name=f"G{game_id}")
+            session.add(game)
+            seats = rng.sample(range(1, players + 1), min(players, 6))
+            for turn, (player_id, faction) in enumerate(zip(seats, rng.sample(names, len(seats)))):
+                session.add(model.GamePlayer(
+                    game_id=game_id, player_id=player_id, faction=faction, points=rng.randint(3, 10), turn_order=turn,
+                ))
+            session.flush()
+            GameController().record_result(session, game)
+        session.commit()
+
+
+def check_all(checker: AchievementChecker, achievements, players: int, rebuild: bool) -> int:
+    checks = 0
+    for player_id in range(1, players + 1):
+        for achievement in achievements:
+            if rebuild:
+                finish_rule._statement.cache_clear()
+            checker.check(achievement, player_id)
+            checks += 1
+    return checks
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--players", type=int, default=8)
+    parser.add_argument("--games", type=int, default=200)
+    parser.add_argument("--rounds", type=int, default=5, help="times every achievement is checked for every player")
+    args = parser.parse_args()
+
+    engine = create_engine("sqlite://")
+    models.create_all(engine)
+    seed(engine, args.players, args.games)
+    RatingLogic(engine).refresh_ratings()
+    listener.load_achievements(engine)
+    database.instrument(engine)
+    with Session(engine) as session:
+        achievements = session.scalars(select(Achievement).where(Achievement.is_active.is_(True))).all()
+        session.expunge_all()
+
+    modes = [
+        ("prebuilt", engine, False),
+        ("rebuilt", engine, True),
+        ("uncached", engine.execution_options(compiled_cache=None), True),
+    ]
+    rows = []
+    for name, bind, rebuild in modes:
+        checker = AchievementChecker(bind)
+        # Warm up the compiled cache and the rule statements.
+        check_all(checker, achievements, args.players, rebuild)
+        with database.count_statements(name) as stats:
+            started = time.perf_counter()
+            checks = sum(check_all(checker, achievements, args.players, rebuild) for _ in range(args.rounds))
+            elapsed = time.perf_counter() - started
+        rows.append([name, checks, stats.statements, elapsed / checks * 1e6, stats.seconds / checks * 1e6, stats.cache_hits / stats.statements * 100])
+
+    print(f"{len(achievements)} achievements, {args.players} players, {args.games} games")
+    print(tabulate(
+        rows,
+        headers=["Mode", "Checks", "Statements", "us/check", "us/check in SQL", "Cache hits %"],
+        floatfmt=".1f",
+    ))
+    base = rows[0][3]
+    for name, *_, per_check, _, _ in rows[1:]:
+        print(f"{name}: {per_check - base:+.1f} us per check against prebuilt")
+
+
+if __name__ == "__main__":
+    main()
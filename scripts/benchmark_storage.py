@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+"""Run the bot's command mix against each storage preset and report throughput and latency.
+
+    python scripts/benchmark_storage.py --games 50 --clients 8
+
+Each client plays whole games (lobby, joins, start, drafts, finish) while reading the listings and
+profiles in between, through the same Database the bot uses. Every preset gets a fresh database file.
+"""
+import argparse
+import asyncio
+import sys
+import tempfile
+import time
+
+from collections import defaultdict
+from dataclasses import replace
+from pathlib import Path
+from statistics import quantiles
+from typing import Dict, List
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+from tabulate import tabulate
+
+from src import models, storage
+from src.database import Database
+from src.game import factions, model
+from src.game.gamelogic import GameLogic
+from src.rating.ratinglogic import RatingLogic
+
+PLAYERS = 3
+
+
+class Benchmark:
+    def __init__(self, config: storage.StorageConfig) -> None:
+        self.engine = config.create_engine()
+        models.create_all(self.engine)
+        self.database = Database(self.engine, read_engine=config.create_read_engine())
+        self.games = GameLogic(bot=None, engine=self.engine, database=self.database)
+        self.ratings = RatingLogic(self.engine)
+        self.factions = factions.read_factions()
+        self.latencies: Dict[str, List[float]] = defaultdict(list)
+
+    async def timed(self, command: str, call):
+        started = time.perf_counter()
+        result = await call
+        self.latencies[command].append(time.perf_counter() - started)
+        return result
+
+    def _turn_order(self, game_id: int):
+        with Session(self.engine) as session:
+            return session.execute(
+                select(model.GamePlayer.player_id, model.GamePlayer.factions)
+                .filter_by(game_id=game_id)
+                .order_by(model.GamePlayer.turn_order)
+            ).all()
+
+    async def play(self, game_id: int) -> None:
+        write, run = self.database.write, self.database.run
+        players = [game_id * 10 + i for i in range(PLAYERS)]
+
+        await self.timed("lobby", write(self.games._create_lobby, game_id, players[0], f"P{players[0]}", f"G{game_id}"))
+        for player_id in players[1:]:
+            await self.timed("join", write(self.games.join, game_id, player_id, f"P{player_id}"))
+        await self.timed("lobbies", run(self.games.lobbies))
+        await self.timed("start", write(self.games.start, self.factions, game_id))
+        for player_id, pool in await run(self._turn_order, game_id):
+            await self.timed("draft", write(self.games.draft, player_id, game_id, pool[0]))
+        await self.timed("game", run(self.games.game, game_id))
+        await self.timed("finish", write(self.games.finish, False, game_id, " ".join(str(10 - i) for i in range(PLAYERS))))
+        await self.timed("games", run(self.games.games))
+        await self.timed("stats", run(self.ratings.stats, players[0]))
+        await self.timed("leaderboard", run(self.ratings.rating_page))
+
+    async def client(self, game_ids: List[int]) -> None:
+        for game_id in game_ids:
+            await self.play(game_id)
+
+    async def run(self, games: int, clients: int) -> float:
+        started = time.perf_counter()
+        await asyncio.gather(*(self.client(list(range(1 + c, games + 1, clients))) for c in range(clients)))
+        elapsed = time.perf_counter() - started
+        self.database.close()
+        return elapsed
+
+    def finished(self) -> int:
+        with Session(self.engine) as session:
+            return len(session.scalars(select(model.Game.game_id).filter_by(game_state=model.GameState.FINISHED)).all())
+
+
+def milliseconds(values: List[float], q: int) -> float:
+    if len(values) < 2:
+        return values[0] * 1000
+    return quantiles(values, n=100, method="inclusive")[q - 1] * 1000
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--games", type=int, default=50, help="games to play per preset")
+    parser.add_argument("--clients", type=int, default=8, help="games played at the same time")
+    parser.add_argument("--presets", nargs="*", default=list(storage.PRESETS), choices=list(storage.PRESETS))
+    args = parser.parse_args()
+
+    summary = []
+    for name in args.presets:
+        with tempfile.TemporaryDirectory() as directory:
+            config = replace(storage.PRESETS[name], path=str(Path(directory) / "benchmark.db"))
+            benchmark = Benchmark(config)
+            elapsed = asyncio.run(benchmark.run(args.games, args.clients))
+            finished = benchmark.finished()
+            benchmark.engine.dispose()
+
+        commands = sum(len(values) for values in benchmark.latencies.values())
+        print(f"\n{name}: {commands} commands in {elapsed:.2f}s, {finished}/{args.games} games finished")
+        print(tabulate(
+            [
+                [command, len(values), milliseconds(values, 50), milliseconds(values, 95), max(values) * 1000]
+                for command, values in sorted(benchmark.latencies.items())
+            ],
+            headers=["Command", "Count", "p50 ms", "p95 ms", "Max ms"],
+            floatfmt=".1f",
+        ))
+        writes = sum(len(benchmark.latencies[c]) for c in ("lobby", "join", "start", "draft", "finish"))
+        summary.append([name, commands / elapsed, writes / elapsed, milliseconds([v for vs in benchmark.latencies.values() for v in vs], 95)])
+
+    print()
+    print(tabulate(summary, headers=["Preset", "Commands/s", "Writes/s", "p95 ms"], floatfmt=".1f"))
+
+
+if __name__ == "__main__":
+    main()
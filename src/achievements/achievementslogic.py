@@ -4,20 +4,21 @@ import discord
 
 from itertools import batched
 from reactionmenu import ViewMenu, ViewButton
-from sqlalchemy import Engine, select
-from sqlalchemy.orm import Session
+from sqlalchemy import Engine, bindparam, func, select
+from sqlalchemy.orm import Session, aliased
 from dataclasses import dataclass
 from datetime import datetime
 
 from . import model
 from ..game import model as game_model
+from .. import database
 from .checker import AchievementChecker
 
-from typing import Sequence, List, Optional
+from typing import Dict, Sequence, List, Optional
 from .achievementtype import *
 from ..typing import *
 
-@dataclass
+@dataclass(frozen=True, slots=True)
 class Achievement:
     name: str
     points: int
@@ -27,7 +28,7 @@ class Achievement:
     target: Optional[int] = None
     unlocked_time: Optional[datetime] = None
 
-@dataclass
+@dataclass(frozen=True, slots=True)
 class PlayerAchievements:
     name: str
     locked: List[Achievement]
@@ -82,19 +83,43 @@ class PlayerAchievements:
         return "\n".join(lines)
 
 
+# Shown as plain rows, see Achievement. Nothing is loaded into the session for them.
+_UNLOCK_COUNTS = select(model.PlayerAchievement.achievement_id, func.count()).group_by(
+    model.PlayerAchievement.achievement_id
+)
+
+_unlocks = aliased(model.PlayerAchievement)
+_UNLOCKED = (
+    select(
+        model.Achievement.name,
+        model.Achievement.points,
+        model.Achievement.description,
+        model.PlayerAchievement.unlocked_at,
+        select(func.count())
+        .where(_unlocks.achievement_id == model.Achievement.achievement_id)
+        .scalar_subquery()
+        .label("unlocked_count"),
+    )
+    .join(model.Achievement, model.Achievement.achievement_id == model.PlayerAchievement.achievement_id)
+    .where(model.PlayerAchievement.player_id == bindparam("player_id"))
+)
+
+
 class AchievementsLogic:
     """Logic around achievements."""
 
     def __init__(self, engine: Engine) -> None:
         self.engine = engine
         self.checker = AchievementChecker(engine)
-        with Session(engine) as session:
+        with database.session(engine) as session:
             ps = session.scalars(select(game_model.Player))
             for p in ps:
                 self.achievements(p.player_id, p.name)
 
 
-    def update_achievements_and_obtain_locked(self, session: Session, all_ach: Sequence[model.Achievement], player_id: int) -> List[Achievement]:
+    def update_achievements_and_obtain_locked(
+        self, session: Session, all_ach: Sequence[model.Achievement], player_id: int, unlock_counts: Dict[str, int]
+    ) -> List[Achievement]:
         locked = []
         for ach in all_ach:
             match(self.checker.check(ach, player_id)):
@@ -114,7 +139,7 @@ class AchievementsLogic:
                             points = ach.points,
                             current = current,
                             target = target,
-                            unlocked_count = len(ach.player_unlocks),
+                            unlocked_count = unlock_counts.get(ach.achievement_id, 0),
                             description = ach.description,
                         ))
         session.flush()
@@ -126,7 +151,7 @@ class AchievementsLogic:
     def achievements(self, player_id: int, player_name) -> Result[PlayerAchievements]:
         """Return a human-readable list of unlocked and locked achievements for player_id."""
         try:
-            with Session(self.engine) as session:
+            with database.session(self.engine) as session:
                 sq = select(model.PlayerAchievement).filter_by(player_id=player_id)
                 subquery = sq.subquery()
                 locked_achievements = session.scalars(
@@ -139,20 +164,19 @@ class AchievementsLogic:
                     
                 ).all()
 
-                locked = self.update_achievements_and_obtain_locked(session, locked_achievements, player_id)
-                pa = session.scalars(
-                    sq
-                ).all()
-                unlocked = []
-                for p in pa:
-                    ach = p.achievement
-                    unlocked.append(Achievement(
-                        name = ach.name,
-                        points = ach.points,
-                        description = ach.description,
-                        unlocked_time=p.unlocked_at,
-                        unlocked_count = len(ach.player_unlocks),
-                    ))
+                # Locked achievements are not this player's, so checking them below doesn't change their counts.
+                unlock_counts = dict(session.execute(_UNLOCK_COUNTS).tuples().all())
+                locked = self.update_achievements_and_obtain_locked(session, locked_achievements, player_id, unlock_counts)
+                unlocked = [
+                    Achievement(
+                        name = row.name,
+                        points = row.points,
+                        description = row.description,
+                        unlocked_time=row.unlocked_at,
+                        unlocked_count = row.unlocked_count,
+                    )
+                    for row in session.execute(_UNLOCKED, {"player_id": player_id})
+                ]
 
                 player = session.get(game_model.Player, player_id)
                 if not player:
@@ -170,7 +194,7 @@ class AchievementsLogic:
             return Err("Something went wrong.")
 
     def player_id_from_name(self, name: str) -> Optional[int]:
-        with Session(self.engine) as session:
+        with database.session(self.engine) as session:
             return session.scalar(
                 select(game_model.Player.player_id).filter_by(name=name)
             )
\ No newline at end of file
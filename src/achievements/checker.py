@@ -9,6 +9,7 @@ from sqlalchemy.orm import Session
 from . import model as achievements_model
 from ..rating import model as rating_model
 from ..game import model as game_model
+from .. import database
 from ..typing import *
 from .achievementtype import *
 from .rules import head_to_head, finish, player as player_rule
@@ -38,7 +39,7 @@ class AchievementChecker:
         """Evaluate whether `player_id` satisfies `achievement`'s rule_json.
         """
         try:
-            with Session(self.engine) as session:
+            with database.session(self.engine) as session:
                 if self._is_unlocked(session, achievement.achievement_id, player_id):
                     return Unlocked()
 
@@ -5,30 +5,37 @@ from . import achievementslogic
 from . import listener as achievements_listener
 
 from discord.ext import commands
-from sqlalchemy import Engine
+from .. import outbox
+from ..shards import Shard, ShardRouter
 
-from typing import Optional
+from typing import Optional, Tuple
 from ..typing import *
 
 
 class Achievements(commands.Cog):
     """Cog containing achievement related commands."""
 
-    def __init__(self, engine: Engine) -> None:
-        self.engine = engine
-        self.logic = achievementslogic.AchievementsLogic(engine)
-        try:
-            achievements_listener.register(engine)
-        except Exception:
-            logging.exception("Failed to register achievements listener")
+    def __init__(self, shards: ShardRouter) -> None:
+        self.shards = shards
+        shards.subscribers.subscribe(outbox.GAME_FINISHED, "achievements", achievements_listener.on_game_finished)
+
+    @staticmethod
+    def _open(shard: Shard) -> achievementslogic.AchievementsLogic:
+        # Load achievement definitions from JSON files and then reconcile counters
+        achievements_listener.load_achievements(shard.engine)
+        achievements_listener.reconcile(shard.engine)
+        return achievementslogic.AchievementsLogic(shard.engine)
+
+    async def __logic(self, ctx: commands.Context) -> Tuple[Shard, achievementslogic.AchievementsLogic]:
+        shard = await self.shards.shard(ctx.guild)
+        return shard, await shard.service("achievements", self._open)
 
     @commands.Cog.listener()
     async def on_ready(self) -> None:
         logging.info("Achievements cog loaded")
-        # Load achievement definitions from JSON files and then reconcile counters
         try:
-            asyncio.create_task(asyncio.to_thread(achievements_listener.load_achievements, self.engine))
-            asyncio.create_task(asyncio.to_thread(achievements_listener.reconcile, self.engine))
+            for shard in await self.shards.shards():
+                asyncio.create_task(shard.service("achievements", self._open))
         except Exception:
             logging.exception("Failed to schedule achievements startup tasks")
 
@@ -36,15 +43,16 @@ class Achievements(commands.Cog):
     @commands.command()
     async def achievements(self, ctx: commands.Context, *, name_input: Optional[str]) -> None:
             """Type !achievements to view your achievements or !achievements {name} to view someone else's."""
+            shard, logic = await self.__logic(ctx)
             id, name = ctx.author.id, ctx.author.name
             if name_input:
-                id = self.logic.player_id_from_name(name_input)
+                id = await shard.database.run(logic.player_id_from_name, name_input)
                 if not id:
                     await ctx.send("Could not find that player")
                     return
                 
                 
-            match self.logic.achievements(id, name):
+            match await shard.database.write(logic.achievements, id, name):
                 case Ok(s):
                     await s.view_menu(ctx).start()
                 case Err(s):
@@ -1,81 +1,54 @@
 import logging
-from blinker import signal
 from sqlalchemy import select, func, delete
 from sqlalchemy.orm import Session
 from pathlib import Path
 import json
 
 from . import model as achievements_model
-from ..game import controller as game_controller
 from ..game import model as game_model
+from ..rating import model as rating_model
+from .. import database, outbox
 
 
-def register(engine) -> None:
-    """Connect to the game finish signal and update counters when a game finishes."""
+def sync_counters(engine, game_id: int) -> None:
+    """Bring the games_played, points_total and games_won counters of a game's players up to date.
 
-    def _on_finish(sender, game_id: int):
-        try:
-            with Session(engine) as session:
-                # Load finished game and determine winner
-                game = session.get(game_model.Game, game_id)
-                if not game:
-                    return
-                # Use controller to find winner
-                ctrl = game_controller.GameController()
-                try:
-                    winner = ctrl.winner(session, game)
-                except LookupError:
-                    return
-
-                # Increment or create games_won counter
-                counter_key = "games_won"
-                up = session.get(achievements_model.PlayerProgress, (winner.player_id, counter_key))
-                if up is None:
-                    up = achievements_model.PlayerProgress(player_id=winner.player_id, counter_key=counter_key, value=1)
-                    session.add(up)
-                else:
-                    up.value = (up.value or 0) + 1
-                    session.merge(up)
-
-                # Increment or create games_played counter
-                counter_key = "games_played"
-                for player in game.game_players:
-                    up = session.get(achievements_model.PlayerProgress, (player.player_id, counter_key))
-                    if up is None:
-                        up = achievements_model.PlayerProgress(player_id=player.player_id, counter_key=counter_key, value=1)
-                        session.add(up)
-                    else:
-                        up.value = (up.value or 0) + 1
-                        session.merge(up)
-
-                # Increment or create points_total counter
-                counter_key = "points_total"
-                for player in game.game_players:
-                    up = session.get(achievements_model.PlayerProgress, (player.player_id, counter_key))
-                    if up is None:
-                        up = achievements_model.PlayerProgress(player_id=player.player_id, counter_key=counter_key, value=player.points)
-                        session.add(up)
-                    else:
-                        up.value = (up.value or 0) + player.points
-                        session.merge(up)
-
-                # Commit the increment
-                session.commit()
-        except Exception as e:
-            logging.exception("Error handling game finish for achievements")
-
-    signal("finish").connect(_on_finish)
+    They are copied from the players' stats rather than incremented, so running this twice, as
+    at-least-once delivery may, changes nothing.
+    """
+    with database.session(engine) as session:
+        rows = session.execute(
+            select(
+                rating_model.PlayerStats.player_id,
+                rating_model.PlayerStats.games,
+                rating_model.PlayerStats.points,
+                rating_model.PlayerStats.wins,
+            ).where(
+                rating_model.PlayerStats.player_id.in_(
+                    select(game_model.GamePlayer.player_id).where(game_model.GamePlayer.game_id == game_id)
+                )
+            )
+        ).all()
+        for player_id, played, points, wins in rows:
+            for counter_key, value in (("games_played", played), ("points_total", points), ("games_won", wins)):
+                session.merge(achievements_model.PlayerProgress(
+                    player_id=player_id, counter_key=counter_key, value=int(value or 0),
+                ))
+        session.commit()
+
+
+async def on_game_finished(db: database.Database, event: outbox.Event) -> None:
+    """Outbox handler for outbox.GAME_FINISHED."""
+    await db.write(sync_counters, db.engine, event.payload["game_id"])
 
 
 def reconcile_games(session: Session):
     stmt = (
         select(
-            game_model.GamePlayer.player_id,
-            func.count("*").label("played"),
-            func.sum(game_model.GamePlayer.points).label("points"),
-        ).group_by(game_model.GamePlayer.player_id)
-        .join(game_model.GamePlayer.game)
-        .where(game_model.Game.game_state==game_model.GameState.FINISHED)
+            rating_model.PlayerStats.player_id,
+            rating_model.PlayerStats.games.label("played"),
+            rating_model.PlayerStats.points,
+        ).where(rating_model.PlayerStats.games > 0)
     )
     rows = session.execute(stmt).all()
 
@@ -107,31 +80,10 @@ def reconcile_achievements(session: Session):
         session.add(up)
 
 def reconcile_wins(session: Session):
-    # Build subquery to find max points per finished game
-    sq = (
-        select(
-            game_model.GamePlayer.game_id,
-            func.max(game_model.GamePlayer.points).label("max_points"),
-        )
-        .group_by(game_model.GamePlayer.game_id)
-        .filter(
-            game_model.GamePlayer.game.has(
-                game_model.Game.game_state == game_model.GameState.FINISHED
-            )
-        )
-        .subquery()
-    )
-
-    # Count wins per player by joining with subquery where points == max_points
+    # Wins per player are maintained in player_stats
     stmt = (
-        select(game_model.GamePlayer.player_id, func.count("*").label("wins"))
-        .select_from(game_model.GamePlayer)
-        .join(
-            sq,
-            (sq.c.game_id == game_model.GamePlayer.game_id)
-            & (sq.c.max_points == game_model.GamePlayer.points),
-        )
-        .group_by(game_model.GamePlayer.player_id)
+        select(rating_model.PlayerStats.player_id, rating_model.PlayerStats.wins)
+        .where(rating_model.PlayerStats.wins > 0)
     )
 
     rows = session.execute(stmt).all()
@@ -153,7 +105,7 @@ def reconcile(engine) -> None:
     """
 
     try:
-        with Session(engine) as session:
+        with database.session(engine) as session:
             reconcile_games(session)
             reconcile_wins(session)
             reconcile_achievements(session)
@@ -189,7 +141,7 @@ def load_achievements(engine, dir_path: str | None = None) -> None:
             logging.info("No achievement JSON files found in %s", str(base))
             return
 
-        with Session(engine) as session:
+        with database.session(engine) as session:
             for fp in files:
                 try:
                     data = json.loads(fp.read_text(encoding="utf-8"))
@@ -1,7 +1,7 @@
 from __future__ import annotations
 from datetime import datetime
 
-from sqlalchemy import ForeignKey, DateTime, String, Integer, func, JSON, Boolean, DateTime, ForeignKey, UniqueConstraint
+from sqlalchemy import ForeignKey, DateTime, String, Integer, func, JSON, Boolean, DateTime, ForeignKey, UniqueConstraint, Index
 from sqlalchemy.orm import Mapped, relationship, mapped_column
 
 from .. import models
@@ -51,6 +51,11 @@ class PlayerAchievement(models.Base):
 
     achievement: Mapped[Achievement] = relationship(back_populates="player_unlocks")
 
+    __table_args__ = (
+        # Counting who else unlocked an achievement.
+        Index("ix_player_achievement_achievement", "achievement_id"),
+    )
+
 class PlayerProgress(models.Base):
     __tablename__ = "player_progress"
 
@@ -1,15 +1,61 @@
-from typing import Any, Dict
+import functools
+import json
+from typing import Any, Dict, Tuple, Union
 from datetime import datetime
 from sqlalchemy.orm import Session, aliased
 from ..achievementtype import *
 from ...game import model as game_model
-from sqlalchemy import select, func, and_
+from sqlalchemy import Select, bindparam, select, func, and_
+
+_PLAYER_ID_BY_NAME = select(game_model.Player.player_id).where(game_model.Player.name == bindparam("name"))
+
 
 def finish(session: Session, rule: Dict[str, Any], player_id: int) -> AchievementType:
     target = rule.get("target")
     if target is None:
         return "Invalid finish rule (missing target)"
 
+    built = _statement(json.dumps(rule, sort_keys=True))
+    if isinstance(built, str):
+        return built
+    stmt, names = built
+
+    # Players named by the rule are bound by id, see _statement.
+    params = {"player_id": player_id}
+    for i, name in enumerate(names):
+        other_player_id = session.scalar(_PLAYER_ID_BY_NAME, {"name": name})
+        if other_player_id is None:
+            return f"Player not found: {name}"
+        params[f"named_player_{i}"] = other_player_id
+
+    c = session.execute(stmt, params).one_or_none()
+    if not c:
+        return Locked(
+            current=0,
+            target=int(target),
+        )
+        
+    current = c.played
+    target = rule.get("target")
+    if current >= target:
+        return Achieved()
+
+    return Locked(
+        current=current,
+        target=target,
+    )
+
+
+@functools.lru_cache(maxsize=1024)
+def _statement(rule_json: str) -> Union[str, Tuple[Select, Tuple[str, ...]]]:
+    """The counting statement of a rule and the player names it binds, or why the rule is invalid.
+
+    The player being checked and the named players are bound parameters, so each rule is built
+    once and its statement object, cache key included, is reused for every check.
+    """
+    rule = json.loads(rule_json)
+    names = []
+
     stmt = (
         select(
             game_model.GamePlayer,
@@ -17,7 +63,7 @@ def finish(session: Session, rule: Dict[str, Any], player_id: int) -> Achievemen
         )
         .group_by(game_model.GamePlayer.player_id)
         .where(
-            game_model.GamePlayer.player_id == player_id,
+            game_model.GamePlayer.player_id == bindparam("player_id"),
             game_model.GamePlayer.game.has(
                 game_state=game_model.GameState.FINISHED
             )
@@ -103,29 +149,20 @@ def finish(session: Session, rule: Dict[str, Any], player_id: int) -> Achievemen
                     return "Unsupported role in against_faction filter"
 
                 gp_named = aliased(game_model.GamePlayer)
-                gp_cmp = aliased(game_model.GamePlayer)
 
                 if role == "winner":
-                    # primary GamePlayer must have fewer or equal points than named? No,
-                    # we require that the named player is the winner. So named player's
-                    # row has no other player with more points.
+                    # We require that the named player is the winner of the game.
                     role_clause = select(gp_named).where(
                         gp_named.game_id == game_model.GamePlayer.game_id,
                         gp_named.faction == faction_name,
-                        ~select(gp_cmp).where(
-                            gp_cmp.game_id == gp_named.game_id,
-                            gp_cmp.points > gp_named.points,
-                        ).exists(),
+                        gp_named.result.has(winner=True),
                         gp_named.player_id != game_model.GamePlayer.player_id,
                     ).exists()
                 elif role == "loser":
                     role_clause = select(gp_named).where(
                         gp_named.game_id == game_model.GamePlayer.game_id,
                         gp_named.faction == faction_name,
-                        ~select(gp_cmp).where(
-                            gp_cmp.game_id == gp_named.game_id,
-                            gp_cmp.points < gp_named.points,
-                        ).exists(),
+                        gp_named.result.has(loser=True),
                         gp_named.player_id != game_model.GamePlayer.player_id,
                     ).exists()
                 else:
@@ -148,11 +185,8 @@ def finish(session: Session, rule: Dict[str, Any], player_id: int) -> Achievemen
     if isinstance(filter_, dict) and "win_against" in filter_:
         f = filter_["win_against"]
         gp_op = aliased(game_model.GamePlayer)
-        # primary is winner: no other player in same game has more points
-        stmt = stmt.where(~select(gp_op).where(
-            gp_op.game_id == game_model.GamePlayer.game_id,
-            gp_op.points > game_model.GamePlayer.points,
-        ).exists())
+        # primary is winner
+        stmt = stmt.where(game_model.GamePlayer.result.has(winner=True))
 
         if isinstance(f, str):
             stmt = stmt.where(select(gp_op).where(
@@ -174,11 +208,8 @@ def finish(session: Session, rule: Dict[str, Any], player_id: int) -> Achievemen
     if isinstance(filter_, dict) and "lose_against" in filter_:
         f = filter_["lose_against"]
         gp_op = aliased(game_model.GamePlayer)
-        # primary is loser: no other player in same game has fewer points
-        stmt = stmt.where(~select(gp_op).where(
-            gp_op.game_id == game_model.GamePlayer.game_id,
-            gp_op.points < game_model.GamePlayer.points,
-        ).exists())
+        # primary is loser
+        stmt = stmt.where(game_model.GamePlayer.result.has(loser=True))
 
         if isinstance(f, str):
             stmt = stmt.where(select(gp_op).where(
@@ -199,71 +230,41 @@ def finish(session: Session, rule: Dict[str, Any], player_id: int) -> Achievemen
         f = filter_["player"]
         if isinstance(f, str):
             # Check if the player with filter_["player"] name is in the game as well
-            other_player = session.scalar(
-                select(game_model.Player).filter_by(name=f)
-            )
-            if not other_player:
-                return f"Player not found: {f}"
+            other_player_id = bindparam(f"named_player_{len(names)}")
+            names.append(f)
 
             gp_named = aliased(game_model.GamePlayer)
             # Require that the named player appears in the same game as the
             # primary GamePlayer row (i.e., they were in the game together).
             stmt = stmt.where(select(gp_named).where(
                 gp_named.game_id == game_model.GamePlayer.game_id,
-                gp_named.player_id == other_player.player_id,
+                gp_named.player_id == other_player_id,
             ).exists())
 
         elif isinstance(f, dict):
             for name, role in f.items():
-                other_player = session.scalar(
-                    select(game_model.Player).filter_by(name=name)
-                )
-                if not other_player:
-                    return f"Player not found: {name}"
+                other_player_id = bindparam(f"named_player_{len(names)}")
+                names.append(name)
 
-                gp_named = aliased(game_model.GamePlayer)
-                gp_cmp = aliased(game_model.GamePlayer)
+                result = aliased(game_model.GameResult)
 
                 if role == "winner":
-                    # Require that the named player's GamePlayer row in the same
-                    # game has no other player with more points (i.e. they finished first)
-                    stmt = stmt.where(select(gp_named).where(
-                        gp_named.game_id == game_model.GamePlayer.game_id,
-                        gp_named.player_id == other_player.player_id,
-                        ~select(gp_cmp).where(
-                            gp_cmp.game_id == gp_named.game_id,
-                            gp_cmp.points > gp_named.points,
-                        ).exists(),
+                    # Require that the named player finished first in the same game
+                    stmt = stmt.where(select(result).where(
+                        result.game_id == game_model.GamePlayer.game_id,
+                        result.player_id == other_player_id,
+                        result.winner.is_(True),
                     ).exists())
                 elif role == "loser":
-                    # Require that the named player's GamePlayer row in the same
-                    # game has no other player with fewer points (i.e. they finished last)
-                    stmt = stmt.where(select(gp_named).where(
-                        gp_named.game_id == game_model.GamePlayer.game_id,
-                        gp_named.player_id == other_player.player_id,
-                        ~select(gp_cmp).where(
-                            gp_cmp.game_id == gp_named.game_id,
-                            gp_cmp.points < gp_named.points,
-                        ).exists(),
+                    # Require that the named player finished last in the same game
+                    stmt = stmt.where(select(result).where(
+                        result.game_id == game_model.GamePlayer.game_id,
+                        result.player_id == other_player_id,
+                        result.loser.is_(True),
                     ).exists())
                 else:
                     return "Unsupported player role"
         else:
             return "Invalid player filter"
 
-    c = session.execute(stmt).one_or_none()
-    if not c:
-        return Locked(
-            current=0,
-            target=int(target),
-        )
-        
-    current = c.played
-    target = rule.get("target")
-    if current >= target:
-        return Achieved()
-
-    return Locked(
-        current=current,
-        target=target,
-    )
\ No newline at end of file
+    return stmt, tuple(names)
@@ -2,9 +2,18 @@ from typing import Any, Dict
 from sqlalchemy.orm import Session
 from ..achievementtype import *
 from ...game import model as game_model
-from sqlalchemy import select
+from sqlalchemy import bindparam, func, select
 from ...rating import model as rating_model
 
+_PLAYER_ID_BY_NAME = select(game_model.Player.player_id).where(game_model.Player.name == bindparam("name"))
+_HAS_MATCH_PLAYER = select(rating_model.MatchPlayer.player_id).where(
+    rating_model.MatchPlayer.player_id == bindparam("player_id")
+)
+_WINS_AGAINST = select(func.count()).select_from(rating_model.WinnerHeadToHead).where(
+    rating_model.WinnerHeadToHead.winner_id == bindparam("winner_id"),
+    rating_model.WinnerHeadToHead.loser_id == bindparam("loser_id"),
+)
+
 def head_to_head(session: Session, rule: Dict[str, Any], player_id: int) -> AchievementType:
     # rule expects: opponent_name (str) and target (int)
     opponent_name = rule.get("opponent_name")
@@ -13,25 +22,18 @@ def head_to_head(session: Session, rule: Dict[str, Any], player_id: int) -> Achi
         return "Invalid head_to_head rule (missing opponent_name or target)"
 
     # Resolve opponent player_id via game Player table
-    opponent_player = session.scalar(
-        select(game_model.Player).filter_by(name=opponent_name)
-    )
-    if not opponent_player:
+    opponent_id = session.scalar(_PLAYER_ID_BY_NAME, {"name": opponent_name})
+    if opponent_id is None:
         return f"Opponent not found: {opponent_name}"
 
     # Map to MatchPlayer id (MatchPlayer.player_id references player.player_id)
-    opponent_mp = session.scalar(
-        select(rating_model.MatchPlayer).filter_by(player_id=opponent_player.player_id)
-    )
-    if not opponent_mp:
+    opponent_mp_id = session.scalar(_HAS_MATCH_PLAYER, {"player_id": opponent_id})
+    if opponent_mp_id is None:
         # No match_player entry -> zero wins against them
         current = 0
     else:
         # Count WinnerHeadToHead rows where winner_id == player_id and loser_id == opponent_mp.player_id
-        cnt = session.execute(
-            select(rating_model.WinnerHeadToHead).filter_by(winner_id=player_id, loser_id=opponent_mp.player_id)
-        ).all()
-        current = len(cnt)
+        current = session.scalar(_WINS_AGAINST, {"winner_id": player_id, "loser_id": opponent_mp_id})
 
     if int(current) >= int(target):
         return Achieved()
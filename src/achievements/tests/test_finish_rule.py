@@ -0,0 +1,68 @@
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from src import database
+from src.achievements.achievementtype import Achieved, Locked
+from src.achievements.rules import finish
+from src.game import model as game_model
+from src.game.controller import GameController
+from src.models import Base
+
+
+@pytest.fixture(scope="function")
+def session():
+    engine = create_engine("sqlite:///:memory:")
+    Base.metadata.create_all(engine)
+    session = sessionmaker(bind=engine)()
+    for player_id, name in [(1, "Alice"), (2, "Jake"), (3, "Carl")]:
+        session.add(game_model.Player(player_id=player_id, name=name))
+
+    game = game_model.Game(game_id=1, game_state=game_model.GameState.FINISHED, name="G1")
+    session.add(game)
+    for player_id, faction, points in [(1, "The Winnu", 10), (2, "The Yin Brotherhood", 3), (3, "The Xxcha Kingdom", 6)]:
+        session.add(game_model.GamePlayer(game_id=1, player_id=player_id, faction=faction, points=points))
+    session.flush()
+    GameController().record_result(session, game)
+    session.commit()
+    yield session
+    session.close()
+
+
+def test_win_against(session):
+    rule = {"type": "finish", "filter": {"win_against": "The Yin Brotherhood"}, "target": 1}
+    assert isinstance(finish(session, rule, 1), Achieved)
+    assert isinstance(finish(session, rule, 3), Locked)
+
+
+def test_lose_against(session):
+    rule = {"type": "finish", "filter": {"lose_against": "The Winnu"}, "target": 1}
+    assert isinstance(finish(session, rule, 2), Achieved)
+    assert isinstance(finish(session, rule, 3), Locked)
+
+
+def test_named_player_roles(session):
+    rule = {"type": "finish", "filter": {"player": {"Jake": "loser"}}, "target": 1}
+    assert isinstance(finish(session, rule, 3), Achieved)
+    rule = {"type": "finish", "filter": {"player": {"Jake": "winner"}}, "target": 1}
+    assert isinstance(finish(session, rule, 3), Locked)
+
+
+def test_against_faction_roles(session):
+    rule = {"type": "finish", "filter": {"against_faction": {"The Winnu": "winner"}}, "target": 1}
+    assert isinstance(finish(session, rule, 2), Achieved)
+    rule = {"type": "finish", "filter": {"against_faction": {"The Xxcha Kingdom": "loser"}}, "target": 1}
+    assert isinstance(finish(session, rule, 1), Locked)
+
+
+def test_checks_reuse_the_compiled_statement(session):
+    database.instrument(session.get_bind())
+    rule = {"type": "finish", "filter": {"win_against": ["The Yin Brotherhood"], "player": "Carl"}, "target": 1}
+    assert isinstance(finish(session, rule, 1), Achieved)
+
+    # Other players, and the other player named in the rule, are bound parameters.
+    with database.count_statements("achievements") as stats:
+        assert isinstance(finish(session, rule, 2), Locked)
+        assert finish(session, {**rule, "filter": {**rule["filter"], "player": "Nobody"}}, 1) == "Player not found: Nobody"
+        assert isinstance(finish(session, rule, 1), Achieved)
+    assert stats.cache_misses == 0
+    assert stats.cache_hits == stats.statements == 5
@@ -1,6 +1,9 @@
 import logging
 from . import model as betting_model
 from ..game import model as game_model
+from ..game import controller as game_controller
+from ..game import loading
+from .. import database
 
 from sqlalchemy.orm import Session
 from sqlalchemy import Engine, select
@@ -13,6 +16,7 @@ class BettingLogic:
 
     def __init__(self, engine: Engine) -> None:
         self.engine = engine
+        self.controller = game_controller.GameController()
 
     @staticmethod
     def _balance(session: Session, bettor: betting_model.Bettor) -> int:
@@ -26,7 +30,7 @@ class BettingLogic:
     def balance(self, id: int, name) -> str:
         """Returns bettor's current balance."""
         try:
-            with Session(self.engine) as session:
+            with database.session(self.engine) as session:
                 bettor = session.get(betting_model.Bettor, id)
                 if not bettor:
                     player = session.get(game_model.Player, id)
@@ -45,8 +49,8 @@ class BettingLogic:
 
     def payout(self, game_id: int) -> str:
         try:
-            with Session(self.engine) as session:
-                game = session.get(game_model.Game, game_id)
+            with database.session(self.engine) as session:
+                game = session.get(game_model.Game, game_id, options=loading.standings())
                 if not game:
                     return "Game not found."
                 if game.game_state != game_model.GameState.FINISHED:
@@ -54,20 +58,16 @@ class BettingLogic:
 
                 stmt = select(betting_model.GameBet).filter_by(game_id=game.game_id)
                 bets = session.scalars(stmt).all()
-                winner = (
-                    session.query(game_model.GamePlayer)
-                    .with_parent(game)
-                    .order_by(game_model.GamePlayer.points.desc())
-                    .first()
-                )
                 if not bets:
                     return "No bets placed"
-                if winner is None:
+                try:
+                    winner = self.controller.winner(session, game)
+                except LookupError:
                     return "Something went wrong"
                 lines = []
                 for game_bet in bets:
+                    bettor = game_bet.bettor
                     if game_bet.winner == winner.player_id:
-                        bettor = game_bet.bettor
                         bettor.balance += game_bet.bet
                         lines.append(f"{bettor.player.name} won {game_bet.bet} Jake coins!")
                     else:
@@ -92,7 +92,7 @@ class BettingLogic:
         name: str,
     ) -> str:
         """Places a bet on game_id, for bet amount on player id."""
-        with Session(self.engine) as session:
+        with database.session(self.engine) as session:
             bettor = session.get(betting_model.Bettor, id)
             if not bettor:
                 player = session.get(game_model.Player, id)
@@ -3,16 +3,20 @@ import logging
 from . import bettinglogic
 
 from discord.ext import commands
-from sqlalchemy import Engine
+from ..shards import Shard, ShardRouter
 
-from typing import Optional
+from typing import Optional, Tuple
 
 
 class Betting(commands.Cog):
     """Cog containing betting related commands."""
 
-    def __init__(self, engine: Engine) -> None:
-        self.logic = bettinglogic.BettingLogic(engine)
+    def __init__(self, shards: ShardRouter) -> None:
+        self.shards = shards
+
+    async def __logic(self, ctx: commands.Context) -> Tuple[Shard, bettinglogic.BettingLogic]:
+        shard = await self.shards.shard(ctx.guild)
+        return shard, await shard.service("betting", lambda shard: bettinglogic.BettingLogic(shard.engine))
 
     @commands.Cog.listener()
     async def on_ready(self) -> None:
@@ -21,19 +25,22 @@ class Betting(commands.Cog):
     @commands.command()
     async def balance(self, ctx: commands.Context) -> None:
         """Returns bettor's current balance."""
-        await ctx.send(self.logic.balance(ctx.author.id, ctx.author.name))
+        shard, logic = await self.__logic(ctx)
+        await ctx.send(await shard.database.write(logic.balance, ctx.author.id, ctx.author.name))
 
     @commands.command()
     async def payout(self, ctx: commands.Context) -> None:
-        await ctx.send(self.logic.payout(ctx.channel.id))
+        shard, logic = await self.__logic(ctx)
+        await ctx.send(await shard.database.write(logic.payout, ctx.channel.id))
 
     @commands.command()
     async def bet(
         self, ctx: commands.Context, bet_amount: Optional[int], winner: Optional[str]
     ) -> None:
         """Places a bet for bet amount on player. Usage !bet {amount} {player}"""
+        shard, logic = await self.__logic(ctx)
         await ctx.send(
-            self.logic.bet(
-                ctx.channel.id, bet_amount, winner, ctx.author.id, ctx.author.name
+            await shard.database.write(
+                logic.bet, ctx.channel.id, bet_amount, winner, ctx.author.id, ctx.author.name
             )
         )
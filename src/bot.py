@@ -1,7 +1,10 @@
 import discord
 import asyncio
+import logging
 import Levenshtein
 
+from typing import List, Optional
+
 from .game.commands import Game
 from .misc.commands import Misc
 from .rating.commands import Rating
@@ -9,34 +12,61 @@ from .betting.commands import Betting
 from .achievements.commands import Achievements
 
 from discord.ext import commands
-from sqlalchemy import create_engine
-from . import models
-
-from sqlalchemy.engine import Engine
-from sqlalchemy import event
-
-
-@event.listens_for(Engine, "connect")
-def set_sqlite_pragma(dbapi_connection, connection_record):
-    cursor = dbapi_connection.cursor()
-    cursor.execute("PRAGMA foreign_keys=ON")
-    cursor.execute("PRAGMA journal_mode=WAL")
-    cursor.close()
+from . import compute, database, metrics, storage, watchdog
+from .shards import ShardRouter
 
 
 class Bot(commands.Bot):
-    def __init__(self, intents: discord.Intents) -> None:
-        engine = create_engine("sqlite:///app.db", connect_args={"timeout": 15})
+    def __init__(self, intents: discord.Intents, storage_config: Optional[storage.StorageConfig] = None) -> None:
+        # Pass the guild databases to cogs that need them. Each shard creates its tables when first opened.
+        self.databases = ShardRouter.from_env(storage_config or storage.from_env())
+        # Worker processes for the CPU-heavy jobs, started when the first one runs.
+        self.compute = compute.ComputeService.from_env()
+        # Logs what blocked the event loop, see watchdog.LoopWatchdog.
+        self.watchdog = watchdog.LoopWatchdog.from_env()
+        self.metrics = metrics.MetricsRegistry()
+        self.metrics.collect(self._runtime_metrics)
+        self.metrics_exporter = metrics.MetricsExporter.from_env(self.metrics)
+        self.init_cogs = [
+            Game(self, self.databases),
+            Misc(self.metrics, self.watchdog),
+            Betting(self.databases),
+            Rating(self.databases, self.compute),
+            Achievements(self.databases),
+        ]
+
+        super().__init__(command_prefix="!", intents=intents)
+        self.before_invoke(self.metrics.before_invoke)
+        self.after_invoke(self.metrics.after_invoke)
 
-        # Instantiate all the tables.
-        models.Base.metadata.create_all(engine)
+    def _runtime_metrics(self) -> List[str]:
+        lines = metrics.family_lines("ti4_loop_lag_seconds", "histogram", "How late the event loop ran the watchdog's wake-ups.")
+        lines += metrics.histogram_lines("ti4_loop_lag_seconds", {}, self.watchdog.histogram)
+        lines += metrics.family_lines("ti4_loop_stalls_total", "counter", "Times the event loop was blocked past the watchdog's threshold.")
+        lines.append(metrics.sample_line("ti4_loop_stalls_total", {}, self.watchdog.stalls))
 
-        # Pass engine to cogs that need it.
-        self.init_cogs = [Game(self, engine), Misc(), Betting(engine), Rating(engine), Achievements(engine)]
+        shards = self.databases.opened()
+        for name, kind, help, value in [
+            ("ti4_outbox_lag_seconds", "gauge", "Age of the oldest undelivered outbox event.", lambda stats: stats.lag_seconds),
+            ("ti4_outbox_delivered_total", "counter", "Outbox events delivered to every handler.", lambda stats: stats.delivered),
+            ("ti4_outbox_failed_total", "counter", "Outbox events that ran out of attempts.", lambda stats: stats.failed),
+        ]:
+            lines += metrics.family_lines(name, kind, help)
+            for shard in shards:
+                lines.append(metrics.sample_line(name, {"guild": str(shard.guild_id or "shared")}, value(shard.outbox.stats)))
 
-        super().__init__(command_prefix="!", intents=intents)
+        for name, kind, help, value in [
+            ("ti4_compute_runs_total", "counter", "Compute tasks run in a worker process.", lambda stats: stats.runs),
+            ("ti4_compute_seconds_total", "counter", "Time compute tasks ran in a worker process.", lambda stats: stats.seconds),
+            ("ti4_compute_queued_seconds_total", "counter", "Time compute tasks waited for a worker process.", lambda stats: stats.queued_seconds),
+        ]:
+            lines += metrics.family_lines(name, kind, help)
+            for task, stats in sorted(self.compute.stats.items()):
+                lines.append(metrics.sample_line(name, {"task": task}, value(stats)))
+        return lines
 
     async def on_command_error(self, ctx: commands.Context, error: Exception) -> None:
+        self.metrics.rejected(ctx)
         similarity = max([(command.name, Levenshtein.ratio(ctx.message.content, command.name)) for command in self.commands], key = lambda x: x[1])[0]
 
         if isinstance(error, commands.CommandNotFound):
@@ -46,5 +76,34 @@ class Bot(commands.Bot):
                 color=discord.Color.red()
             ))
 
+    async def invoke(self, ctx: commands.Context) -> None:
+        if ctx.command is None:
+            return await super().invoke(ctx)
+
+        with database.count_statements(ctx.command.qualified_name) as stats:
+            try:
+                await super().invoke(ctx)
+            finally:
+                logging.info(
+                    "!%s: %d statement(s), %.1f ms in the database, %.0f%% compiled cache hits",
+                    stats.command, stats.statements, stats.seconds * 1000, stats.cache_hit_rate * 100,
+                )
+
+    async def close(self) -> None:
+        self.watchdog.stop()
+        if self.metrics_exporter is not None:
+            self.metrics_exporter.stop()
+        await super().close()
+        self.databases.close()
+        self.compute.close()
+
     async def setup_hook(self) -> None:
+        # Instantiate all the tables of the shared database.
+        await self.databases.shard(None)
         await asyncio.gather(*(self.add_cog(cog) for cog in self.init_cogs))
+        # The cogs have subscribed their outbox handlers.
+        self.databases.start()
+        self.watchdog.start()
+        self.metrics.instrument_http(self.http)
+        if self.metrics_exporter is not None:
+            self.metrics_exporter.start()
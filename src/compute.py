@@ -0,0 +1,97 @@
+import asyncio
+import logging
+import multiprocessing
+import os
+import time
+
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, Generic, Mapping, Optional, Tuple, TypeVar
+
+T = TypeVar("T")
+
+# Number of worker processes. The jobs are occasional, so a couple is enough.
+WORKERS_ENV = "TI4_COMPUTE_WORKERS"
+DEFAULT_WORKERS = 2
+
+
+@dataclass(frozen=True)
+class Task(Generic[T]):
+    """A CPU-bound job that can run in a worker process.
+
+    fn must be a module-level function, and its arguments and result plain data (tuples, dicts,
+    dataclasses), as they are pickled across the process boundary. It doesn't get a database:
+    read what it needs before, and commit what it returns after, from the bot's process.
+    """
+
+    name: str
+    fn: Callable[..., T]
+
+
+@dataclass
+class TaskStats:
+    runs: int = 0
+    failed: int = 0
+    # Timed out or cancelled by the caller.
+    cancelled: int = 0
+    # Time spent running in a worker, and waiting for one.
+    seconds: float = 0.0
+    queued_seconds: float = 0.0
+    max_seconds: float = 0.0
+
+
+def _timed(fn: Callable[..., T], args: Tuple[Any, ...]) -> Tuple[T, float]:
+    # Runs in the worker.
+    started = time.perf_counter()
+    result = fn(*args)
+    return result, time.perf_counter() - started
+
+
+class ComputeService:
+    """Runs Tasks on a pool of worker processes, so long Python loops don't hold the event loop's GIL.
+
+    The pool is started on first use. Cancelling a call, or its timeout, drops a task that hasn't
+    started yet; one already running finishes in its worker and the result is thrown away.
+    """
+
+    def __init__(self, workers: int = DEFAULT_WORKERS) -> None:
+        self.workers = workers
+        self.stats: Dict[str, TaskStats] = {}
+        self._pool: Optional[ProcessPoolExecutor] = None
+
+    @classmethod
+    def from_env(cls, env: Mapping[str, str] = os.environ) -> "ComputeService":
+        return cls(int(env.get(WORKERS_ENV, DEFAULT_WORKERS)))
+
+    async def run(self, task: Task[T], *args: Any, timeout: Optional[float] = None) -> T:
+        """Run task.fn(*args) in a worker and return its result."""
+        stats = self.stats.setdefault(task.name, TaskStats())
+        submitted = time.perf_counter()
+        future = asyncio.wrap_future(self._executor().submit(_timed, task.fn, args))
+        try:
+            result, seconds = await asyncio.wait_for(future, timeout)
+        except (asyncio.CancelledError, TimeoutError):
+            stats.cancelled += 1
+            raise
+        except Exception:
+            stats.failed += 1
+            raise
+
+        queued = time.perf_counter() - submitted - seconds
+        stats.runs += 1
+        stats.seconds += seconds
+        stats.queued_seconds += queued
+        stats.max_seconds = max(stats.max_seconds, seconds)
+        logging.info("compute %s: %.1f ms, %.1f ms waiting for a worker", task.name, seconds * 1000, queued * 1000)
+        return result
+
+    def close(self) -> None:
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+    def _executor(self) -> ProcessPoolExecutor:
+        if self._pool is None:
+            # Not forked: the bot's process has database and event loop threads a fork would copy mid-flight.
+            self._pool = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context("spawn"))
+        return self._pool
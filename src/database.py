@@ -0,0 +1,318 @@
+import asyncio
+import contextlib
+import contextvars
+import functools
+import logging
+import queue
+import threading
+import time
+
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass, field
+from sqlalchemy import Connection, Engine, event
+from sqlalchemy.engine.interfaces import CacheStats
+from sqlalchemy.orm import Session
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple, TypeVar
+
+T = TypeVar("T")
+
+# Connection of the writer thread while it runs a write job.
+_writer_connection: contextvars.ContextVar[Optional[Connection]] = contextvars.ContextVar(
+    "writer_connection", default=None
+)
+
+
+
+@dataclass
+class StatementStats:
+    """Statements one command issued and the time they took, over every thread it used."""
+
+    command: str
+    statements: int = 0
+    seconds: float = 0.0
+    # Statements whose SQL came from the engine's compiled cache, and the ones that had to be compiled.
+    cache_hits: int = 0
+    cache_misses: int = 0
+    _lock: threading.Lock = field(default_factory=threading.Lock, repr=False, compare=False)
+
+    def add(self, seconds: float, cache: Optional[CacheStats] = None) -> None:
+        with self._lock:
+            self.statements += 1
+            self.seconds += seconds
+            if cache == CacheStats.CACHE_HIT:
+                self.cache_hits += 1
+            elif cache == CacheStats.CACHE_MISS:
+                self.cache_misses += 1
+
+    @property
+    def cache_hit_rate(self) -> float:
+        """Share of the cacheable statements that skipped compilation. 1.0 when there were none."""
+        cacheable = self.cache_hits + self.cache_misses
+        return self.cache_hits / cacheable if cacheable else 1.0
+
+
+# Stats of the command that is running. Copied into database workers and write jobs along with the rest of the context.
+_statement_stats: contextvars.ContextVar[Optional[StatementStats]] = contextvars.ContextVar(
+    "statement_stats", default=None
+)
+
+
+@contextlib.contextmanager
+def count_statements(command: str) -> Iterator[StatementStats]:
+    """Count the statements issued on instrumented engines until the block exits."""
+    stats = StatementStats(command)
+    token = _statement_stats.set(stats)
+    try:
+        yield stats
+    finally:
+        _statement_stats.reset(token)
+
+
+def current_statements() -> Optional[StatementStats]:
+    """The stats of the count_statements block this runs in, if any."""
+    return _statement_stats.get()
+
+
+def instrument(engine: Engine) -> None:
+    """Attribute the statements executed on engine to the running command, see count_statements."""
+    if not event.contains(engine, "before_cursor_execute", _before_cursor_execute):
+        event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+        event.listen(engine, "after_cursor_execute", _after_cursor_execute)
+
+
+def _before_cursor_execute(connection, cursor, statement, parameters, context, executemany) -> None:
+    # Kept on the execution rather than the connection, so a statement that raises leaves nothing behind.
+    context._statement_start = time.perf_counter()
+
+
+def _after_cursor_execute(connection, cursor, statement, parameters, context, executemany) -> None:
+    stats = _statement_stats.get()
+    if stats is not None:
+        stats.add(time.perf_counter() - context._statement_start, context.cache_hit)
+
+
+# Set while a function runs on a database worker through Database.run.
+_reading: contextvars.ContextVar[bool] = contextvars.ContextVar("reading", default=False)
+
+# Read-only engines on the same database file, by the engine they read for. See Database.
+_read_engines: Dict[Engine, Engine] = {}
+
+
+# The session of the outermost logic call running in this context, shared with the calls nested in it.
+_unit_of_work: contextvars.ContextVar[Optional[Tuple[Engine, Session]]] = contextvars.ContextVar(
+    "unit_of_work", default=None
+)
+
+
+@contextlib.contextmanager
+def session(engine: Engine, read_only: Optional[bool] = None) -> Iterator[Session]:
+    """Session for logic code. Inside a write job it joins the writer's transaction.
+
+    Commits inside a write job only release a savepoint; the writer commits the whole batch.
+    Reads started through Database.run, or with read_only=True, go to the engine's read-only
+    engine when it has one.
+
+    The first session opened for an engine is the unit of work: logic calls nested in it get the
+    same session, so a command checks out one connection and loads each row once. Only the
+    outermost block closes it. An exception leaving a nested block rolls the unit back, so a
+    caller that retries starts from fresh state.
+    """
+    current = _unit_of_work.get()
+    if current is not None and current[0] is engine:
+        shared = current[1]
+        try:
+            yield shared
+        except Exception:
+            shared.rollback()
+            raise
+        return
+
+    with _new_session(engine, read_only) as new:
+        token = _unit_of_work.set((engine, new))
+        try:
+            yield new
+        finally:
+            _unit_of_work.reset(token)
+
+
+def _new_session(engine: Engine, read_only: Optional[bool]) -> Session:
+    connection = _writer_connection.get()
+    if connection is not None and connection.engine is engine:
+        return Session(bind=connection, join_transaction_mode="create_savepoint")
+    if read_only if read_only is not None else _reading.get():
+        engine = _read_engines.get(engine, engine)
+    return Session(engine)
+
+
+@dataclass
+class _WriteJob:
+    fn: Callable[[], Any]
+    context: contextvars.Context
+    future: Future = field(default_factory=Future)
+
+
+class Writer:
+    """The one thread that writes to the database.
+
+    Jobs queued while a batch is running are committed together in the next batch.
+    Each job runs in its own savepoint, so a failing job doesn't take the rest of its batch down,
+    and in its own unit of work (see session).
+    Futures are resolved once the batch is committed.
+    """
+
+    _STOP = object()
+
+    def __init__(
+        self,
+        engine: Engine,
+        max_batch: int = 32,
+        rollback_hooks: Optional[List[Callable[[], None]]] = None,
+        commit_hooks: Optional[List[Callable[[], None]]] = None,
+    ) -> None:
+        self.engine = engine
+        self.max_batch = max_batch
+        # Called when a batch fails to commit, e.g. to drop caches that saw its uncommitted state.
+        self.rollback_hooks = rollback_hooks if rollback_hooks is not None else []
+        # Called once a batch is committed, before its futures are resolved. A job's own commit
+        # only releases its savepoint, so this is when other connections first see its writes.
+        self.commit_hooks = commit_hooks if commit_hooks is not None else []
+        self._queue: queue.SimpleQueue = queue.SimpleQueue()
+        self._thread = threading.Thread(target=self._loop, name="db-writer", daemon=True)
+        self._thread.start()
+
+    def submit(self, fn: Callable[..., T], *args, **kwargs) -> "Future[T]":
+        job = _WriteJob(functools.partial(fn, *args, **kwargs), contextvars.copy_context())
+        self._queue.put(job)
+        return job.future
+
+    def stop(self) -> None:
+        self._queue.put(self._STOP)
+        self._thread.join()
+
+    def _next_batch(self) -> Optional[List[_WriteJob]]:
+        job = self._queue.get()
+        if job is self._STOP:
+            return None
+        batch = [job]
+        while len(batch) < self.max_batch:
+            try:
+                job = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if job is self._STOP:
+                self._queue.put(job)
+                break
+            batch.append(job)
+        return batch
+
+    def _loop(self) -> None:
+        while (batch := self._next_batch()) is not None:
+            self._commit_batch(batch)
+
+    def _commit_batch(self, batch: List[_WriteJob]) -> None:
+        # Skip the jobs cancelled while queued, e.g. by a task stopped at shutdown. The rest can no longer be.
+        batch = [job for job in batch if job.future.set_running_or_notify_cancel()]
+        if not batch:
+            return
+        outcomes = []
+        try:
+            with self.engine.connect() as connection, connection.begin():
+                for job in batch:
+                    outcomes.append(self._run_job(connection, job))
+        except Exception as e:
+            logging.exception("Write batch of %d job(s) failed to commit", len(batch))
+            for hook in self.rollback_hooks:
+                hook()
+            for job in batch:
+                job.future.set_exception(e)
+            return
+
+        for hook in self.commit_hooks:
+            try:
+                hook()
+            except Exception:
+                logging.exception("Commit hook %s failed", hook)
+        for job, (ok, value) in zip(batch, outcomes):
+            if ok:
+                job.future.set_result(value)
+            else:
+                job.future.set_exception(value)
+
+    def _run_job(self, connection: Connection, job: _WriteJob):
+        def call():
+            token = _writer_connection.set(connection)
+            try:
+                with session(self.engine):
+                    return job.fn()
+            finally:
+                _writer_connection.reset(token)
+
+        savepoint = connection.begin_nested()
+        try:
+            value = job.context.run(call)
+        except Exception as e:
+            savepoint.rollback()
+            return False, e
+        savepoint.commit()
+        return True, value
+
+
+class Database:
+    """Runs blocking database work off the event loop so it is never blocked on I/O.
+
+    Reads run on a bounded thread pool with their own pooled connections, from read_engine if
+    given: a query_only engine on the same file, so under WAL they never wait on the writer.
+    Writes are queued to the single writer thread.
+    Logic classes stay synchronous. Cogs await them through `run` or `write`.
+    """
+
+    def __init__(self, engine: Engine, max_workers: int = 4, read_engine: Optional[Engine] = None) -> None:
+        self.engine = engine
+        self.read_engine = read_engine
+        if read_engine is not None:
+            _read_engines[engine] = read_engine
+        # Stay below the connection pool size so a worker never waits on a connection.
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="db")
+        self._writer: Optional[Writer] = None
+        self._writer_lock = threading.Lock()
+        self.rollback_hooks: List[Callable[[], None]] = []
+        self.commit_hooks: List[Callable[[], None]] = []
+
+    async def run(self, fn: Callable[..., T], *args, **kwargs) -> T:
+        """Call fn(*args, **kwargs) on a database worker and await its result. fn must only read."""
+        loop = asyncio.get_running_loop()
+        # Carry over context variables, e.g. which command is running.
+        context = contextvars.copy_context()
+        return await loop.run_in_executor(
+            self._executor, functools.partial(context.run, self._read, fn, *args, **kwargs)
+        )
+
+    def _read(self, fn: Callable[..., T], *args, **kwargs) -> T:
+        token = _reading.set(True)
+        try:
+            # One unit of work for everything fn reads, see session.
+            with session(self.engine):
+                return fn(*args, **kwargs)
+        finally:
+            _reading.reset(token)
+
+    async def write(self, fn: Callable[..., T], *args, **kwargs) -> T:
+        """Call fn(*args, **kwargs) on the writer thread and await its result once it is committed."""
+        return await asyncio.wrap_future(self.writer.submit(fn, *args, **kwargs))
+
+    @property
+    def writer(self) -> Writer:
+        with self._writer_lock:
+            if self._writer is None:
+                self._writer = Writer(self.engine, rollback_hooks=self.rollback_hooks, commit_hooks=self.commit_hooks)
+            return self._writer
+
+    def close(self) -> None:
+        self._executor.shutdown(wait=True)
+        with self._writer_lock:
+            if self._writer is not None:
+                self._writer.stop()
+                self._writer = None
+        if self.read_engine is not None:
+            _read_engines.pop(self.engine, None)
+            self.read_engine.dispose()
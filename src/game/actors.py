@@ -0,0 +1,90 @@
+import asyncio
+import contextvars
+import time
+
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable, Dict, Tuple, TypeVar
+
+T = TypeVar("T")
+
+
+@dataclass
+class ActorMetrics:
+    depth: int = 0
+    max_depth: int = 0
+    processed: int = 0
+    # Seconds between a command being queued and starting to run.
+    total_wait: float = 0.0
+    max_wait: float = 0.0
+
+    @property
+    def average_wait(self) -> float:
+        return self.total_wait / self.processed if self.processed else 0.0
+
+
+@dataclass
+class _Actor:
+    queue: "asyncio.Queue[Tuple[Callable[[], Awaitable[Any]], contextvars.Context, asyncio.Future, float]]" = field(
+        default_factory=asyncio.Queue
+    )
+    metrics: ActorMetrics = field(default_factory=ActorMetrics)
+    task: "asyncio.Task | None" = None
+
+
+class GameActors:
+    """One queue per game. Commands for a game run one at a time in arrival order, while different games run concurrently.
+
+    An actor stops once its queue has been idle for idle_timeout seconds, so finished games don't keep a task around.
+    Its metrics go with it.
+    """
+
+    def __init__(self, idle_timeout: float = 300) -> None:
+        self.idle_timeout = idle_timeout
+        self._actors: Dict[int, _Actor] = {}
+
+    async def submit(self, game_id: int, command: Callable[[], Awaitable[T]]) -> T:
+        """Queue command for the game and await its result."""
+        actor = self._actors.get(game_id)
+        if actor is None:
+            actor = _Actor()
+            actor.task = asyncio.create_task(self._work(game_id, actor), name=f"game-actor-{game_id}")
+            self._actors[game_id] = actor
+
+        future = asyncio.get_running_loop().create_future()
+        # The command runs in the caller's context, e.g. to count its statements against the calling command.
+        actor.queue.put_nowait((command, contextvars.copy_context(), future, time.monotonic()))
+        actor.metrics.depth = actor.queue.qsize()
+        actor.metrics.max_depth = max(actor.metrics.max_depth, actor.metrics.depth)
+        return await future
+
+    async def _work(self, game_id: int, actor: _Actor) -> None:
+        while True:
+            try:
+                command, context, future, queued_at = await asyncio.wait_for(actor.queue.get(), self.idle_timeout)
+            except TimeoutError:
+                if actor.queue.empty():
+                    del self._actors[game_id]
+                    return
+                continue
+
+            metrics = actor.metrics
+            metrics.depth = actor.queue.qsize()
+            wait = time.monotonic() - queued_at
+            metrics.processed += 1
+            metrics.total_wait += wait
+            metrics.max_wait = max(metrics.max_wait, wait)
+            if future.cancelled():
+                continue
+
+            try:
+                result = await asyncio.create_task(command(), context=context)
+            except Exception as e:
+                if not future.cancelled():
+                    future.set_exception(e)
+                continue
+            if not future.cancelled():
+                future.set_result(result)
+
+    def metrics(self) -> Dict[int, ActorMetrics]:
+        """Metrics of the games with a running actor."""
+        return {game_id: actor.metrics for game_id, actor in self._actors.items()}
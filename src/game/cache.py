@@ -0,0 +1,215 @@
+import threading
+import time
+import weakref
+
+from collections import OrderedDict
+from sqlalchemy import Connection, Engine, event, select
+from sqlalchemy.orm import Session, attributes
+from sqlalchemy.orm.util import identity_key
+from typing import Iterable, Optional, Set
+
+from . import loading
+from . import model
+
+ACTIVE_STATES = {model.GameState.LOBBY, model.GameState.BAN, model.GameState.DRAFT}
+
+
+class GameChannels:
+    """Which channel ids are games, so commands in ordinary channels skip the database.
+
+    Known games are loaded at startup and kept up to date from flushes. An id that is neither known
+    nor remembered as a miss is looked up once; misses are remembered for miss_ttl seconds in case
+    a game shows up some other way.
+    """
+
+    def __init__(self, game_ids: Iterable[int], miss_ttl: float = 600, max_misses: int = 4096) -> None:
+        self.miss_ttl = miss_ttl
+        self.max_misses = max_misses
+        self._games: Set[int] = set(game_ids)
+        self._misses: OrderedDict[int, float] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def is_game(self, channel_id: int) -> bool:
+        with self._lock:
+            return channel_id in self._games
+
+    def is_known_miss(self, channel_id: int) -> bool:
+        with self._lock:
+            expires = self._misses.get(channel_id)
+            if expires is None:
+                return False
+            if expires < time.monotonic():
+                del self._misses[channel_id]
+                return False
+            return True
+
+    def add(self, channel_id: int) -> None:
+        with self._lock:
+            self._games.add(channel_id)
+            self._misses.pop(channel_id, None)
+
+    def discard(self, channel_id: int) -> None:
+        with self._lock:
+            self._games.discard(channel_id)
+
+    def record_miss(self, channel_id: int) -> None:
+        with self._lock:
+            if channel_id in self._games:
+                return
+            self._misses[channel_id] = time.monotonic() + self.miss_ttl
+            self._misses.move_to_end(channel_id)
+            while len(self._misses) > self.max_misses:
+                self._misses.popitem(last=False)
+
+
+class GameCache:
+    """Bounded LRU of the game aggregates (settings, players, pools, turn) of games in LOBBY/BAN/DRAFT state.
+
+    Entries are detached snapshots. `get` merges a snapshot into the caller's session without
+    emitting SQL, so the caller works on its own copy. A game is dropped from the cache when a
+    session that flushed it ends its transaction, committed or not. A session joined to the
+    writer's batch only ends a savepoint, and other connections can still read, and cache, the
+    old state until the batch commits; `committed` drops those games again once it has. The
+    version column still catches anything the cache missed.
+    """
+
+    def __init__(self, engine: Engine, max_games: int = 128) -> None:
+        self.engine = engine
+        self.max_games = max_games
+        self.hits = 0
+        self.misses = 0
+        self._games: OrderedDict[int, model.Game] = OrderedDict()
+        self._lock = threading.Lock()
+        # Bumped on every invalidation. A load that raced with one is not cached.
+        self._invalidations = 0
+        # Where a session collects the games it wrote, until its transaction ends.
+        self._written_key = ("written_games", id(self))
+        # Games written in the writer's batch that is running, see committed.
+        self._uncommitted: Set[int] = set()
+        with Session(engine) as session:
+            self.channels = GameChannels(session.scalars(select(model.Game.game_id)))
+        _caches.add(self)
+
+    def get(self, session: Session, game_id: int) -> Optional[model.Game]:
+        # Already loaded by an outer call in the same unit of work. Merging the snapshot again would undo its changes.
+        game = session.identity_map.get(identity_key(model.Game, game_id))
+        if game is not None:
+            return game
+        if self.channels.is_known_miss(game_id):
+            return None
+
+        with self._lock:
+            snapshot = self._games.get(game_id)
+            if snapshot is not None:
+                self._games.move_to_end(game_id)
+                self.hits += 1
+            else:
+                self.misses += 1
+            invalidations = self._invalidations
+
+        if snapshot is None:
+            snapshot = self._load(session, game_id)
+            if snapshot is None:
+                self.channels.record_miss(game_id)
+                return None
+            self.channels.add(game_id)
+            if snapshot.game_state in ACTIVE_STATES:
+                self._put(game_id, snapshot, invalidations)
+
+        game = session.merge(snapshot, load=False)
+        self._unshare_json(game)
+        return game
+
+    def invalidate(self, game_ids: Iterable[int]) -> None:
+        with self._lock:
+            self._invalidations += 1
+            for game_id in game_ids:
+                self._games.pop(game_id, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._invalidations += 1
+            self._uncommitted.clear()
+            self._games.clear()
+
+    def committed(self) -> None:
+        """Drop the games written since the last call. A writer commit hook, see database.Writer."""
+        with self._lock:
+            written, self._uncommitted = self._uncommitted, set()
+        if written:
+            self.invalidate(written)
+
+    def _load(self, session: Session, game_id: int) -> Optional[model.Game]:
+        # A private session on the caller's connection sees the same transaction,
+        # and leaves the caller's identity map alone.
+        with Session(bind=session.connection()) as loader:
+            game = loader.scalar(
+                select(model.Game)
+                .where(model.Game.game_id == game_id)
+                .options(*loading.game_aggregate())
+            )
+            loader.expunge_all()
+            return game
+
+    def _put(self, game_id: int, game: model.Game, invalidations: int) -> None:
+        with self._lock:
+            if invalidations != self._invalidations:
+                return
+            self._games[game_id] = game
+            self._games.move_to_end(game_id)
+            while len(self._games) > self.max_games:
+                self._games.popitem(last=False)
+
+    @staticmethod
+    def _unshare_json(game: model.Game) -> None:
+        # JSON lists are mutated in place by the drafting modes. Give the session its own copies.
+        attributes.set_committed_value(game, "map_string", list(game.map_string or []))
+        for player in game.game_players:
+            attributes.set_committed_value(player, "factions", list(player.factions or []))
+            attributes.set_committed_value(player, "bans", list(player.bans or []))
+
+    def _is_ours(self, session: Session) -> bool:
+        bind = session.bind
+        return bind is not None and bind.engine is self.engine
+
+    def _track_writes(self, session: Session) -> None:
+        if not self._is_ours(session):
+            return
+        written = session.info.setdefault(self._written_key, set())
+        for obj in [*session.new, *session.dirty, *session.deleted]:
+            if isinstance(obj, (model.Game, model.GamePlayer, model.GameSettings)):
+                written.add(obj.game_id)
+        # New lobbies and cancelled games.
+        for obj in session.new:
+            if isinstance(obj, model.Game):
+                self.channels.add(obj.game_id)
+        for obj in session.deleted:
+            if isinstance(obj, model.Game):
+                self.channels.discard(obj.game_id)
+
+    def _invalidate_written(self, session: Session) -> None:
+        written = session.info.pop(self._written_key, None)
+        if not written:
+            return
+        if isinstance(session.bind, Connection):
+            # Joined to a transaction that is still open, e.g. the writer's batch.
+            with self._lock:
+                self._uncommitted.update(written)
+        self.invalidate(written)
+
+
+# Every live cache. The session events are listened to once, here, rather than by each cache.
+_caches: "weakref.WeakSet[GameCache]" = weakref.WeakSet()
+
+
+@event.listens_for(Session, "before_flush")
+def _track_writes(session: Session, flush_context, instances) -> None:
+    for game_cache in list(_caches):
+        game_cache._track_writes(session)
+
+
+@event.listens_for(Session, "after_commit")
+@event.listens_for(Session, "after_transaction_end")
+def _invalidate_written(session: Session, *args) -> None:
+    for game_cache in list(_caches):
+        game_cache._invalidate_written(session)
@@ -1,18 +1,19 @@
 import logging
-from unittest import case
 import Levenshtein
 import discord
 
+from . import actors
 from . import gamelogic
 from . import factions
 from . import strategy_cards
 from . import board
+from . import timers
 from ..typing import *
 
 from discord.ext import commands
-from typing import Optional
-from discord.ext import commands
-from sqlalchemy import Engine
+from functools import partial
+from typing import Hashable, Optional, Tuple
+from ..shards import Shard, ShardRouter
 
 class Game(commands.Cog):
     """Cog containing game related commands."""
@@ -20,13 +21,30 @@ class Game(commands.Cog):
     def __init__(
         self,
         bot: commands.Bot,
-        engine: Engine,
+        shards: ShardRouter,
     ) -> None:
         """Initialize the Commands cog with factions."""
         self.factions = factions.read_factions()
         self.strategy_cards = strategy_cards.read_strategy_cards()
-        self.logic = gamelogic.GameLogic(bot, engine)
+        self.bot = bot
+        self.shards = shards
+        # Channel ids are unique across guilds, so one set of queues serves every shard.
+        self.actors = actors.GameActors()
         self.planets = board.read_planets()
+        self.draft_timeout = timers.timeout_from_env()
+        # Pick and ban deadlines of every guild's drafts, keyed by (guild id, game id).
+        self.deadlines = timers.DeadlineScheduler(self.__deadline_passed)
+
+    async def cog_load(self) -> None:
+        pending = await self.shards.fan_out(lambda shard: timers.pending(shard.engine))
+        for guild_id, rows in pending.items():
+            for game_id, deadline, step in rows:
+                self.deadlines.schedule((guild_id, game_id), deadline, step)
+        logging.info("Loaded %d draft deadline(s)", len(self.deadlines))
+        self.deadlines.start()
+
+    async def cog_unload(self) -> None:
+        self.deadlines.stop()
 
 
     async def __send_embed_or_pretty_err(self, ctx: commands.Context, result: Result[discord.Embed]) -> None:
@@ -49,6 +67,53 @@ class Game(commands.Cog):
         # Let's use the channel ID for the game ID.
         return ctx.channel.id
 
+    async def __logic(self, ctx: commands.Context) -> Tuple[Shard, gamelogic.GameLogic]:
+        shard = await self.shards.shard(ctx.guild)
+        return shard, await self.__shard_logic(shard)
+
+    async def __shard_logic(self, shard: Shard) -> gamelogic.GameLogic:
+        return await shard.service(
+            "game",
+            lambda shard: gamelogic.GameLogic(self.bot, shard.engine, shard.database, self.draft_timeout),
+        )
+
+    async def __reschedule(self, shard: Shard, game_id: int) -> None:
+        """Follow the game's deadline after a write that may have moved its draft on."""
+        logic = await self.__shard_logic(shard)
+        if logic.cache.channels.is_known_miss(game_id):
+            return
+        match await shard.database.run(logic.deadline, game_id):
+            case (deadline, step):
+                self.deadlines.schedule((shard.guild_id, game_id), deadline, step)
+            case None:
+                self.deadlines.cancel((shard.guild_id, game_id))
+
+    async def __deadline_passed(self, key: Hashable, step: int) -> None:
+        guild_id, game_id = key
+        shard = await self.shards.shard(guild_id)
+        logic = await self.__shard_logic(shard)
+        # Queued behind the game's commands, like a pick made by the drafter.
+        result = await self.actors.submit(game_id, partial(shard.database.write, logic.auto_pick, game_id, step))
+        await self.__reschedule(shard, game_id)
+        channel = self.bot.get_channel(game_id)
+        match result:
+            case Ok(embed) if channel is not None:
+                await channel.send(embed=embed)
+            case Err(s) if channel is not None:
+                await channel.send(s)
+
+    async def __write_in_game(self, ctx: commands.Context, method, *args):
+        """Run a write for this channel's game after the game's earlier commands have finished.
+
+        method is a GameLogic method, called on the logic of the guild's shard.
+        """
+        shard, logic = await self.__logic(ctx)
+        fn = partial(method, logic)
+        if logic.cache.channels.is_known_miss(self.__game_id(ctx)):
+            # Not a game channel. The logic answers without a query, so skip the queues.
+            return await shard.database.run(fn, *args)
+        return await self.actors.submit(self.__game_id(ctx), partial(shard.database.write, fn, *args))
+
     @commands.command(name="strategy-cards")
     async def strat_cards(
         self, ctx: commands.Context) -> None:
@@ -108,7 +173,8 @@ class Game(commands.Cog):
     ) -> None:
         """Finish the game. Usage !finish {list_of_points} where the order is the turn order of the players."""
         is_admin = ctx.author.guild_permissions.administrator
-        await self.__send_embed_or_pretty_err(ctx, self.logic.finish(is_admin, self.__game_id(ctx), points))
+        result = await self.__write_in_game(ctx, gamelogic.GameLogic.finish, is_admin, self.__game_id(ctx), points)
+        await self.__send_embed_or_pretty_err(ctx, result)
 
     @commands.command()
     async def ban(
@@ -116,20 +182,25 @@ class Game(commands.Cog):
     ) -> None:
         """Ban a faction."""
         await ctx.send(
-            await self.logic.ban(ctx.author.id, self.__game_id(ctx), faction)
+            await self.__write_in_game(ctx, gamelogic.GameLogic.ban, ctx.author.id, self.__game_id(ctx), faction)
         )
+        if faction:
+            await self.__reschedule(await self.shards.shard(ctx.guild), self.__game_id(ctx))
 
     @commands.command()
     async def draft(
         self, ctx: commands.Context, *, faction: Optional[str] = None
     ) -> None:
         """Draft your faction."""
-        await self.__send_embed_or_pretty_err(ctx, await self.logic.draft(ctx.author.id, self.__game_id(ctx), faction))
+        await self.__send_embed_or_pretty_err(ctx, await self.__write_in_game(ctx, gamelogic.GameLogic.draft, ctx.author.id, self.__game_id(ctx), faction))
+        if faction:
+            await self.__reschedule(await self.shards.shard(ctx.guild), self.__game_id(ctx))
 
     @commands.command()
     async def start(self, ctx: commands.Context) -> None:
         """Start the lobby."""
-        await self.__send_embed_or_pretty_err(ctx, self.logic.start(self.factions, self.__game_id(ctx)))
+        await self.__send_embed_or_pretty_err(ctx, await self.__write_in_game(ctx, gamelogic.GameLogic.start, self.factions, self.__game_id(ctx)))
+        await self.__reschedule(await self.shards.shard(ctx.guild), self.__game_id(ctx))
 
     @commands.command()
     async def cancel(self, ctx: commands.Context) -> None:
@@ -142,7 +213,7 @@ class Game(commands.Cog):
             case _:
                 return
 
-        match self.logic.cancel(self.__game_id(ctx)):
+        match await self.__write_in_game(ctx, gamelogic.GameLogic.cancel, self.__game_id(ctx)):
             case Ok(s):
                 match ctx.channel:
                     case discord.TextChannel():
@@ -153,18 +224,20 @@ class Game(commands.Cog):
     @commands.command()
     async def info(self, ctx: commands.Context, *, game_name: Optional[str]) -> None:
         """Fetch game info"""
+        shard, logic = await self.__logic(ctx)
         if not game_name:
             game_id = self.__game_id(ctx)
-            await self.__send_embed_or_pretty_err(ctx, self.logic.game(game_id))
+            await self.__send_embed_or_pretty_err(ctx, await shard.database.run(logic.game, game_id))
             return
-        await self.__send_embed_or_pretty_err(ctx, self.logic.game_from_name(game_name))
+        await self.__send_embed_or_pretty_err(ctx, await shard.database.run(logic.game_from_name, game_name))
         
         
 
     @commands.command()
     async def games(self, ctx: commands.Context) -> None:
         """Fetches latest games."""
-        match self.logic.games():
+        shard, logic = await self.__logic(ctx)
+        match await shard.database.run(logic.games):
             case Ok(paginated):
                 await paginated.view_menu(ctx).start()
             case Err(s):
@@ -190,8 +263,9 @@ class Game(commands.Cog):
             await ctx.send(embed=embed)
             return
 
+        shard, logic = await self.__logic(ctx)
         channel = await ctx.guild.create_text_channel(name)
-        match await self.logic.lobby(channel, channel.id, ctx.author.id, ctx.author.name, name):
+        match await logic.lobby(channel, channel.id, ctx.author.id, ctx.author.name, name):
             case Ok(s):
                 await channel.send(embed=s)
                 await ctx.send(f"Created {channel.mention} for TI4 Lobby")
@@ -201,14 +275,15 @@ class Game(commands.Cog):
     @commands.command()
     async def lobbies(self, ctx: commands.Context) -> None:
         """Show all open lobbies."""
-        await ctx.send(self.__string_from_string_result(self.logic.lobbies()))
+        shard, logic = await self.__logic(ctx)
+        await ctx.send(self.__string_from_string_result(await shard.database.run(logic.lobbies)))
 
     @commands.command()
     async def leave(self, ctx: commands.Context) -> None:
         """Leave a lobby."""
         id = ctx.author.id
         await ctx.send(
-            self.__string_from_string_result(self.logic.leave(self.__game_id(ctx), id))
+            self.__string_from_string_result(await self.__write_in_game(ctx, gamelogic.GameLogic.leave, self.__game_id(ctx), id))
         )
 
     @commands.command()
@@ -218,17 +293,20 @@ class Game(commands.Cog):
         name = ctx.author.name
         await ctx.send(
             self.__string_from_string_result(
-                self.logic.join(self.__game_id(ctx), id, name)
+                await self.__write_in_game(ctx, gamelogic.GameLogic.join, self.__game_id(ctx), id, name)
             )
         )
 
     @commands.command()
     async def polls(self, ctx: commands.Context) -> None:
         """Apply the results of the polls to the game."""
+        shard, logic = await self.__logic(ctx)
         await ctx.send("Reading polls...")
         await ctx.send(
             self.__string_from_string_result(
-                await self.logic.apply_poll_results(self.__game_id(ctx))
+                await self.actors.submit(
+                    self.__game_id(ctx), partial(logic.apply_poll_results, self.__game_id(ctx))
+                )
             )
         )
 
@@ -237,4 +315,35 @@ class Game(commands.Cog):
         self, ctx: commands.Context, property: Optional[str], value: Optional[str]
     ) -> None:
         """Configure a lobby."""
-        await self.__send_embed_or_pretty_err(ctx, self.logic.config(self.__game_id(ctx), property, value))
+        await self.__send_embed_or_pretty_err(ctx, await self.__write_in_game(ctx, gamelogic.GameLogic.config, self.__game_id(ctx), property, value))
+
+    @commands.command()
+    async def queues(self, ctx: commands.Context) -> None:
+        """Admin command to show the command queues of the recently active games."""
+        if not ctx.author.guild_permissions.administrator:
+            await ctx.send("Admin only command")
+            return
+        metrics = self.actors.metrics()
+        if not metrics:
+            await ctx.send("No game has had a command queued recently.")
+            return
+        lines = [
+            f"<#{game_id}>: depth {m.depth} (max {m.max_depth}), {m.processed} processed, "
+            f"wait avg {m.average_wait * 1000:.0f} ms / max {m.max_wait * 1000:.0f} ms"
+            for game_id, m in sorted(metrics.items(), key=lambda item: item[1].max_wait, reverse=True)[:20]
+        ]
+        await ctx.send("\n".join(lines))
+
+    @commands.command(name="shards")
+    async def list_shards(self, ctx: commands.Context) -> None:
+        """Owner command to show the games in every guild's database."""
+        if not await self.bot.is_owner(ctx.author):
+            await ctx.send("Owner only command")
+            return
+        counts = await self.shards.fan_out(lambda shard: gamelogic.GameLogic.state_counts(shard.engine))
+        lines = [
+            f"{f'Guild {guild_id}' if guild_id else 'Shared'}: "
+            + (", ".join(f"{count} {state.value.lower()}" for state, count in states.items()) or "no games")
+            for guild_id, states in counts.items()
+        ]
+        await ctx.send("\n".join(lines))
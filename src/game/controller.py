@@ -1,39 +1,47 @@
-from sqlalchemy import select
-from sqlalchemy.orm import Session, with_parent
+from sqlalchemy import bindparam, inspect, select, delete
+from sqlalchemy.orm import Session
 
-from .model import Game, GamePlayer
+from . import loading
+from .model import Game, GamePlayer, GameResult, GameState
 
 from typing import Sequence
 
+# Built once, with the game as a bound parameter, so executing them reuses the compiled SQL
+# without rebuilding the statement or its cache key.
+_PLAYERS_BY_TURN = (
+    select(GamePlayer)
+    .where(GamePlayer.game_id == bindparam("game_id"))
+    .order_by(GamePlayer.turn_order.asc())
+    .options(*loading.players_with_names())
+)
+_PLAYERS_BY_POINTS = (
+    select(GamePlayer)
+    .where(GamePlayer.game_id == bindparam("game_id"))
+    .order_by(GamePlayer.points.desc())
+    .options(*loading.players_with_names())
+)
+_WINNER_ID = (
+    select(GameResult.player_id)
+    .where(GameResult.game_id == bindparam("game_id"), GameResult.winner.is_(True))
+    .limit(1)
+)
+
 
 class GameController:
 
     def player_from_game(self, session: Session, game:Game, player_id: int) -> GamePlayer|None:
-        return session.scalar(
-            select(GamePlayer)
-            .where(
-                with_parent(game, Game.game_players),
-                GamePlayer.player_id==player_id,
-            )
-        )
+        return next((player for player in game.game_players if player.player_id == player_id), None)
 
     def players_ordered_by_turn(
         self, session: Session, game: Game
     ) -> Sequence[GamePlayer]:
-        return session.scalars(
-            select(GamePlayer)
-            .where(with_parent(game, Game.game_players))
-            .order_by(GamePlayer.turn_order.asc())
-        ).all()
+        return session.scalars(_PLAYERS_BY_TURN, {"game_id": game.game_id}).all()
 
 
     def current_drafter(self, session: Session, game: Game) -> GamePlayer:
-        current_drafter = session.scalar(
-            select(GamePlayer)
-            .where(
-                with_parent(game, Game.game_players),
-                GamePlayer.turn_order == game.turn,
-            )
+        # The players are usually loaded already (see GameCache), so look in memory.
+        current_drafter = next(
+            (player for player in game.game_players if player.turn_order == game.turn), None
         )
         if current_drafter is None:
             raise LookupError("Current drafter not found for this game!")
@@ -42,20 +50,44 @@ class GameController:
     def players_ordered_by_points(
         self, session: Session, game: Game
     ) -> Sequence[GamePlayer]:
-        return session.scalars(
-            select(GamePlayer)
-            .where(with_parent(game, Game.game_players))
-            .order_by(GamePlayer.points.desc())
-        ).all()
+        return session.scalars(_PLAYERS_BY_POINTS, {"game_id": game.game_id}).all()
+
+    def record_result(self, session: Session, game: Game) -> None:
+        """(Re)write the standings of a finished game from its players' points."""
+        session.execute(delete(GameResult).where(GameResult.game_id == game.game_id))
+
+        points = [player.points for player in game.game_players]
+        if not points:
+            return
+        best, worst = max(points), min(points)
+        for player in game.game_players:
+            session.add(GameResult(
+                game_id=game.game_id,
+                player_id=player.player_id,
+                points=player.points,
+                faction=player.faction,
+                placement=1 + sum(1 for other in points if other > player.points),
+                winner=player.points == best,
+                loser=player.points == worst,
+            ))
+        session.flush()
 
     # Assumes only one winner
     def winner(self, session: Session, game: Game) -> GamePlayer:
-        winner = session.scalar(
-            select(GamePlayer)
-            .where(with_parent(game, Game.game_players))
-            .order_by(GamePlayer.points.desc())
-        )
-       
-        if winner is None:
+        # Worked out from the loaded players and standings (see loading.standings). Standings
+        # that weren't loaded are read in one query rather than one per player.
+        players = game.game_players
+        if not players:
             raise LookupError("Winner not found for this game!")
-        return winner
\ No newline at end of file
+
+        if game.game_state == GameState.FINISHED:
+            if any("result" in inspect(player).unloaded for player in players):
+                winner_id = session.scalar(_WINNER_ID, {"game_id": game.game_id})
+                winner = next((player for player in players if player.player_id == winner_id), None)
+            else:
+                winner = next((player for player in players if player.result is not None and player.result.winner), None)
+            if winner is not None:
+                return winner
+
+        # Not finished (yet), so there are no standings to read.
+        return max(players, key=lambda player: player.points or 0)
@@ -64,10 +64,30 @@ class GameMode:
     ) -> Optional[str]:
         return f"Drafting mode {self.game.game_settings.drafting_mode} does not support bans"
 
+    def auto_pick(self, player: model.GamePlayer) -> Optional[str]:
+        """A random pick for a drafter who ran out of time, as they would type it after !draft."""
+        return None
+
+    def auto_ban(self, player: model.GamePlayer) -> Optional[str]:
+        """A random ban for a player who ran out of time, as they would type it after !ban."""
+        return None
+
+    def _banned(self) -> List[str]:
+        return [banned for game_player in self.game.game_players for banned in game_player.bans or []]
+
+    def _random_faction(self, player: model.GamePlayer) -> Optional[str]:
+        # Picks used to be left in the other players' lists of a shared pool, so skip them too.
+        taken = set(self._banned()) | {other.faction for other in self.game.game_players if other.faction}
+        available = [faction for faction in player.factions if faction not in taken]
+        return random.choice(available) if available else None
+
 class GameStarted:
     pass
 
 class ExclusivePool(GameMode):
+    def auto_pick(self, player: model.GamePlayer) -> Optional[str]:
+        return None if player.faction else self._random_faction(player)
+
     def draft(
         self, session: Session, player: model.GamePlayer, faction: Optional[str]
     ) -> Result[discord.Embed|GameStarted]:
@@ -168,6 +188,9 @@ class ExclusivePool(GameMode):
         ))
 
 class PicksOnly(GameMode):
+    def auto_pick(self, player: model.GamePlayer) -> Optional[str]:
+        return None if player.faction else self._random_faction(player)
+
     def draft(
         self, session: Session, player: model.GamePlayer, faction: Optional[str]
     ) -> Optional[str]:
@@ -197,6 +220,7 @@ class PicksOnly(GameMode):
         ]
         for other_player in other_players:
             other_player.factions.remove(player.faction)
+            attributes.flag_modified(other_player, "factions")
             session.merge(other_player)
 
         session.merge(self.game)
@@ -251,6 +275,12 @@ class PicksOnly(GameMode):
 
 
 class PicksAndBans(GameMode):
+    def auto_pick(self, player: model.GamePlayer) -> Optional[str]:
+        return None if player.faction else self._random_faction(player)
+
+    def auto_ban(self, player: model.GamePlayer) -> Optional[str]:
+        return self._random_faction(player)
+
     def draft(
         self,
         session: Session,
@@ -297,6 +327,7 @@ class PicksAndBans(GameMode):
             # Look into it later.
             if player.faction:
                 other_player.factions.remove(player.faction)
+                attributes.flag_modified(other_player, "factions")
                 session.merge(other_player)
 
         session.merge(self.game)
@@ -423,6 +454,20 @@ class PicksAndBans(GameMode):
 
 
 class HomeBrewDraft(GameMode):
+    def auto_pick(self, player: model.GamePlayer) -> Optional[str]:
+        # One of the things still missing, the way a player drafts one per turn.
+        if not player.faction:
+            return self._random_faction(player)
+        if not player.strategy_card:
+            taken = {other.strategy_card for other in self.game.game_players}
+            cards = [sc.name for sc in strategy_cards.read_strategy_cards() if sc.name not in taken]
+            return random.choice(cards) if cards else None
+        if not player.position:
+            taken_positions = {other.position for other in self.game.game_players}
+            positions = [p for p in range(1, len(self.game.game_players) + 1) if p not in taken_positions]
+            return str(random.choice(positions)) if positions else None
+        return None
+
     def draft(
         self,
         session: Session,
@@ -11,19 +11,44 @@ from . import strategy_cards
 from . import model
 from . import draftingmodes
 from . import controller
+from . import cache
+from . import readmodels
+from . import timers
 
 from ..typing import *
+from .. import database, outbox
+from ..database import Database
 
 from reactionmenu import ViewMenu, ViewButton
 from discord.ext import commands
 from datetime import datetime, timedelta
-from sqlalchemy import inspect, Enum, Boolean, String, Integer, select
+from sqlalchemy import inspect, Enum, Boolean, String, Integer, func, select
 from sqlalchemy.orm import Session
+from sqlalchemy.orm.exc import StaleDataError
 from string import Template
-from typing import Optional, Dict, Any, Iterable, Sequence, List, List
+from typing import Optional, Dict, Any, Iterable, Sequence, List, List, Tuple
 from itertools import batched
+from functools import wraps
 
-from blinker import signal
+
+
+def retry_on_conflict(conflict_result, attempts: int = 3):
+    """Rerun the decorated method with fresh state when another session updated the same game first.
+
+    The method must open its session with database.session and let StaleDataError propagate,
+    which rolls back the unit of work it may be nested in.
+    """
+    def decorator(method):
+        @wraps(method)
+        def wrapper(*args, **kwargs):
+            for attempt in range(1, attempts + 1):
+                try:
+                    return method(*args, **kwargs)
+                except StaleDataError:
+                    logging.info("%s: concurrent update (attempt %d/%d)", method.__name__, attempt, attempts)
+            return conflict_result
+        return wrapper
+    return decorator
 
 
 class PaginatedEmbed:
@@ -62,11 +87,38 @@ class PaginatedEmbed:
 
 class GameLogic:
 
-    def __init__(self, bot: commands.Bot, engine):
+    def __init__(
+        self,
+        bot: commands.Bot,
+        engine,
+        database: Database,
+        draft_timeout: Optional[timedelta] = timers.DEFAULT_DRAFT_TIMEOUT,
+    ):
         self.bot = bot
         self.engine = engine
-        self.signal = signal("finish")
+        # Time a drafter has for each pick or ban. None leaves the drafts without deadlines.
+        self.draft_timeout = draft_timeout
+        # Used by the methods that interleave database work with Discord calls.
+        self.database = database
+        self.cache = cache.GameCache(engine)
+        # The writer's uncommitted state may have been cached by a batch that then failed.
+        self.database.rollback_hooks.append(self.cache.clear)
+        # Readers on other connections may have cached the state from before the batch committed.
+        self.database.commit_hooks.append(self.cache.committed)
         self.controller = controller.GameController()
+        self._backfill_results()
+
+    def _backfill_results(self) -> None:
+        """Write the standings of finished games that predate the game_result table."""
+        with database.session(self.engine) as session:
+            games = session.scalars(
+                select(model.Game)
+                .filter_by(game_state=model.GameState.FINISHED)
+                .where(~model.Game.game_results.any())
+            ).all()
+            for game in games:
+                self.controller.record_result(session, game)
+            session.commit()
 
     __game_start_quotes = [
         "> In the ashes of Mecatol Rex, the galaxy trembles. Ancient rivalries stir, alliances are whispered in shadow, and war fleets awaken from slumber. The throne is empty… but not for long.\n> -$player",
@@ -162,12 +214,13 @@ Living rules reference (Prophecy of Kings)
             color=discord.Color.blue()
         )
 
+    @retry_on_conflict(Err("The game was changed by someone else at the same time. Try again."))
     def finish(
         self, is_admin: bool, game_id: int, all_points: Optional[str]
     ) -> Result[discord.Embed]:
-        with Session(self.engine) as session:
+        with database.session(self.engine) as session:
             try:
-                game = session.get(model.Game, game_id)
+                game = self.cache.get(session, game_id)
                 if not game:
                     return Err("Game not found.")
                 if is_admin and game.game_state == model.GameState.FINISHED:
@@ -193,22 +246,29 @@ Living rules reference (Prophecy of Kings)
                 session.add_all(players)
 
                 self.__finish_game(session, game)
+                self.controller.record_result(session, game)
                 players = self.controller.players_ordered_by_points(session, game)
                 msg = self.__end_game_message(players)
+                # Payload: game_id. Delivered to the handlers once this commits, see outbox.Dispatcher.
+                outbox.enqueue(
+                    session, outbox.GAME_FINISHED, f"{outbox.GAME_FINISHED}:{game.game_id}:{game.version}",
+                    {"game_id": game.game_id},
+                )
                 session.commit()
-
-                self.signal.send(None, game_id=game.game_id)
                 return Ok(msg)
+            except StaleDataError:
+                raise
             except Exception as e:
                 logging.exception("Can't finish game")
                 return Err("Can't finish game. Something went wrong.")
 
-    async def ban(
+    @retry_on_conflict("The game was changed by someone else at the same time. Try again.")
+    def ban(
         self, player_id: int, game_id: int, faction: Optional[str] = None
     ) -> Optional[str]:
         try:
-            with Session(self.engine) as session:
-                game = session.get(model.Game, game_id)
+            with database.session(self.engine) as session:
+                game = self.cache.get(session, game_id)
                 if not game:
                     return "No game found."
 
@@ -219,18 +279,24 @@ Living rules reference (Prophecy of Kings)
                 if not player:
                     return "You are not in this game!"
 
-                return draftingmodes.GameMode.create(game).ban(session, player, faction)
+                result = draftingmodes.GameMode.create(game).ban(session, player, faction)
+                if faction:
+                    self._arm_deadline(session, game)
+                return result
 
+        except StaleDataError:
+            raise
         except Exception as e:
             logging.exception("Error drafting")
             return "Something went wrong"
 
-    async def draft(
+    @retry_on_conflict(Err("The game was changed by someone else at the same time. Try again."))
+    def draft(
         self, player_id: int, game_id: int, faction: Optional[str] = None
     ) -> Result[discord.Embed]:
         try:
-            with Session(self.engine) as session:
-                game = session.get(model.Game, game_id)
+            with database.session(self.engine) as session:
+                game = self.cache.get(session, game_id)
                 if not game:
                     return Err("No game found.")
                 if game.game_state != model.GameState.DRAFT:
@@ -243,25 +309,109 @@ Living rules reference (Prophecy of Kings)
 
                 draft_mode = draftingmodes.GameMode.create(game)
 
+                result: Result[discord.Embed] = Err("Unknown error during drafting")
                 match draft_mode.draft(session, player, faction):
                     case Ok(embed_or_game_started):
                         match embed_or_game_started:
                             case draftingmodes.GameStarted():
-                                return Ok(self._start_game(session, game))
+                                result = Ok(self._start_game(session, game))
                             case discord.Embed():
-                                return Ok(embed_or_game_started)
+                                result = Ok(embed_or_game_started)
                     case Err(error_message):
-                        return Err(error_message)
-                return Err("Unknown error during drafting")
-
+                        result = Err(error_message)
+                if faction:
+                    self._arm_deadline(session, game)
+                return result
 
+        except StaleDataError:
+            raise
         except Exception as e:
             logging.exception("Error drafting")
             return Err("Something went wrong")
 
+    def _arm_deadline(self, session: Session, game: model.Game) -> None:
+        # After a pick or ban was tried. The drafting mode may have committed it already.
+        timers.arm(session, game, self.draft_timeout)
+        session.commit()
+
+    def deadline(self, game_id: int) -> Optional[Tuple[datetime, int]]:
+        """The deadline of the game's current pick or ban and the draft step it is for, if it has one."""
+        with database.session(self.engine) as session:
+            timer = session.get(model.DraftTimer, game_id)
+            return (timer.deadline, timer.step) if timer else None
+
+    def auto_pick(self, game_id: int, step: int) -> Optional[Result[discord.Embed]]:
+        """Pick or ban for the drafter who let the deadline for this step pass, as !draft or !ban would.
+
+        Returns None if there was nothing to do: the draft moved on, the deadline was moved, or
+        nobody is left to pick.
+        """
+        with database.session(self.engine) as session:
+            timer = session.get(model.DraftTimer, game_id)
+            if timer is None or timer.step != step or timer.deadline > datetime.now():
+                return None
+            game = self.cache.get(session, game_id)
+            if (
+                game is None
+                or timers.draft_step(game) != step
+                or game.game_state not in timers.DRAFT_STATES
+                or not timers.has_drafter(game)
+            ):
+                # Out of date, e.g. the game was changed without going through !draft or !ban.
+                # Re-arming removes the deadline if nobody is left to pick.
+                if game is None:
+                    session.delete(timer)
+                    session.commit()
+                else:
+                    self._arm_deadline(session, game)
+                return None
+
+            drafter = self.controller.current_drafter(session, game)
+            mode = draftingmodes.GameMode.create(game)
+            if game.game_state == model.GameState.BAN:
+                choice = mode.auto_ban(drafter)
+                outcome = self.ban(drafter.player_id, game_id, choice) if choice else None
+            else:
+                choice = mode.auto_pick(drafter)
+                outcome = self.draft(drafter.player_id, game_id, choice) if choice else None
+            if choice is None:
+                # Nothing left to pick from. Leave the draft to the players.
+                session.delete(timer)
+                session.commit()
+                return None
+
+            # Some drafting modes answer with text whether or not the pick was made, and !draft turns
+            # that into an error, so only the step tells whether it went through.
+            match outcome:
+                case Ok(discord.Embed() as embed):
+                    text = embed.description or embed.title or ""
+                case Ok(str() as text) | Err(text) | (str() as text):
+                    pass
+                case _:
+                    text = ""
+            if timers.draft_step(game) == step:
+                # Refused. A deadline left in place would fire again straight away, so leave the pick
+                # or ban to the drafter instead.
+                session.delete(timer)
+                session.commit()
+                return Err(
+                    f"<@{drafter.player_id}> ran out of time, but {choice} couldn't be chosen for them: "
+                    f"{text}\nThere is no deadline for this pick any more."
+                )
+            if isinstance(outcome, Err):
+                # Made, but the drafting mode's answer isn't a message for the channel.
+                text = ""
+                if timers.has_drafter(game):
+                    text = f"Next drafter is <@{self.controller.current_drafter(session, game).player_id}>. Use !draft."
+            return Ok(discord.Embed(
+                title="⏰ Out of time",
+                description=f"<@{drafter.player_id}> ran out of time, so {choice} was chosen for them.\n\n{text}",
+                color=discord.Color.orange()
+            ))
+
     def cancel(self, game_id: int) -> Result[discord.Embed]:
-        with Session(self.engine) as session:
-            game = session.get(model.Game, game_id)
+        with database.session(self.engine) as session:
+            game = self.cache.get(session, game_id)
             if not game:
                 return Err(f"No such game found")
 
@@ -296,35 +446,38 @@ Living rules reference (Prophecy of Kings)
 
     def start(self, factions: fs.Factions, game_id: int) -> Result[discord.Embed]:
         try:
-            with Session(self.engine) as session:
+            with database.session(self.engine) as session:
                 res = self._find_lobby(session, game_id)
                 if isinstance(res, Err):
                     return res
                 game = res.value
-                return draftingmodes.GameMode.create(game).start(session, factions)
+                result = draftingmodes.GameMode.create(game).start(session, factions)
+                self._arm_deadline(session, game)
+                return result
 
         except Exception as e:
             logging.exception("Error fetching game data")
             return Err("An error occurred while fetching the game data.")
 
     def game_from_name(self, game_name: str) -> Result[discord.Embed]:
-        with Session(self.engine) as session:
+        with database.session(self.engine) as session:
             try:
-                game = session.scalars(
-                    select(model.Game).filter_by(name=game_name)
+                # Just the id: game loads the whole aggregate into this session.
+                game_id = session.scalars(
+                    select(model.Game.game_id).filter_by(name=game_name)
                 ).first()
-                if not game:
+                if game_id is None:
                     return Err(f"No game found.")
-                return self.game(game.game_id)
+                return self.game(game_id)
 
             except Exception as e:
                 logging.exception("!game error")
                 return Err("An error occurred while fetching the game data.")
 
     def game(self, game_id: int) -> Result[discord.Embed]:
-        with Session(self.engine) as session:
+        with database.session(self.engine) as session:
             try:
-                game = session.get(model.Game, game_id)
+                game = self.cache.get(session, game_id)
                 if not game:
                     return Err(f"No game found.")
 
@@ -363,20 +516,26 @@ Living rules reference (Prophecy of Kings)
                 logging.exception("!game error")
                 return Err("An error occurred while fetching the game data.")
 
+    @staticmethod
+    def state_counts(engine) -> Dict[model.GameState, int]:
+        """Number of games in each state."""
+        with database.session(engine) as session:
+            return dict(session.execute(
+                select(model.Game.game_state, func.count())
+                .group_by(model.Game.game_state)
+                .order_by(model.Game.game_state)
+            ).all())
+
     def lobbies(self) -> Result[str]:
-        with Session(self.engine) as session:
+        with database.session(self.engine) as session:
             try:
-                games = session.scalars(
-                    select(model.Game)
-                    .order_by(model.Game.lobby_create_time.desc())
-                    .filter_by(game_state=model.GameState.LOBBY)
-                ).all()
+                games = readmodels.lobbies(session)
                 if not games:
                     return Err("No games found.")
                 lines = ["Open lobbies:"]
                 for game in games:
                     lines.append(
-                        f"- <#{game.game_id}> {game.name}. {len(game.game_players)} player(s)."
+                        f"- <#{game.game_id}> {game.name}. {game.players} player(s)."
                     )
                 return Ok("\n".join(lines))
             except Exception as e:
@@ -392,34 +551,48 @@ Living rules reference (Prophecy of Kings)
             return list(range(1,6))
         return []
 
+    def _create_lobby(
+        self, game_id: int, player_id: int, player_name: str, name: str
+    ) -> discord.Embed:
+        with database.session(self.engine) as session:
+            game = model.Game(game_id=game_id, game_state="LOBBY", name=name)
+            session.add(game)
+            session.flush()
+            settings = model.GameSettings(game_id=game.game_id)
+            session.add(settings)
+            player = session.get(model.Player, player_id)
+            if not player:
+                player = model.Player(player_id=player_id, name=player_name)
+                session.merge(player)
+            game_player = model.GamePlayer(
+                game_id=game.game_id,
+                player_id=player_id,
+            )
+            session.add(game_player)
+            embed = self.__start_lobby_message(player)
+            session.commit()
+            return embed
+
+    def _save_polls(self, game_id: int, thread_id: int, message_ids: List[int]) -> None:
+        with database.session(self.engine) as session:
+            for message_id in message_ids:
+                settings_poll = model.SettingsPoll(message_id=message_id, game_id=game_id, thread_id=thread_id)
+                session.add(settings_poll)
+            session.commit()
+
     async def lobby(
         self, channel: discord.TextChannel, game_id: int, player_id: int, player_name: str, name: str
     ) -> Result[discord.Embed]:
         try:
-            with Session(self.engine) as session:
-                    game = model.Game(game_id=game_id, game_state="LOBBY", name=name)
-                    session.add(game)
-                    session.flush()
-                    settings = model.GameSettings(game_id=game.game_id)
-                    session.add(settings)
-                    player = session.get(model.Player, player_id)
-                    if not player:
-                        player = model.Player(player_id=player_id, name=player_name)
-                        session.merge(player)
-                    game_player = model.GamePlayer(
-                        game_id=game.game_id,
-                        player_id=player_id,
-                    )
-                    session.add(game_player)
-
-                    settings = inspect(model.GameSettings)
-                    valid_keys: Dict[str, Any] = dict()
-                    for key, dtype in [(col.key, col.type) for col in settings.columns]:
-                        if not ("game" in key and "id" in key):
-                            valid_keys[key] = dtype
-                    thread = await channel.create_thread(name="Configuration", type=discord.ChannelType.public_thread)
-                    embed = self.__start_lobby_message(player)
-                    session.commit()
+            settings = inspect(model.GameSettings)
+            valid_keys: Dict[str, Any] = dict()
+            for key, dtype in [(col.key, col.type) for col in settings.columns]:
+                if not ("game" in key and "id" in key):
+                    valid_keys[key] = dtype
+
+            # Before the game is written, so a failure here doesn't leave a lobby without its polls behind.
+            thread = await channel.create_thread(name="Configuration", type=discord.ChannelType.public_thread)
+            embed = await self.database.write(self._create_lobby, game_id, player_id, player_name, name)
 
             messages = []
             for k,v in valid_keys.items():
@@ -433,19 +606,15 @@ Living rules reference (Prophecy of Kings)
                     poll.add_answer(text=str(opt))
                 messages.append(await thread.send(poll=poll))
 
-            with Session(self.engine) as session:
-                    for message in messages:
-                        settings_poll = model.SettingsPoll(message_id=message.id, game_id=game_id, thread_id=thread.id)
-                        session.add(settings_poll)
-                    session.commit()
-                    return Ok(embed)
+            await self.database.write(self._save_polls, game_id, thread.id, [message.id for message in messages])
+            return Ok(embed)
 
         except Exception as e:
             logging.exception("Error creating game")
             return Err("An error occurred while creating the game.")
 
     def _find_lobby(self, session: Session, game_id: int) -> Result[model.Game]:
-        game = session.get(model.Game, game_id)
+        game = self.cache.get(session, game_id)
 
         if game is None:
             return Err("No lobby found.")
@@ -456,7 +625,7 @@ Living rules reference (Prophecy of Kings)
         return Ok(game)
 
     def leave(self, game_id: int, player_id: int) -> Result[str]:
-        with Session(self.engine) as session:
+        with database.session(self.engine) as session:
             try:
                 res = self._find_lobby(session, game_id)
                 if isinstance(res, Err):
@@ -484,7 +653,7 @@ Living rules reference (Prophecy of Kings)
                 return Err("An error occurred while leaving the lobby.")
 
     def join(self, game_id: int, player_id: int, player_name: str) -> Result[str]:
-        with Session(self.engine) as session:
+        with database.session(self.engine) as session:
             try:
                 res = self._find_lobby(session, game_id)
                 if isinstance(res, Err):
@@ -521,25 +690,19 @@ Living rules reference (Prophecy of Kings)
                 return Err("An error occurred while joining the lobby.")
 
     def games(self, game_limit: int = 40) -> Result[PaginatedEmbed]:
-        def embed_from_games(games: List[model.Game]) -> discord.Embed:
+        def embed_from_games(games: List[readmodels.FinishedGame]) -> discord.Embed:
             embed = discord.Embed(title="🎮 Recent Games", color=discord.Color.blue())
             for game in games:
-                winner = self.controller.winner(session, game)
                 embed.add_field(
-                    name=f"{game.name} (players {len(game.game_players)})",
-                    value=f"Winner: {f"{winner.player.name} ({winner.faction})" if winner else "Unknown"}",
+                    name=f"{game.name} (players {game.players})",
+                    value=f"Winner: {f"{game.winner_name} ({game.winner_faction})" if game.players else "Unknown"}",
                     inline=False
                 )
             return embed
 
-        with Session(self.engine) as session:
+        with database.session(self.engine) as session:
             try:
-                games = session.scalars(
-                    select(model.Game)
-                    .order_by(model.Game.game_finish_time.desc())
-                    .filter_by(game_state=model.GameState.FINISHED)
-                    .limit(game_limit)
-                ).all()
+                games = readmodels.finished_games(session, game_limit)
                 if not games:
                     return Err(f"No games found.")
                 embeds = []
@@ -555,9 +718,9 @@ Living rules reference (Prophecy of Kings)
         self, game_id: int, property: Optional[str], value: Optional[str]
     ) -> Result[discord.Embed]:
         """Configure a game session. For example !config factions_per_player 5. !config to show current settings."""
-        with Session(self.engine) as session:
+        with database.session(self.engine) as session:
             try:
-                game = session.get(model.Game, game_id)
+                game = self.cache.get(session, game_id)
                 if not game:
                     return Err("No lobby found.")
 
@@ -651,40 +814,47 @@ Living rules reference (Prophecy of Kings)
                 logging.exception("Error configuring lobby")
                 return Err("An error occurred while configuring the lobby.")
 
+    def _settings_polls(self, game_id: int) -> List[Tuple[int, int]]:
+        with database.session(self.engine) as session:
+            return [
+                (poll.thread_id, poll.message_id)
+                for poll in session.scalars(select(model.SettingsPoll).filter_by(game_id=game_id))
+            ]
+
+    def _apply_settings(self, game_id: int, answers: List[Tuple[str, str]]) -> None:
+        with database.session(self.engine) as session:
+            game_settings = session.get(model.GameSettings, game_id)
+            for question, answer in answers:
+                # Coerce the poll answer into the type we want.
+                t = type(getattr(game_settings, question))
+                setattr(game_settings, question, t(answer))
+            session.commit()
+
     async def apply_poll_results(self, game_id: int) -> Result[str]:
-        with Session(self.engine) as session:
-            try:
-                messages = session.scalars(
-                    select(model.SettingsPoll)
-                    .filter_by(game_id=game_id)
-                ).all()
-                lines = ["Poll results are:"]
-                polls = []
-
-                if not messages:
-                    return Err("Polls can not be found")
-
-                thread = self.bot.get_channel(messages[0].thread_id)
-                if not isinstance(thread, discord.Thread):
-                    return Err("Polls can not be found")
-                msgs = await asyncio.gather(*[thread.fetch_message(message.message_id) for message in messages])
-
-                for msg in msgs:
-                    if not msg.poll:
-                        continue
-                    poll = msg.poll
-                    answer = max(poll.answers, key=lambda c: c.vote_count)
-                    lines.append(f"{poll.question}: {answer.text} with {answer.vote_count}")
-
-                    game_settings = session.get(model.GameSettings, game_id)
-
-                    # Coerce the poll answer into the type we want.
-                    t = type(getattr(game_settings, poll.question))
-                    setattr(game_settings, poll.question, t(answer.text))
-
-                lines.append("See !config for the updated values.")
-                session.commit()
-                return Ok("\n".join(lines))
-            except Exception as e:
-                logging.exception("Error fetching polls data")
-                return Err("An error occurred while fetching the game data.")
+        try:
+            polls = await self.database.run(self._settings_polls, game_id)
+            lines = ["Poll results are:"]
+
+            if not polls:
+                return Err("Polls can not be found")
+
+            thread = self.bot.get_channel(polls[0][0])
+            if not isinstance(thread, discord.Thread):
+                return Err("Polls can not be found")
+            msgs = await asyncio.gather(*[thread.fetch_message(message_id) for _, message_id in polls])
+
+            answers = []
+            for msg in msgs:
+                if not msg.poll:
+                    continue
+                poll = msg.poll
+                answer = max(poll.answers, key=lambda c: c.vote_count)
+                lines.append(f"{poll.question}: {answer.text} with {answer.vote_count}")
+                answers.append((poll.question, answer.text))
+
+            await self.database.write(self._apply_settings, game_id, answers)
+            lines.append("See !config for the updated values.")
+            return Ok("\n".join(lines))
+        except Exception as e:
+            logging.exception("Error fetching polls data")
+            return Err("An error occurred while fetching the game data.")
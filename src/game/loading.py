@@ -0,0 +1,48 @@
+import os
+
+from sqlalchemy.orm import joinedload, raiseload, selectinload
+from sqlalchemy.orm.interfaces import LoaderOption
+from typing import Tuple
+
+from .model import Game, GamePlayer
+
+# Loader profiles: what each read path uses, loaded up front in a fixed number of queries.
+# The listings don't load entities at all, see readmodels.
+#
+# With TI4_STRICT_LOADING=1 the profiles of the hot paths also mark every other relationship as
+# raise, so a path that starts touching something it didn't load fails loudly instead of issuing
+# a query per row. Some statements are built with their profile at import, so set it before the
+# bot starts.
+STRICT_LOADING_ENV = "TI4_STRICT_LOADING"
+
+
+def strict() -> bool:
+    return os.environ.get(STRICT_LOADING_ENV, "") == "1"
+
+
+def _profile(*options: LoaderOption) -> Tuple[LoaderOption, ...]:
+    if strict():
+        return (*options, raiseload("*"))
+    return options
+
+
+def game_aggregate() -> Tuple[LoaderOption, ...]:
+    """Settings, players with names and standings of one game. Used by GameCache.
+
+    Cached snapshots are merged into other sessions, where they are used like any other game, so this one never raises.
+    """
+    return (
+        joinedload(Game.game_settings),
+        selectinload(Game.game_players).joinedload(GamePlayer.player),
+        selectinload(Game.game_players).selectinload(GamePlayer.result),
+    )
+
+
+def standings() -> Tuple[LoaderOption, ...]:
+    """The players and their standings, to find the winner."""
+    return _profile(selectinload(Game.game_players).selectinload(GamePlayer.result))
+
+
+def players_with_names() -> Tuple[LoaderOption, ...]:
+    """For queries on GamePlayer whose rows are shown by name."""
+    return _profile(joinedload(GamePlayer.player))
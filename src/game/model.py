@@ -1,7 +1,7 @@
 import enum
 
 from datetime import datetime
-from sqlalchemy import ForeignKey, DateTime, Integer, String, Enum, Boolean, JSON
+from sqlalchemy import ForeignKey, ForeignKeyConstraint, DateTime, Index, Integer, String, Enum, Boolean, JSON
 from sqlalchemy.orm import Mapped, relationship, mapped_column
 from sqlalchemy.sql import func
 from typing import Optional, List
@@ -26,6 +26,12 @@ class DraftingMode(enum.Enum):
 
 class GamePlayer(models.Base):
     __tablename__ = "game_player"
+    __table_args__ = (
+        # A player's games, for the achievement rules.
+        Index("ix_game_player_player", "player_id"),
+        # Standings of a game.
+        Index("ix_game_player_points", "game_id", "points"),
+    )
     game_id: Mapped[int] = mapped_column(ForeignKey("game.game_id"), primary_key=True)
     player_id: Mapped[int] = mapped_column(
         ForeignKey("player.player_id"), primary_key=True
@@ -44,13 +50,22 @@ class GamePlayer(models.Base):
     # Used in picks and bans
     bans: Mapped[Optional[List[str]]] = mapped_column(JSON, default=[])
 
+    # Bumped on every UPDATE; a concurrent change to the draft state makes the flush fail.
+    version: Mapped[int] = mapped_column(Integer, nullable=False, default=1)
+    __mapper_args__ = {"version_id_col": version}
+
     # Relationships
     game: Mapped["Game"] = relationship("Game", back_populates="game_players")
     player: Mapped["Player"] = relationship("Player", back_populates="game_players")
+    result: Mapped[Optional["GameResult"]] = relationship(
+        "GameResult", back_populates="game_player", cascade="all, delete-orphan", passive_deletes=True
+    )
 
 
 class Game(models.Base):
     __tablename__ = "game"
+    # Listings by state, most recently finished first.
+    __table_args__ = (Index("ix_game_state_finish_time", "game_state", "game_finish_time"),)
     game_id: Mapped[int] = mapped_column(Integer, primary_key=True)
     game_state: Mapped[GameState] = mapped_column("game_state", Enum(GameState))
     name: Mapped[str] = mapped_column("name")
@@ -65,12 +80,56 @@ class Game(models.Base):
     turn: Mapped[int] = mapped_column(Integer, default=0)
 
     map_string: Mapped[List[int]] = mapped_column(JSON, default=[])
+
+    # Bumped on every UPDATE; a concurrent change to the game makes the flush fail.
+    version: Mapped[int] = mapped_column(Integer, nullable=False, default=1)
+    __mapper_args__ = {"version_id_col": version}
+
     game_players: Mapped[List["GamePlayer"]] = relationship(
         "GamePlayer", back_populates="game", cascade="all"
     )
     game_settings: Mapped["GameSettings"] = relationship(
         "GameSettings", back_populates="game", cascade="all"
     )
+    game_results: Mapped[List["GameResult"]] = relationship(
+        "GameResult", back_populates="game", viewonly=True
+    )
+
+
+# Final standings of a finished game. Written when the game is finished and
+# rewritten when an admin re-finishes it, so readers never have to work out
+# the max points per game themselves.
+class GameResult(models.Base):
+    __tablename__ = "game_result"
+    game_id: Mapped[int] = mapped_column(
+        ForeignKey("game.game_id", ondelete="CASCADE"), primary_key=True
+    )
+    player_id: Mapped[int] = mapped_column(
+        ForeignKey("player.player_id"), primary_key=True
+    )
+    points: Mapped[int] = mapped_column(Integer)
+    faction: Mapped[Optional[str]] = mapped_column(String)
+
+    # 1 is first place. Players with equal points share a placement.
+    placement: Mapped[int] = mapped_column(Integer)
+    # Nobody finished with more points.
+    winner: Mapped[bool] = mapped_column(Boolean)
+    # Nobody finished with fewer points.
+    loser: Mapped[bool] = mapped_column(Boolean)
+
+    __table_args__ = (
+        ForeignKeyConstraint(
+            ["game_id", "player_id"],
+            ["game_player.game_id", "game_player.player_id"],
+            ondelete="CASCADE",
+        ),
+        # A player's results, for the stats triggers.
+        Index("ix_game_result_player", "player_id"),
+    )
+
+    game: Mapped["Game"] = relationship("Game", back_populates="game_results", viewonly=True)
+    game_player: Mapped["GamePlayer"] = relationship("GamePlayer", back_populates="result")
+
 
 class GameSettings(models.Base):
     __tablename__ = "game_settings"
@@ -98,8 +157,19 @@ class SettingsPoll(models.Base):
     thread_id: Mapped[int] = mapped_column(Integer, primary_key=True)
 
 
+# Deadline of the pick or ban a game's draft is waiting on. Loaded into timers.DeadlineScheduler at startup.
+class DraftTimer(models.Base):
+    __tablename__ = "draft_timer"
+    game_id: Mapped[int] = mapped_column(ForeignKey("game.game_id", ondelete="CASCADE"), primary_key=True)
+    deadline: Mapped[datetime] = mapped_column(DateTime, nullable=False)
+    # Picks and bans made when the deadline was set. Each one moves the draft on and sets a new deadline.
+    step: Mapped[int] = mapped_column(Integer, nullable=False)
+
+
 class Player(models.Base):
     __tablename__ = "player"
+    # Players are looked up by name in commands and achievement rules.
+    __table_args__ = (Index("ix_player_name", "name"),)
     player_id: Mapped[int] = mapped_column(Integer, primary_key=True)
     name: Mapped[str] = mapped_column(String)
 
@@ -0,0 +1,97 @@
+from collections import defaultdict
+from dataclasses import dataclass
+from sqlalchemy import Row, bindparam, func, select
+from sqlalchemy.orm import Session
+from typing import Dict, List, Optional, Sequence
+
+from .model import Game, GamePlayer, GameResult, GameState, Player
+
+# Read models: what the listings show, selected as plain rows. Nothing is added to the
+# session's identity map or tracked for changes, so formatting a page costs only the rows.
+
+
+@dataclass(frozen=True, slots=True)
+class LobbySummary:
+    game_id: int
+    name: str
+    players: int
+
+
+@dataclass(frozen=True, slots=True)
+class FinishedGame:
+    game_id: int
+    name: str
+    players: int
+    winner_name: Optional[str]
+    winner_faction: Optional[str]
+
+
+_player_count = (
+    select(func.count())
+    .where(GamePlayer.game_id == Game.game_id)
+    .correlate(Game)
+    .scalar_subquery()
+)
+
+_LOBBIES = (
+    select(Game.game_id, Game.name, _player_count)
+    .where(Game.game_state == GameState.LOBBY)
+    .order_by(Game.lobby_create_time.desc())
+)
+
+_FINISHED_GAMES = (
+    select(Game.game_id, Game.name)
+    .where(Game.game_state == GameState.FINISHED)
+    .order_by(Game.game_finish_time.desc())
+    .limit(bindparam("limit"))
+)
+
+_STANDINGS = (
+    select(GamePlayer.game_id, Player.name, GamePlayer.faction, GamePlayer.points, GameResult.winner)
+    .join(Player, Player.player_id == GamePlayer.player_id)
+    .outerjoin(
+        GameResult,
+        (GameResult.game_id == GamePlayer.game_id) & (GameResult.player_id == GamePlayer.player_id),
+    )
+    .where(GamePlayer.game_id.in_(bindparam("game_ids", expanding=True)))
+    .order_by(GamePlayer.game_id, GamePlayer.player_id)
+)
+
+
+def lobbies(session: Session) -> List[LobbySummary]:
+    """Open lobbies, newest first."""
+    return [LobbySummary(*row) for row in session.execute(_LOBBIES)]
+
+
+def finished_games(session: Session, limit: int) -> List[FinishedGame]:
+    """The last `limit` finished games with their winners, in two queries."""
+    games = session.execute(_FINISHED_GAMES, {"limit": limit}).all()
+    if not games:
+        return []
+
+    standings: Dict[int, List[Row]] = defaultdict(list)
+    for row in session.execute(_STANDINGS, {"game_ids": [game.game_id for game in games]}):
+        standings[row.game_id].append(row)
+
+    summaries = []
+    for game in games:
+        players = standings[game.game_id]
+        winner = _winner(players)
+        summaries.append(FinishedGame(
+            game_id=game.game_id,
+            name=game.name,
+            players=len(players),
+            winner_name=winner.name if winner else None,
+            winner_faction=winner.faction if winner else None,
+        ))
+    return summaries
+
+
+def _winner(players: Sequence[Row]) -> Optional[Row]:
+    # As GameController.winner: the recorded winner, else the most points.
+    if not players:
+        return None
+    winner = next((player for player in players if player.winner), None)
+    if winner is not None:
+        return winner
+    return max(players, key=lambda player: player.points or 0)
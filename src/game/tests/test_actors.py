@@ -0,0 +1,72 @@
+import asyncio
+import contextvars
+import pytest
+from src.game.actors import GameActors
+
+
+@pytest.mark.asyncio
+async def test_commands_for_a_game_run_in_order():
+    actors = GameActors()
+    running = []
+    log = []
+
+    async def command(name):
+        running.append(name)
+        assert len(running) == 1, "two commands for the same game overlapped"
+        await asyncio.sleep(0.01)
+        log.append(name)
+        running.remove(name)
+        return name
+
+    results = await asyncio.gather(*(actors.submit(1, lambda n=n: command(n)) for n in range(5)))
+    assert results == log == list(range(5))
+
+    metrics = actors.metrics()[1]
+    assert metrics.processed == 5
+    assert metrics.max_depth >= 4
+    assert metrics.max_wait >= 0.03
+
+
+@pytest.mark.asyncio
+async def test_games_run_concurrently_and_errors_reach_the_caller():
+    actors = GameActors()
+    both_started = asyncio.Event()
+    started = set()
+
+    async def command(game_id):
+        started.add(game_id)
+        if len(started) == 2:
+            both_started.set()
+        await asyncio.wait_for(both_started.wait(), 1)
+
+    await asyncio.gather(actors.submit(1, lambda: command(1)), actors.submit(2, lambda: command(2)))
+
+    async def failing():
+        raise ValueError("boom")
+
+    with pytest.raises(ValueError):
+        await actors.submit(1, failing)
+    assert await actors.submit(1, lambda: asyncio.sleep(0, "still serving")) == "still serving"
+
+
+@pytest.mark.asyncio
+async def test_idle_actor_stops():
+    actors = GameActors(idle_timeout=0.01)
+    await actors.submit(1, lambda: asyncio.sleep(0))
+    await asyncio.sleep(0.05)
+    assert 1 not in actors._actors
+    assert actors.metrics() == {}
+
+
+@pytest.mark.asyncio
+async def test_commands_run_in_the_callers_context():
+    actors = GameActors()
+    command_name = contextvars.ContextVar("command_name", default=None)
+
+    async def command():
+        return command_name.get()
+
+    command_name.set("draft")
+    assert await actors.submit(1, command) == "draft"
+    command_name.set("finish")
+    assert await actors.submit(1, command) == "finish"
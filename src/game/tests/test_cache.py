@@ -0,0 +1,140 @@
+import gc
+import threading
+
+import pytest
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import sessionmaker
+from src.database import Database
+from src.game import cache, gamelogic, model
+from src.models import Base
+from src.typing import *
+
+
+@pytest.fixture(scope="function")
+def db():
+    engine = create_engine("sqlite:///:memory:")
+    Base.metadata.create_all(engine)
+    session = sessionmaker(bind=engine)()
+    settings = model.GameSettings(drafting_mode=model.DraftingMode.EXCLUSIVE_POOL, factions_per_player=2)
+    session.add(model.Game(game_id=7, game_state=model.GameState.DRAFT, name="Cached", game_settings=settings))
+    for i, factions in enumerate([["A", "B"], ["C", "D"]]):
+        session.add(model.Player(player_id=i + 1, name=f"P{i + 1}"))
+        session.add(model.GamePlayer(game_id=7, player_id=i + 1, turn_order=i, factions=factions))
+    session.commit()
+    logic = gamelogic.GameLogic(bot=None, engine=engine, database=Database(engine))
+    yield session, logic, engine
+    session.close()
+    logic.database.close()
+
+
+def count_statements(engine, fn):
+    statements = []
+    listener = lambda *args: statements.append(args[2])
+    event.listen(engine, "before_cursor_execute", listener)
+    try:
+        fn()
+    finally:
+        event.remove(engine, "before_cursor_execute", listener)
+    return len(statements)
+
+
+def test_repeated_draft_prompt_is_served_from_cache(db):
+    _, logic, engine = db
+    assert count_statements(engine, lambda: logic.draft(1, 7, None)) > 0
+    assert count_statements(engine, lambda: logic.draft(1, 7, None)) == 0
+    assert logic.cache.hits == 1
+
+
+def test_commit_invalidates_cached_game(db):
+    session, logic, _ = db
+    logic.draft(1, 7, None)
+    assert isinstance(logic.draft(1, 7, "A"), Ok)
+    assert 7 not in logic.cache._games
+
+    # The next read reloads the drafted faction and the new turn.
+    assert "You have drafted A" in logic.draft(1, 7, "B").value.description
+    game = logic.cache.get(session, 7)
+    assert game.turn == 1
+    assert logic.controller.current_drafter(session, game).player_id == 2
+
+
+def test_sessions_get_their_own_copy(db):
+    _, logic, engine = db
+    Session = sessionmaker(bind=engine)
+    with Session() as first:
+        logic.cache.get(first, 7).game_players[0].factions.remove("A")
+    with Session() as second:
+        assert logic.cache.get(second, 7).game_players[0].factions == ["A", "B"]
+
+
+def test_finished_games_are_not_cached(db):
+    session, logic, _ = db
+    session.get(model.Game, 7).game_state = model.GameState.FINISHED
+    session.commit()
+    with sessionmaker(bind=logic.engine)() as other:
+        assert logic.cache.get(other, 7).game_state == model.GameState.FINISHED
+    assert 7 not in logic.cache._games
+
+
+def test_non_game_channel_is_answered_without_queries(db):
+    _, logic, engine = db
+    assert count_statements(engine, lambda: logic.join(123, 1, "P1")) > 0
+    assert count_statements(engine, lambda: logic.join(123, 1, "P1")) == 0
+    assert count_statements(engine, lambda: logic.game(123)) == 0
+    assert logic.cache.channels.is_known_miss(123)
+
+
+def test_new_lobby_clears_negative_cache(db):
+    session, logic, _ = db
+    logic.join(8, 1, "P1")
+    assert logic.cache.channels.is_known_miss(8)
+
+    session.add(model.Game(game_id=8, game_state=model.GameState.LOBBY, name="New"))
+    session.commit()
+    assert logic.cache.channels.is_game(8)
+    assert "has joined lobby" in logic.join(8, 1, "P1").value
+
+    game = session.get(model.Game, 8)
+    session.delete(game)
+    session.commit()
+    assert not logic.cache.channels.is_game(8)
+
+
+@pytest.mark.asyncio
+async def test_state_read_before_the_writer_commits_is_dropped(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'cache.db'}")
+    Base.metadata.create_all(engine)
+    with sessionmaker(bind=engine)() as session:
+        session.add(model.Game(game_id=9, game_state=model.GameState.LOBBY, name="Lobby"))
+        session.commit()
+    logic = gamelogic.GameLogic(bot=None, engine=engine, database=Database(engine))
+
+    def join_then_read_elsewhere():
+        assert isinstance(logic.join(9, 1, "P1"), Ok)
+
+        # Another connection, while the batch is still open: it caches the game without the join.
+        def read():
+            with sessionmaker(bind=engine)() as other:
+                assert logic.cache.get(other, 9).game_players == []
+
+        reader = threading.Thread(target=read)
+        reader.start()
+        reader.join()
+        assert 9 in logic.cache._games
+
+    try:
+        await logic.database.write(join_then_read_elsewhere)
+        with sessionmaker(bind=engine)() as session:
+            assert [player.player_id for player in logic.cache.get(session, 9).game_players] == [1]
+    finally:
+        logic.database.close()
+
+
+def test_caches_stop_listening_once_collected(db):
+    _, logic, engine = db
+    assert logic.cache in cache._caches
+    extra = cache.GameCache(engine)
+    assert len(cache._caches) >= 2
+    del extra
+    gc.collect()
+    assert len([c for c in cache._caches if c.engine is engine]) == 1
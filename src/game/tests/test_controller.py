@@ -1,8 +1,9 @@
 import pytest
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
+from sqlalchemy.exc import InvalidRequestError
 from sqlalchemy.orm import sessionmaker
 from src.game.controller import GameController
-from src.game import model
+from src.game import loading, model
 from src.models import Base
 
 
@@ -61,3 +62,75 @@ def test_winner_and_errors(db):
 
     winner = ctrl.winner(session, game)
     assert winner.player.name == "B"
+
+
+def test_record_result_placements_and_refinish(db):
+    session = db
+    game = model.Game(game_state=model.GameState.FINISHED, name="ResultTest")
+    session.add(game)
+    session.flush()
+    for player_id, points in [(1, 10), (2, 10), (3, 4), (4, 7)]:
+        session.add(model.Player(player_id=player_id, name=f"P{player_id}"))
+        session.add(model.GamePlayer(game_id=game.game_id, player_id=player_id, points=points))
+    session.commit()
+
+    ctrl = GameController()
+    ctrl.record_result(session, game)
+    session.commit()
+
+    results = {r.player_id: r for r in session.query(model.GameResult).all()}
+    assert [results[i].placement for i in (1, 2, 4, 3)] == [1, 1, 3, 4]
+    assert results[1].winner and results[2].winner and not results[4].winner
+    assert results[3].loser and not results[4].loser
+    assert ctrl.winner(session, game).player_id in (1, 2)
+
+    # Re-finishing replaces the standings
+    for gp in game.game_players:
+        gp.points = 12 if gp.player_id == 3 else 2
+    ctrl.record_result(session, game)
+    session.commit()
+    assert session.query(model.GameResult).count() == 4
+    assert ctrl.winner(session, game).player_id == 3
+
+
+def test_winner_reads_unloaded_standings_in_one_query(db):
+    session = db
+    game = model.Game(game_id=1, game_state=model.GameState.FINISHED, name="Finished")
+    session.add(game)
+    for player_id, points in [(1, 4), (2, 10), (3, 7)]:
+        session.add(model.Player(player_id=player_id, name=f"P{player_id}"))
+        session.add(model.GamePlayer(game_id=1, player_id=player_id, points=points))
+    session.flush()
+    GameController().record_result(session, game)
+    session.commit()
+    session.expunge_all()
+
+    statements = []
+    event.listen(session.bind, "before_cursor_execute", lambda *args: statements.append(args[2]))
+    game = session.get(model.Game, 1)
+    game.game_players
+    statements.clear()
+    assert GameController().winner(session, game).player_id == 2
+    assert len(statements) == 1
+
+
+def test_strict_loading_turns_lazy_loads_into_errors(db, monkeypatch):
+    session = db
+    session.add(model.Game(game_id=1, game_state=model.GameState.FINISHED, name="Finished"))
+    for player_id, points in [(1, 4), (2, 10)]:
+        session.add(model.Player(player_id=player_id, name=f"P{player_id}"))
+        session.add(model.GamePlayer(game_id=1, player_id=player_id, points=points))
+    session.commit()
+    session.expunge_all()
+
+    monkeypatch.setenv(loading.STRICT_LOADING_ENV, "1")
+    game = session.get(model.Game, 1, options=loading.standings())
+    # What the profile loads is there; anything else is a mistake in the read path.
+    assert GameController().winner(session, game).player_id == 2
+    with pytest.raises(InvalidRequestError):
+        game.game_settings
+
+    monkeypatch.delenv(loading.STRICT_LOADING_ENV)
+    session.expunge_all()
+    game = session.get(model.Game, 1, options=loading.standings())
+    assert game.game_settings is None
@@ -1,7 +1,9 @@
 import pytest
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
-from src.game import gamelogic, model
+from sqlalchemy import create_engine, event, text
+from sqlalchemy.orm import Session, sessionmaker
+from sqlalchemy.orm.exc import StaleDataError
+from src.database import Database
+from src.game import controller, gamelogic, model
 from src.models import Base
 from src.typing import *
 
@@ -14,9 +16,10 @@ def db():
     SessionLocal = sessionmaker(bind=engine)
     session = SessionLocal()
     # GameLogic expects a bot and engine, but tests only use engine
-    logic = gamelogic.GameLogic(bot=None, engine=engine)
+    logic = gamelogic.GameLogic(bot=None, engine=engine, database=Database(engine))
     yield session, logic
     session.close()
+    logic.database.close()
 
 
 def test_join_new_player(db):
@@ -246,3 +249,146 @@ def test_games_summary(db):
     assert "G1" in embed.description
     assert "G2" in embed.description
     assert "G3" in embed.description
+
+
+def test_finish_writes_game_result(db):
+    session, logic = db
+    game = model.Game(game_state="STARTED", name="ResultFlow")
+    session.add(game)
+    session.commit()
+    for i in range(1, 3):
+        session.add(model.Player(player_id=i, name=f"P{i}"))
+        session.add(model.GamePlayer(game_id=game.game_id, player_id=i, turn_order=i))
+    session.commit()
+
+    assert isinstance(logic.finish(False, game.game_id, "3 9"), Ok)
+    assert isinstance(logic.finish(True, game.game_id, "9 3"), Ok)
+
+    results = session.query(model.GameResult).filter_by(game_id=game.game_id, winner=True).all()
+    assert [r.player_id for r in results] == [1]
+
+
+def draft_game(session):
+    settings = model.GameSettings(drafting_mode=model.DraftingMode.EXCLUSIVE_POOL, factions_per_player=2)
+    game = model.Game(game_id=7, game_state=model.GameState.DRAFT, name="Versioned", game_settings=settings)
+    session.add(game)
+    for i, factions in enumerate([["A", "B"], ["C", "D"]]):
+        session.add(model.Player(player_id=i + 1, name=f"P{i + 1}"))
+        session.add(model.GamePlayer(game_id=7, player_id=i + 1, turn_order=i, factions=factions))
+    session.commit()
+    return game
+
+
+def test_game_version_detects_concurrent_update(db):
+    session, logic = db
+    draft_game(session)
+    other = sessionmaker(bind=logic.engine)()
+
+    mine, theirs = session.get(model.Game, 7), other.get(model.Game, 7)
+    theirs.turn = 1
+    other.commit()
+    mine.turn = 1
+    with pytest.raises(StaleDataError):
+        session.commit()
+    other.close()
+
+
+def test_draft_retries_with_fresh_state_after_conflict(db):
+    session, logic = db
+    draft_game(session)
+
+    def concurrent_update(s):
+        s.connection().execute(text("UPDATE game SET version = version + 1 WHERE game_id = 7"))
+
+    event.listen(Session, "before_commit", concurrent_update, once=True)
+    result = logic.draft(1, 7, "A")
+    assert isinstance(result, Ok)
+
+    session.expire_all()
+    game = session.get(model.Game, 7)
+    assert game.turn == 1
+    assert game.version == 3
+
+
+def finished_games(session, count, first_id=1):
+    ctrl = controller.GameController()
+    for game_id in range(first_id, first_id + count):
+        game = model.Game(game_id=game_id, game_state="FINISHED", name=f"G{game_id}")
+        session.add(game)
+        for player_id, points in [(1, 10), (2, 7), (3, 4)]:
+            if session.get(model.Player, player_id) is None:
+                session.add(model.Player(player_id=player_id, name=f"P{player_id}"))
+            session.add(model.GamePlayer(game_id=game_id, player_id=player_id, points=points, faction=f"F{player_id}"))
+        session.flush()
+        ctrl.record_result(session, game)
+    session.commit()
+
+
+def test_games_listing_takes_constant_queries(db):
+    session, logic = db
+    statements = []
+    event.listen(logic.engine, "before_cursor_execute", lambda *args: statements.append(args[2]))
+
+    finished_games(session, 5)
+    statements.clear()
+    assert "P1 (F1)" in logic.games().value.description
+    few = len(statements)
+
+    finished_games(session, 35, first_id=6)
+    statements.clear()
+    logic.games(game_limit=40)
+    assert len(statements) == few
+
+    session.add(model.Game(game_id=100, game_state="LOBBY", name="Open"))
+    session.commit()
+    assert "Open. 0 player(s)" in logic.lobbies().value
+
+
+def test_games_listing_winner_without_standings(db):
+    session, logic = db
+    finished_games(session, 1)
+    # Finished before results were recorded: the most points win. No players: no winner.
+    session.execute(text("DELETE FROM game_result"))
+    session.add(model.Game(game_id=2, game_state="FINISHED", name="Empty"))
+    session.commit()
+
+    description = logic.games().value.description
+    assert "G1 (players 3)" in description and "P1 (F1)" in description
+    assert "Empty (players 0)" in description and "Winner: Unknown" in description
+
+
+def test_nested_logic_calls_share_one_unit_of_work(db):
+    session, logic = db
+    finished_games(session, 1)
+    session.add(model.GameSettings(game_id=1))
+    session.commit()
+    checkouts = []
+    event.listen(logic.engine, "checkout", lambda *args: checkouts.append(args))
+    statements = []
+    event.listen(logic.engine, "before_cursor_execute", lambda *args: statements.append(args[2]))
+
+    # game_from_name calls game, which calls config. They all use the session game_from_name opened.
+    assert "🏆" in logic.game_from_name("G1").value.description
+    assert len(checkouts) == 1
+    # The name, then the aggregate once: config finds the game and its settings in the identity map.
+    assert len(statements) == 4
+    assert sum("FROM game LEFT OUTER JOIN game_settings" in statement for statement in statements) == 1
+
+
+class NoThreads:
+    async def create_thread(self, **kwargs):
+        raise RuntimeError("Missing permissions")
+
+
+@pytest.mark.asyncio
+async def test_lobby_is_not_created_when_its_thread_cant_be(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'lobby.db'}")
+    Base.metadata.create_all(engine)
+    logic = gamelogic.GameLogic(bot=None, engine=engine, database=Database(engine))
+    try:
+        result = await logic.lobby(NoThreads(), 100, 1, "Alice", "Lobby")
+        assert isinstance(result, Err)
+        with Session(engine) as session:
+            assert session.get(model.Game, 100) is None
+    finally:
+        logic.database.close()
@@ -0,0 +1,196 @@
+import asyncio
+import pytest
+from datetime import datetime, timedelta
+from sqlalchemy import create_engine, update
+from sqlalchemy.orm import sessionmaker
+from src.database import Database
+from src.game import gamelogic, model, timers
+from src.models import Base
+from src.typing import *
+
+
+@pytest.fixture(scope="function")
+def db():
+    engine = create_engine("sqlite:///:memory:")
+    Base.metadata.create_all(engine)
+    session = sessionmaker(bind=engine)()
+    for game_id, mode, state in [
+        (7, model.DraftingMode.EXCLUSIVE_POOL, model.GameState.DRAFT),
+        (8, model.DraftingMode.PICKS_AND_BANS, model.GameState.BAN),
+    ]:
+        settings = model.GameSettings(drafting_mode=mode, factions_per_player=2, bans_per_player=1)
+        session.add(model.Game(game_id=game_id, game_state=state, name=f"G{game_id}", game_settings=settings))
+        for i, factions in enumerate([["A", "B"], ["C", "D"]]):
+            if game_id == 7:
+                session.add(model.Player(player_id=i + 1, name=f"P{i + 1}"))
+            if mode == model.DraftingMode.PICKS_AND_BANS:
+                factions = ["A", "B", "C", "D"]
+            session.add(model.GamePlayer(game_id=game_id, player_id=i + 1, turn_order=i, factions=factions))
+    session.commit()
+    logic = gamelogic.GameLogic(bot=None, engine=engine, database=Database(engine), draft_timeout=timedelta(hours=1))
+    yield session, logic, engine
+    session.close()
+    logic.database.close()
+
+
+def expire(session, game_id):
+    session.execute(update(model.DraftTimer).filter_by(game_id=game_id).values(deadline=datetime.now() - timedelta(seconds=1)))
+    session.commit()
+
+
+def test_scheduler_pops_the_latest_deadline_of_each_key_in_order():
+    scheduler = timers.DeadlineScheduler(fire=None)
+    now = datetime(2025, 1, 1)
+    scheduler.schedule("a", now + timedelta(minutes=5), 1)
+    scheduler.schedule("b", now + timedelta(minutes=1), 1)
+    scheduler.schedule("c", now + timedelta(minutes=2), 1)
+    # Moved on: the first deadline of a no longer counts.
+    scheduler.schedule("a", now + timedelta(minutes=3), 2)
+    scheduler.cancel("c")
+
+    assert scheduler.next_deadline() == now + timedelta(minutes=1)
+    assert scheduler.pop_due(now + timedelta(minutes=10)) == [("b", 1), ("a", 2)]
+    assert len(scheduler) == 0 and scheduler.next_deadline() is None
+
+
+def test_scheduler_compacts_replaced_entries():
+    scheduler = timers.DeadlineScheduler(fire=None)
+    now = datetime(2025, 1, 1)
+    for step in range(1000):
+        scheduler.schedule("game", now + timedelta(seconds=step), step)
+    assert len(scheduler._heap) < 100
+    assert scheduler.pop_due(now + timedelta(days=1)) == [("game", 999)]
+
+
+@pytest.mark.asyncio
+async def test_scheduler_fires_once_the_deadline_passes():
+    fired = asyncio.Queue()
+
+    async def fire(key, step):
+        await fired.put((key, step))
+
+    scheduler = timers.DeadlineScheduler(fire)
+    scheduler.start()
+    scheduler.schedule("later", datetime.now() + timedelta(hours=1), 1)
+    scheduler.schedule("soon", datetime.now() + timedelta(milliseconds=50), 3)
+    assert await asyncio.wait_for(fired.get(), 1) == ("soon", 3)
+    assert len(scheduler) == 1
+    scheduler.stop()
+
+
+def test_picks_move_the_deadline_and_a_missed_one_is_made_for_the_drafter(db):
+    session, logic, _ = db
+    assert logic.deadline(7) is None
+    # Asking for the options isn't a pick.
+    logic.draft(1, 7, None)
+    assert logic.deadline(7) is None
+
+    assert isinstance(logic.draft(1, 7, "A"), Ok)
+    deadline, step = logic.deadline(7)
+    assert step == 1 and deadline > datetime.now() + timedelta(minutes=59)
+    # Not due yet.
+    assert logic.auto_pick(7, step) is None
+
+    expire(session, 7)
+    assert logic.auto_pick(7, 0) is None
+    result = logic.auto_pick(7, step)
+    assert "ran out of time" in result.value.description
+
+    session.expire_all()
+    game = session.get(model.Game, 7)
+    assert game.game_state == model.GameState.STARTED
+    assert session.get(model.GamePlayer, (7, 2)).faction in ["C", "D"]
+    assert logic.deadline(7) is None
+
+
+def test_a_missed_ban_is_made_for_the_player(db):
+    session, logic, _ = db
+    logic.ban(1, 8, "A")
+    _, step = logic.deadline(8)
+    expire(session, 8)
+
+    assert isinstance(logic.auto_pick(8, step), Ok)
+    session.expire_all()
+    assert session.get(model.GamePlayer, (8, 2)).bans[0] in ["B", "C", "D"]
+    assert session.get(model.Game, 8).game_state == model.GameState.DRAFT
+    assert logic.deadline(8)[1] == 2
+
+
+def test_a_refused_pick_is_reported_and_disarms_the_deadline(db, monkeypatch):
+    session, logic, _ = db
+    logic.draft(1, 7, "A")
+    _, step = logic.deadline(7)
+    expire(session, 7)
+    monkeypatch.setattr(logic, "draft", lambda *args: Err("That faction is taken."))
+
+    result = logic.auto_pick(7, step)
+    assert isinstance(result, Err) and "That faction is taken." in result.msg
+    # Nothing fires again for this step.
+    assert logic.deadline(7) is None
+    assert logic.auto_pick(7, step) is None
+
+
+def test_a_refused_ban_is_reported_and_disarms_the_deadline(db, monkeypatch):
+    session, logic, _ = db
+    logic.ban(1, 8, "A")
+    _, step = logic.deadline(8)
+    expire(session, 8)
+    monkeypatch.setattr(logic, "ban", lambda *args: "Faction A has already been banned!")
+
+    result = logic.auto_pick(8, step)
+    assert isinstance(result, Err) and "already been banned" in result.msg
+    assert logic.deadline(8) is None
+
+
+def picks_game(session, game_id, mode):
+    # Three players, so a pick made for the second leaves a drafter after it.
+    session.add(model.Player(player_id=3, name="P3"))
+    settings = model.GameSettings(drafting_mode=mode, factions_per_player=2, bans_per_player=1)
+    session.add(model.Game(game_id=game_id, game_state=model.GameState.DRAFT, name=f"G{game_id}", game_settings=settings))
+    for i in range(3):
+        session.add(model.GamePlayer(
+            game_id=game_id, player_id=i + 1, turn_order=i, factions=["A", "B", "C", "D", "E", "F"],
+        ))
+    session.commit()
+
+
+@pytest.mark.parametrize("mode", [model.DraftingMode.PICKS_ONLY, model.DraftingMode.PICKS_AND_BANS])
+def test_a_missed_pick_is_made_in_shared_pool_drafts(db, mode):
+    session, logic, _ = db
+    picks_game(session, 9, mode)
+    logic.draft(1, 9, "A")
+    _, step = logic.deadline(9)
+    expire(session, 9)
+
+    result = logic.auto_pick(9, step)
+    assert isinstance(result, Ok)
+    session.expire_all()
+    faction = session.get(model.GamePlayer, (9, 2)).faction
+    assert faction in ["B", "C", "D", "E", "F"]
+    assert f"so {faction} was chosen for them" in result.value.description
+    assert "Next drafter is <@3>" in result.value.description
+    # The deadline of the next drafter's pick.
+    timer = session.get(model.DraftTimer, 9)
+    assert timer is not None and timer.step == step + 1 and timer.deadline > datetime.now()
+
+    # The last pick leaves nobody to pick, so there is no deadline to miss.
+    expire(session, 9)
+    result = logic.auto_pick(9, step + 1)
+    assert isinstance(result, Ok) and "was chosen for them" in result.value.description
+    session.expire_all()
+    assert session.get(model.GamePlayer, (9, 3)).faction is not None
+    assert session.get(model.DraftTimer, 9) is None
+    assert logic.auto_pick(9, step + 2) is None
+
+
+def test_a_deadline_left_after_the_last_pick_is_removed(db):
+    session, logic, _ = db
+    picks_game(session, 9, model.DraftingMode.PICKS_ONLY)
+    for player_id, faction in [(1, "A"), (2, "B"), (3, "C")]:
+        logic.draft(player_id, 9, faction)
+    # As armed before nobody being left to pick stopped it.
+    session.add(model.DraftTimer(game_id=9, deadline=datetime.now() - timedelta(seconds=1), step=3))
+    session.commit()
+
+    assert logic.auto_pick(9, 3) is None
+    assert logic.deadline(9) is None
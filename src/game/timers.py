@@ -0,0 +1,163 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import os
+
+from datetime import datetime, timedelta
+from sqlalchemy import bindparam, delete, select
+from sqlalchemy.dialects.sqlite import insert
+from sqlalchemy.orm import Session
+from typing import Awaitable, Callable, Dict, Hashable, List, Mapping, Optional, Tuple
+
+from . import model
+from .. import database
+
+# Hours a drafter has for each pick or ban before one is made for them. 0 turns the deadlines off.
+DRAFT_TIMEOUT_ENV = "TI4_DRAFT_TIMEOUT_HOURS"
+DEFAULT_DRAFT_TIMEOUT = timedelta(hours=24)
+
+DRAFT_STATES = {model.GameState.BAN, model.GameState.DRAFT}
+
+
+def timeout_from_env(env: Mapping[str, str] = os.environ) -> Optional[timedelta]:
+    if DRAFT_TIMEOUT_ENV not in env:
+        return DEFAULT_DRAFT_TIMEOUT
+    hours = float(env[DRAFT_TIMEOUT_ENV])
+    return timedelta(hours=hours) if hours > 0 else None
+
+
+def draft_step(game: model.Game) -> int:
+    """Picks and bans made so far in the game's draft. Every one of them moves the draft on."""
+    return sum(
+        bool(player.faction) + bool(player.strategy_card) + bool(player.position) + len(player.bans or [])
+        for player in game.game_players
+    )
+
+
+def has_drafter(game: model.Game) -> bool:
+    """Whether someone is up to pick or ban. Not after the last pick of a draft that doesn't start the game itself."""
+    return any(player.turn_order == game.turn for player in game.game_players)
+
+
+_ARM = (
+    insert(model.DraftTimer)
+    .values(game_id=bindparam("game_id"), deadline=bindparam("deadline"), step=bindparam("step"))
+    .on_conflict_do_update(
+        index_elements=[model.DraftTimer.game_id],
+        set_={"deadline": bindparam("deadline"), "step": bindparam("step")},
+        # The draft hasn't moved on, so the current deadline stands.
+        where=model.DraftTimer.step != bindparam("step"),
+    )
+)
+_DISARM = delete(model.DraftTimer).where(model.DraftTimer.game_id == bindparam("game_id"))
+
+
+def arm(session: Session, game: model.Game, timeout: Optional[timedelta]) -> None:
+    """Bring the game's deadline up to date in one statement, in the session's transaction.
+
+    A new deadline is set when the draft has moved on since the last one, and the deadline is
+    removed once the game is out of its draft or nobody is left to pick.
+    """
+    if timeout is None or game.game_state not in DRAFT_STATES or not has_drafter(game):
+        session.execute(_DISARM, {"game_id": game.game_id})
+        return
+    session.execute(_ARM, {"game_id": game.game_id, "deadline": datetime.now() + timeout, "step": draft_step(game)})
+
+
+def pending(engine) -> List[Tuple[int, datetime, int]]:
+    """Every deadline of the database: (game_id, deadline, step)."""
+    with database.session(engine) as session:
+        return [
+            tuple(row)
+            for row in session.execute(
+                select(model.DraftTimer.game_id, model.DraftTimer.deadline, model.DraftTimer.step)
+            )
+        ]
+
+
+class DeadlineScheduler:
+    """Calls fire(key, step) when a key's deadline passes, for any number of keys with one task.
+
+    Deadlines are kept in a min-heap, so scheduling is O(log n) and the task only ever sleeps until
+    the earliest one. Rescheduling or cancelling a key leaves its old entry in the heap, to be skipped
+    when it comes up. The deadlines themselves are persisted by the caller and scheduled again at startup.
+    """
+
+    def __init__(self, fire: Callable[[Hashable, int], Awaitable[None]], retry_after: float = 60) -> None:
+        self.fire = fire
+        # A deadline whose fire raised is tried again this many seconds later.
+        self.retry_after = retry_after
+        self._heap: List[Tuple[datetime, int, Hashable, int]] = []
+        self._current: Dict[Hashable, Tuple[datetime, int]] = {}
+        self._order = itertools.count()
+        self._changed = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+
+    def __len__(self) -> int:
+        return len(self._current)
+
+    def schedule(self, key: Hashable, deadline: datetime, step: int) -> None:
+        """Set the key's deadline, replacing the one it had."""
+        if self._current.get(key) == (deadline, step):
+            return
+        self._current[key] = (deadline, step)
+        heapq.heappush(self._heap, (deadline, next(self._order), key, step))
+        if len(self._heap) > 2 * len(self._current) + 64:
+            self._compact()
+        # The task works out again what to sleep until.
+        self._changed.set()
+
+    def cancel(self, key: Hashable) -> None:
+        self._current.pop(key, None)
+
+    def next_deadline(self) -> Optional[datetime]:
+        self._drop_stale()
+        return self._heap[0][0] if self._heap else None
+
+    def pop_due(self, now: datetime) -> List[Tuple[Hashable, int]]:
+        """Remove and return the keys whose deadline is at or before now, earliest first."""
+        due = []
+        while self.next_deadline() is not None and self._heap[0][0] <= now:
+            _, _, key, step = heapq.heappop(self._heap)
+            del self._current[key]
+            due.append((key, step))
+        return due
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run(), name="draft-deadlines")
+
+    def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    async def _run(self) -> None:
+        while True:
+            for key, step in self.pop_due(datetime.now()):
+                await self._fire(key, step)
+
+            self._changed.clear()
+            deadline = self.next_deadline()
+            timeout = None if deadline is None else max((deadline - datetime.now()).total_seconds(), 0)
+            try:
+                await asyncio.wait_for(self._changed.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _fire(self, key: Hashable, step: int) -> None:
+        try:
+            await self.fire(key, step)
+        except Exception:
+            logging.exception("Draft deadline of %s failed, retrying in %.0f s", key, self.retry_after)
+            if key not in self._current:
+                self.schedule(key, datetime.now() + timedelta(seconds=self.retry_after), step)
+
+    def _drop_stale(self) -> None:
+        while self._heap and self._current.get(self._heap[0][2]) != (self._heap[0][0], self._heap[0][3]):
+            heapq.heappop(self._heap)
+
+    def _compact(self) -> None:
+        self._heap = [entry for entry in self._heap if self._current.get(entry[2]) == (entry[0], entry[3])]
+        heapq.heapify(self._heap)
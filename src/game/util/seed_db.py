@@ -52,7 +52,7 @@ def main():
 
     engine = create_engine("sqlite:///app.db", echo=True)
     # Instantiate all the tables.
-    models.Base.metadata.create_all(engine)
+    models.create_all(engine)
 
     with Session(engine) as session:
         for item in items:
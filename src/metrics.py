@@ -0,0 +1,237 @@
+import asyncio
+import bisect
+import contextvars
+import logging
+import os
+import time
+
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Callable, Dict, Iterable, List, Mapping, Optional, Sequence
+from weakref import WeakKeyDictionary, WeakSet
+
+from discord.ext import commands
+
+from . import database
+
+# Write the metrics to this file in Prometheus' text format, e.g. for node_exporter's textfile collector.
+FILE_ENV = "TI4_METRICS_FILE"
+
+# Upper bounds of the command latency buckets, in seconds.
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+@dataclass
+class Histogram:
+    bounds: Sequence[float] = LATENCY_BUCKETS
+    # counts[i] is the number of samples up to bounds[i], and not in an earlier bucket. The last one is above them all.
+    counts: List[int] = field(default_factory=list)
+    count: int = 0
+    total: float = 0.0
+
+    def __post_init__(self) -> None:
+        self.counts = self.counts or [0] * (len(self.bounds) + 1)
+
+    def observe(self, seconds: float) -> None:
+        self.counts[bisect.bisect_left(self.bounds, seconds)] += 1
+        self.count += 1
+        self.total += seconds
+
+    def quantile(self, q: float) -> float:
+        """Upper bound of the bucket holding the q-th quantile. Infinite if it is above every bound."""
+        rank, seen = q * self.count, 0
+        for bound, count in zip(self.bounds, self.counts):
+            seen += count
+            if seen >= rank and seen:
+                return bound
+        return float("inf")
+
+
+@dataclass
+class CommandMetrics:
+    latency: Histogram = field(default_factory=Histogram)
+    calls: int = 0
+    errors: int = 0
+    in_flight: int = 0
+    statements: int = 0
+    # Time the command spent waiting on the database and on Discord's API.
+    db_seconds: float = 0.0
+    discord_seconds: float = 0.0
+
+
+@dataclass
+class _Call:
+    started: float
+    discord_seconds: float = 0.0
+
+
+# The command running in this task, for timing its Discord API calls.
+_current_call: contextvars.ContextVar[Optional[_Call]] = contextvars.ContextVar("current_call", default=None)
+
+
+class MetricsRegistry:
+    """Per-command metrics, recorded by the bot's before_invoke and after_invoke hooks.
+
+    Other parts of the bot add their own numbers with collect, to be read when the metrics are rendered.
+    """
+
+    def __init__(self) -> None:
+        self.commands: Dict[str, CommandMetrics] = {}
+        self._collectors: List[Callable[[], Iterable[str]]] = []
+        self._calls: "WeakKeyDictionary[commands.Context, _Call]" = WeakKeyDictionary()
+        # Contexts that got as far as before_invoke. They stay here after after_invoke, which runs
+        # before on_command_error, so rejected can tell them from commands that never ran.
+        self._invoked: "WeakSet[commands.Context]" = WeakSet()
+
+    def collect(self, collector: Callable[[], Iterable[str]]) -> None:
+        """Add the exposition lines collector returns, see family_lines, sample_line and histogram_lines."""
+        self._collectors.append(collector)
+
+    def command(self, name: str) -> CommandMetrics:
+        return self.commands.setdefault(name, CommandMetrics())
+
+    async def before_invoke(self, ctx: commands.Context) -> None:
+        call = self._calls[ctx] = _Call(time.perf_counter())
+        self._invoked.add(ctx)
+        _current_call.set(call)
+        self.command(ctx.command.qualified_name).in_flight += 1
+
+    async def after_invoke(self, ctx: commands.Context) -> None:
+        call = self._calls.pop(ctx, None)
+        if call is None:
+            return
+        _current_call.set(None)
+        metrics = self.command(ctx.command.qualified_name)
+        metrics.in_flight -= 1
+        metrics.calls += 1
+        metrics.latency.observe(time.perf_counter() - call.started)
+        metrics.discord_seconds += call.discord_seconds
+        if ctx.command_failed:
+            metrics.errors += 1
+        # Counted by Bot.invoke around the whole command.
+        stats = database.current_statements()
+        if stats is not None:
+            metrics.statements += stats.statements
+            metrics.db_seconds += stats.seconds
+
+    def rejected(self, ctx: commands.Context) -> None:
+        """Count a command that failed before it ran, e.g. on its arguments. Called from on_command_error."""
+        if ctx.command is not None and ctx not in self._invoked:
+            self.command(ctx.command.qualified_name).errors += 1
+
+    def instrument_http(self, http) -> None:
+        """Time the Discord API requests made through http, and add them to the command making them."""
+        request = http.request
+
+        async def timed_request(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return await request(*args, **kwargs)
+            finally:
+                call = _current_call.get()
+                if call is not None:
+                    call.discord_seconds += time.perf_counter() - started
+
+        http.request = timed_request
+
+    def render(self) -> str:
+        """Every metric, in Prometheus' text exposition format."""
+        lines = family_lines(
+            "ti4_command_latency_seconds", "histogram", "Time from a command's before_invoke to its after_invoke."
+        )
+        for name, metrics in sorted(self.commands.items()):
+            lines.extend(histogram_lines("ti4_command_latency_seconds", {"command": name}, metrics.latency))
+        for metric, kind, help, attribute in [
+            ("ti4_command_calls_total", "counter", "Commands run.", "calls"),
+            ("ti4_command_errors_total", "counter", "Commands that failed, or were rejected before running.", "errors"),
+            ("ti4_command_in_flight", "gauge", "Commands running now.", "in_flight"),
+            ("ti4_command_statements_total", "counter", "SQL statements issued by commands.", "statements"),
+            ("ti4_command_db_seconds_total", "counter", "Time commands spent in SQL statements.", "db_seconds"),
+            ("ti4_command_discord_seconds_total", "counter", "Time commands spent in Discord API requests.", "discord_seconds"),
+        ]:
+            lines.extend(family_lines(metric, kind, help))
+            for name, metrics in sorted(self.commands.items()):
+                lines.append(sample_line(metric, {"command": name}, getattr(metrics, attribute)))
+
+        for collector in self._collectors:
+            try:
+                lines.extend(collector())
+            except Exception:
+                logging.exception("Metrics collector %s failed", collector)
+        return "\n".join(lines) + "\n"
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(labels: Mapping[str, str]) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{_escape(str(value))}"' for key, value in labels.items()) + "}"
+
+
+def family_lines(name: str, kind: str, help: str) -> List[str]:
+    return [f"# HELP {name} {help}", f"# TYPE {name} {kind}"]
+
+
+def _number(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return str(value) if isinstance(value, int) else repr(float(value))
+
+
+def sample_line(name: str, labels: Mapping[str, str], value: float) -> str:
+    return f"{name}{_labels(labels)} {_number(value)}"
+
+
+def histogram_lines(name: str, labels: Mapping[str, str], histogram) -> List[str]:
+    """A histogram's samples: cumulative buckets, then its sum and count."""
+    lines, cumulative = [], 0
+    for bound, count in zip(histogram.bounds, histogram.counts):
+        cumulative += count
+        lines.append(sample_line(f"{name}_bucket", {**labels, "le": _number(bound)}, cumulative))
+    lines.append(sample_line(f"{name}_bucket", {**labels, "le": "+Inf"}, histogram.count))
+    lines.append(sample_line(f"{name}_sum", labels, histogram.total))
+    lines.append(sample_line(f"{name}_count", labels, histogram.count))
+    return lines
+
+
+class MetricsExporter:
+    """Writes the registry to a file every interval seconds. The file is replaced whole, so a scraper never sees half of it."""
+
+    def __init__(self, registry: MetricsRegistry, path: str, interval: float = 15.0) -> None:
+        self.registry = registry
+        self.path = Path(path)
+        self.interval = interval
+        self._task: Optional[asyncio.Task] = None
+
+    @classmethod
+    def from_env(cls, registry: MetricsRegistry, env: Mapping[str, str] = os.environ) -> Optional["MetricsExporter"]:
+        return cls(registry, env[FILE_ENV]) if env.get(FILE_ENV) else None
+
+    def write(self) -> None:
+        partial = self.path.with_name(self.path.name + ".tmp")
+        partial.write_text(self.registry.render(), encoding="utf-8")
+        os.replace(partial, self.path)
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run(), name="metrics-exporter")
+
+    def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        try:
+            self.write()
+        except OSError:
+            logging.exception("Can't write metrics to %s", self.path)
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                self.write()
+            except OSError:
+                logging.exception("Can't write metrics to %s", self.path)
+            await asyncio.sleep(self.interval)
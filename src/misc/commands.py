@@ -2,11 +2,22 @@ import discord
 import logging
 
 from discord.ext import commands
+from tabulate import tabulate
+
+from ..metrics import MetricsRegistry
+from ..watchdog import LoopWatchdog
+
+# Commands shown by !metrics, the busiest first. A message holds about this many rows.
+METRICS_ROWS = 15
 
 
 class Misc(commands.Cog):
     """Cog containing misc related commands."""
 
+    def __init__(self, metrics: MetricsRegistry, watchdog: LoopWatchdog) -> None:
+        self.metrics = metrics
+        self.watchdog = watchdog
+
     @commands.Cog.listener()
     async def on_ready(self) -> None:
         logging.info("Misc cog loaded")
@@ -14,3 +25,34 @@ class Misc(commands.Cog):
     @commands.command()
     async def hello(self, ctx: commands.Context) -> None:
         await ctx.send("Hello!")
+
+    @commands.command()
+    async def metrics(self, ctx: commands.Context) -> None:
+        """Admin command to show the latency, errors and time spent per command."""
+        if not ctx.author.guild_permissions.administrator:
+            await ctx.send("Admin only command")
+            return
+
+        busiest = sorted(self.metrics.commands.items(), key=lambda item: item[1].calls, reverse=True)[:METRICS_ROWS]
+        rows = [
+            [
+                name,
+                m.calls,
+                m.errors,
+                m.in_flight,
+                m.latency.quantile(0.5) * 1000,
+                m.latency.quantile(0.99) * 1000,
+                m.db_seconds * 1000 / m.calls if m.calls else 0,
+                m.discord_seconds * 1000 / m.calls if m.calls else 0,
+            ]
+            for name, m in busiest
+        ]
+        table = tabulate(
+            rows,
+            headers=["Command", "Calls", "Errors", "Running", "p50 ms", "p99 ms", "DB ms/call", "Discord ms/call"],
+            floatfmt=".0f",
+        )
+        await ctx.send(
+            f"```\n{table}\n```"
+            f"Event loop lag: {self.watchdog.histogram.summary()}, blocked {self.watchdog.stalls} time(s)"
+        )
@@ -1,5 +1,40 @@
+from sqlalchemy import Connection, Engine, inspect, literal
 from sqlalchemy.orm import DeclarativeBase
+from sqlalchemy.schema import Column, CreateColumn
 
 
 class Base(DeclarativeBase):
     pass
+
+
+def create_all(engine: Engine) -> None:
+    """Create missing tables, and the columns and indexes added to tables that already exist."""
+    Base.metadata.create_all(engine)
+    with engine.begin() as connection:
+        _add_missing_columns(connection)
+        for table in Base.metadata.sorted_tables:
+            for index in table.indexes:
+                index.create(connection, checkfirst=True)
+
+
+def _add_missing_columns(connection: Connection) -> None:
+    inspector = inspect(connection)
+    for table in Base.metadata.sorted_tables:
+        present = {column["name"] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name not in present:
+                connection.exec_driver_sql(
+                    f"ALTER TABLE {connection.dialect.identifier_preparer.format_table(table)} "
+                    f"ADD COLUMN {_column_definition(connection, column)}"
+                )
+
+
+def _column_definition(connection: Connection, column: Column) -> str:
+    definition = str(CreateColumn(column).compile(dialect=connection.dialect))
+    # Existing rows take the column's default. SQLite only adds a NOT NULL column that has one.
+    if column.server_default is None and column.default is not None and column.default.is_scalar:
+        value = literal(column.default.arg, column.type).compile(
+            dialect=connection.dialect, compile_kwargs={"literal_binds": True}
+        )
+        definition += f" DEFAULT {value}"
+    return definition
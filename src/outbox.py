@@ -0,0 +1,321 @@
+import asyncio
+import logging
+import threading
+
+from collections import defaultdict
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from sqlalchemy import JSON, DateTime, Engine, ForeignKey, Index, Integer, String, delete, func, select, text
+from sqlalchemy.orm import Mapped, Session, mapped_column
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set, Tuple
+
+from . import database, models
+from .database import Database
+
+# Topics. The payload of each is documented where it is enqueued.
+GAME_FINISHED = "game_finished"
+
+
+class OutboxEvent(models.Base):
+    """Something that happened, written in the same transaction as the change itself. See Dispatcher."""
+
+    __tablename__ = "outbox_event"
+
+    event_id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
+    topic: Mapped[str] = mapped_column(String, nullable=False)
+    # One per change, e.g. game_finished:12:3 for version 3 of game 12. Handlers can use it to drop repeats.
+    idempotency_key: Mapped[str] = mapped_column(String, nullable=False, unique=True)
+    payload: Mapped[dict] = mapped_column(JSON, nullable=False)
+    created_at: Mapped[datetime] = mapped_column(DateTime, nullable=False)
+    attempts: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+    next_attempt_at: Mapped[datetime] = mapped_column(DateTime, nullable=False)
+    delivered_at: Mapped[Optional[datetime]] = mapped_column(DateTime, nullable=True)
+    # Set when the event ran out of attempts. It is kept, with the last error, for someone to look at.
+    failed_at: Mapped[Optional[datetime]] = mapped_column(DateTime, nullable=True)
+    last_error: Mapped[Optional[str]] = mapped_column(String, nullable=True)
+
+    __table_args__ = (
+        Index(
+            "ix_outbox_event_due", "next_attempt_at", "event_id",
+            sqlite_where=text("delivered_at IS NULL AND failed_at IS NULL"),
+        ),
+        # For deleting the delivered events past their retention.
+        Index("ix_outbox_event_delivered", "delivered_at", sqlite_where=text("delivered_at IS NOT NULL")),
+    )
+
+
+class OutboxDelivery(models.Base):
+    """A handler that has handled an event, so a retry of the event skips it."""
+
+    __tablename__ = "outbox_delivery"
+
+    event_id: Mapped[int] = mapped_column(ForeignKey("outbox_event.event_id", ondelete="CASCADE"), primary_key=True)
+    handler: Mapped[str] = mapped_column(String, primary_key=True)
+    delivered_at: Mapped[datetime] = mapped_column(DateTime, nullable=False)
+
+
+@dataclass(frozen=True, slots=True)
+class Event:
+    event_id: int
+    topic: str
+    key: str
+    payload: Dict[str, Any]
+    attempts: int
+    created_at: datetime
+
+
+# Called with the database of the shard the event was written to.
+Handler = Callable[[Database, Event], Awaitable[None]]
+
+
+# Databases with events enqueued since their writer last committed. See Dispatcher._committed.
+_enqueued: Set[Engine] = set()
+_enqueued_lock = threading.Lock()
+
+
+def enqueue(session: Session, topic: str, key: str, payload: Dict[str, Any]) -> None:
+    """Add an event to the session's transaction. It is delivered only if the transaction commits.
+
+    An event with the same key is only written once. Written in a write job, it wakes the
+    database's dispatcher once the writer commits.
+    """
+    if session.scalar(select(OutboxEvent.event_id).where(OutboxEvent.idempotency_key == key)) is not None:
+        return
+    now = datetime.now()
+    session.add(OutboxEvent(
+        topic=topic, idempotency_key=key, payload=payload, created_at=now, next_attempt_at=now,
+    ))
+    with _enqueued_lock:
+        _enqueued.add(session.get_bind().engine)
+
+
+def claim(session: Session, event: Event, handler: str) -> bool:
+    """For handlers whose work isn't safe to repeat: record the delivery in the transaction doing the work.
+
+    Returns False if the event was already handled, in which case there is nothing to do.
+    """
+    if session.get(OutboxDelivery, (event.event_id, handler)) is not None:
+        return False
+    session.add(OutboxDelivery(event_id=event.event_id, handler=handler, delivered_at=datetime.now()))
+    return True
+
+
+class Subscribers:
+    """Handlers by topic. Deliveries are recorded under the handler's name, so keep names stable."""
+
+    def __init__(self) -> None:
+        self._handlers: Dict[str, Dict[str, Handler]] = defaultdict(dict)
+
+    def subscribe(self, topic: str, name: str, handler: Handler) -> None:
+        self._handlers[topic][name] = handler
+
+    def of(self, topic: str) -> Dict[str, Handler]:
+        return dict(self._handlers.get(topic, {}))
+
+
+@dataclass
+class DispatcherStats:
+    delivered: int = 0
+    retried: int = 0
+    failed: int = 0
+    # Age of the oldest event waiting to be delivered, as of the last delivery.
+    lag_seconds: float = 0.0
+    purged: int = 0
+
+
+class Dispatcher:
+    """Delivers the outbox events of one database to the handlers subscribed to their topic.
+
+    Delivery is at least once: an event is retried, with exponential backoff, until every handler
+    has handled it or it runs out of attempts. A handler may see an event again after a crash, so
+    it should be safe to repeat, or use claim. Events of a topic nobody subscribes to are dropped.
+
+    The dispatcher delivers the backlog when it starts, then sleeps until the writer commits an
+    event, a retry is due, or, if interval is set, the next poll. Delivered events are deleted
+    once they are older than retention.
+    """
+
+    def __init__(
+        self,
+        database: Database,
+        subscribers: Subscribers,
+        interval: Optional[float] = None,
+        batch_size: int = 50,
+        max_attempts: int = 8,
+        backoff: float = 1.0,
+        retention: timedelta = timedelta(days=7),
+    ) -> None:
+        self.database = database
+        self.subscribers = subscribers
+        self.interval = interval
+        self.batch_size = batch_size
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.retention = retention
+        self.stats = DispatcherStats()
+        self._wake = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        # When the earliest retry is due, as of the last delivery.
+        self._next_attempt: Optional[datetime] = None
+        self._purged_at: Optional[datetime] = None
+        database.commit_hooks.append(self._committed)
+
+    def start(self) -> None:
+        if self._task is None:
+            self._loop = asyncio.get_running_loop()
+            self._task = self._loop.create_task(self._run(), name="outbox-dispatcher")
+
+    def wake(self) -> None:
+        """Deliver now instead of at the next poll."""
+        self._wake.set()
+
+    def stop(self) -> None:
+        """Stop delivering. An event being delivered is retried on the next start."""
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    def _committed(self) -> None:
+        # A writer commit hook, on the writer thread.
+        with _enqueued_lock:
+            if self.database.engine not in _enqueued:
+                return
+            _enqueued.discard(self.database.engine)
+        if self._task is not None and self._loop is not None and not self._loop.is_closed():
+            self._loop.call_soon_threadsafe(self._wake.set)
+
+    async def _run(self) -> None:
+        while True:
+            self._wake.clear()
+            try:
+                settled = await self.deliver()
+                await self._purge()
+            except Exception:
+                logging.exception("Outbox delivery failed")
+                settled = 0
+            if settled < self.batch_size:
+                try:
+                    await asyncio.wait_for(self._wake.wait(), self._sleep())
+                except asyncio.TimeoutError:
+                    pass
+
+    def _sleep(self) -> Optional[float]:
+        """Seconds until the next retry is due or the next poll, whichever comes first. None for neither."""
+        timeouts = [] if self.interval is None else [self.interval]
+        if self._next_attempt is not None:
+            timeouts.append(max((self._next_attempt - datetime.now()).total_seconds(), 0))
+        return min(timeouts, default=None)
+
+    async def deliver(self) -> int:
+        """Deliver the events that are due. Returns how many were settled."""
+        now = datetime.now()
+        events, handled, oldest, upcoming = await self.database.run(self._due, now)
+        self.stats.lag_seconds = (now - oldest).total_seconds() if oldest is not None else 0.0
+        retries = [upcoming] if upcoming is not None else []
+        for event in events:
+            retry = await self._deliver(event, handled.get(event.event_id, set()))
+            if retry is not None:
+                retries.append(retry)
+        self._next_attempt = min(retries, default=None)
+        return len(events)
+
+    async def _purge(self) -> None:
+        now = datetime.now()
+        # At most hourly: a delete over the delivered events isn't worth running on every wake-up.
+        if self._purged_at is not None and now - self._purged_at < timedelta(hours=1):
+            return
+        self._purged_at = now
+        self.stats.purged += await self.database.write(self._delete_delivered, now - self.retention)
+
+    async def _deliver(self, event: Event, handled: Set[str]) -> Optional[datetime]:
+        """Hand the event to the handlers that haven't handled it. Returns when it is retried, if it is."""
+        succeeded: List[str] = []
+        errors: List[str] = []
+        for name, handler in self.subscribers.of(event.topic).items():
+            if name in handled:
+                continue
+            try:
+                await handler(self.database, event)
+            except Exception as e:
+                logging.exception("Outbox handler %s failed on %s (attempt %d)", name, event.key, event.attempts + 1)
+                errors.append(f"{name}: {e!r}")
+            else:
+                succeeded.append(name)
+
+        match await self.database.write(self._settle, event, succeeded, "; ".join(errors) or None):
+            case ("delivered", _):
+                self.stats.delivered += 1
+            case ("retry", retry):
+                self.stats.retried += 1
+                return retry
+            case ("failed", _):
+                self.stats.failed += 1
+                logging.error("Outbox event %s failed %d times and won't be retried", event.key, self.max_attempts)
+        return None
+
+    def _due(
+        self, now: datetime
+    ) -> Tuple[List[Event], Dict[int, Set[str]], Optional[datetime], Optional[datetime]]:
+        with database.session(self.database.engine) as session:
+            pending = (OutboxEvent.delivered_at.is_(None), OutboxEvent.failed_at.is_(None))
+            rows = session.execute(
+                select(
+                    OutboxEvent.event_id,
+                    OutboxEvent.topic,
+                    OutboxEvent.idempotency_key,
+                    OutboxEvent.payload,
+                    OutboxEvent.attempts,
+                    OutboxEvent.created_at,
+                )
+                .where(*pending, OutboxEvent.next_attempt_at <= now)
+                .order_by(OutboxEvent.event_id)
+                .limit(self.batch_size)
+            ).all()
+            events = [Event(*row) for row in rows]
+
+            handled: Dict[int, Set[str]] = defaultdict(set)
+            if any(event.attempts for event in events):
+                for event_id, handler in session.execute(
+                    select(OutboxDelivery.event_id, OutboxDelivery.handler)
+                    .where(OutboxDelivery.event_id.in_([event.event_id for event in events]))
+                ):
+                    handled[event_id].add(handler)
+
+            oldest = session.scalar(select(func.min(OutboxEvent.created_at)).where(*pending))
+            # The earliest retry of the events that aren't due yet.
+            upcoming = session.scalar(
+                select(func.min(OutboxEvent.next_attempt_at)).where(*pending, OutboxEvent.next_attempt_at > now)
+            )
+            return events, handled, oldest, upcoming
+
+    def _settle(self, event: Event, succeeded: List[str], error: Optional[str]) -> Tuple[str, Optional[datetime]]:
+        with database.session(self.database.engine) as session:
+            now = datetime.now()
+            for name in succeeded:
+                session.merge(OutboxDelivery(event_id=event.event_id, handler=name, delivered_at=now))
+
+            row = session.get(OutboxEvent, event.event_id)
+            if error is None:
+                row.delivered_at = now
+                outcome = "delivered", None
+            else:
+                row.attempts = event.attempts + 1
+                row.last_error = error
+                if row.attempts >= self.max_attempts:
+                    row.failed_at = now
+                    outcome = "failed", None
+                else:
+                    row.next_attempt_at = now + timedelta(seconds=min(self.backoff * 2 ** event.attempts, 3600))
+                    outcome = "retry", row.next_attempt_at
+            session.commit()
+            return outcome
+
+    def _delete_delivered(self, before: datetime) -> int:
+        """Delete the events delivered before then, with their deliveries. Failed events are kept."""
+        with database.session(self.database.engine) as session:
+            old = select(OutboxEvent.event_id).where(OutboxEvent.delivered_at < before)
+            session.execute(delete(OutboxDelivery).where(OutboxDelivery.event_id.in_(old)))
+            deleted = session.execute(delete(OutboxEvent).where(OutboxEvent.delivered_at < before)).rowcount
+            session.commit()
+            return deleted
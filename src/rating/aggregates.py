@@ -0,0 +1,224 @@
+import logging
+
+from collections import defaultdict
+from dataclasses import dataclass
+from datetime import datetime
+from sqlalchemy import select, func, delete
+from sqlalchemy.orm import Session
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from . import model
+from .. import compute
+from ..game import model as game_model
+
+
+# One row per player of a finished game: (game_id, player_id, faction, points, game_finish_time).
+FinishedRow = Tuple[int, int, Optional[str], int, Optional[datetime]]
+
+
+@dataclass(frozen=True)
+class ExpectedPlayerStats:
+    games: int
+    wins: int
+    points: int
+    best_placement: Optional[int]
+    current_streak: int
+
+
+@dataclass(frozen=True)
+class Aggregates:
+    players: Dict[int, ExpectedPlayerStats]
+    factions: Dict[Tuple[int, str], int]
+    # Wins per (winner, loser) pair.
+    pairs: Dict[Tuple[int, int], int]
+
+
+@dataclass(frozen=True)
+class Snapshot:
+    """What a recompute is made from, and what the games looked like at the time."""
+
+    rows: List[FinishedRow]
+    token: Tuple[int, int]
+
+
+# Changes whenever a game is added or updated, as every update bumps its version.
+_GAMES_TOKEN = select(func.count(), func.coalesce(func.sum(game_model.Game.version), 0)).select_from(game_model.Game)
+
+
+def finished_rows(session: Session) -> List[FinishedRow]:
+    return [
+        tuple(row)
+        for row in session.execute(
+            select(
+                game_model.GamePlayer.game_id,
+                game_model.GamePlayer.player_id,
+                game_model.GamePlayer.faction,
+                game_model.GamePlayer.points,
+                game_model.Game.game_finish_time,
+            )
+            .join(game_model.GamePlayer.game)
+            .where(game_model.Game.game_state == game_model.GameState.FINISHED)
+        )
+    ]
+
+
+def snapshot(session: Session) -> Snapshot:
+    return Snapshot(rows=finished_rows(session), token=games_token(session))
+
+
+def games_token(session: Session) -> Tuple[int, int]:
+    return tuple(session.execute(_GAMES_TOKEN).one())
+
+
+def recompute_player_stats(rows: Sequence[FinishedRow]) -> Dict[int, ExpectedPlayerStats]:
+    """Full recompute of the player_stats columns."""
+    points_by_game: Dict[int, List[int]] = defaultdict(list)
+    for game_id, _, _, points, _ in rows:
+        points_by_game[game_id].append(points)
+
+    games_by_player = defaultdict(list)
+    for game_id, player_id, _, points, finish_time in rows:
+        others = points_by_game[game_id]
+        placement = 1 + sum(1 for other in others if other > points)
+        games_by_player[player_id].append((finish_time, points, placement))
+
+    expected = {}
+    for player_id, games in games_by_player.items():
+        wins = [finish_time for finish_time, _, placement in games if placement == 1]
+        # Same rules as the trigger: games without a finish time can't be ordered and don't count.
+        not_wins = [t for t, _, placement in games if placement != 1 and t is not None]
+        last_not_win = max(not_wins) if not_wins else None
+        expected[player_id] = ExpectedPlayerStats(
+            games=len(games),
+            wins=len(wins),
+            points=sum(points for _, points, _ in games),
+            best_placement=min(placement for _, _, placement in games),
+            current_streak=sum(
+                1 for t in wins if t is not None and (last_not_win is None or t > last_not_win)
+            ),
+        )
+    return expected
+
+
+def recompute_faction_stats(rows: Sequence[FinishedRow]) -> Dict[Tuple[int, str], int]:
+    """Full recompute of the number of finished games per (player, faction)."""
+    played: Dict[Tuple[int, str], int] = defaultdict(int)
+    for _, player_id, faction, _, _ in rows:
+        if faction is not None:
+            played[(player_id, faction)] += 1
+    return dict(played)
+
+
+def recompute_head_to_head(rows: Sequence[FinishedRow]) -> Dict[Tuple[int, int], int]:
+    """Full recompute of the number of wins per (winner, loser) pair."""
+    players_by_game: Dict[int, List[Tuple[int, int]]] = defaultdict(list)
+    for game_id, player_id, _, points, _ in rows:
+        if points is not None:
+            players_by_game[game_id].append((player_id, points))
+
+    wins: Dict[Tuple[int, int], int] = defaultdict(int)
+    for players in players_by_game.values():
+        for winner_id, winner_points in players:
+            for loser_id, loser_points in players:
+                if loser_points < winner_points:
+                    wins[(winner_id, loser_id)] += 1
+    return dict(wins)
+
+
+def recompute(rows: Sequence[FinishedRow]) -> Aggregates:
+    """Every aggregate table, recomputed from the finished games. Pure, so it can run in a worker."""
+    return Aggregates(
+        players=recompute_player_stats(rows),
+        factions=recompute_faction_stats(rows),
+        pairs=recompute_head_to_head(rows),
+    )
+
+
+RECOMPUTE = compute.Task("recompute_aggregates", recompute)
+
+
+def actual(session: Session) -> Aggregates:
+    """The aggregate tables as they are."""
+    return Aggregates(
+        players={
+            s.player_id: ExpectedPlayerStats(
+                games=s.games,
+                wins=s.wins,
+                points=s.points,
+                best_placement=s.best_placement,
+                current_streak=s.current_streak,
+            )
+            for s in session.scalars(select(model.PlayerStats))
+            if s.games
+        },
+        factions={
+            (s.player_id, s.faction): s.played
+            for s in session.scalars(select(model.PlayerFactionStats))
+            if s.played
+        },
+        pairs={
+            (s.winner_id, s.loser_id): s.wins
+            for s in session.scalars(select(model.HeadToHeadStats))
+            if s.wins
+        },
+    )
+
+
+def _compare(name: str, expected: Dict, actual: Dict) -> List[str]:
+    return [
+        f"{name} {key}: expected {expected.get(key)}, found {actual.get(key)}"
+        for key in expected.keys() | actual.keys()
+        if expected.get(key) != actual.get(key)
+    ]
+
+
+def compare(expected: Aggregates, found: Aggregates) -> List[str]:
+    """A description of every difference between two sets of aggregates."""
+    return (
+        _compare("player_stats", expected.players, found.players)
+        + _compare("player_faction_stats", expected.factions, found.factions)
+        + _compare("head_to_head_stats", expected.pairs, found.pairs)
+    )
+
+
+def verify(session: Session) -> List[str]:
+    """Compare the aggregate tables with a full recompute. Returns a description of every mismatch."""
+    return compare(recompute(finished_rows(session)), actual(session))
+
+
+def rebuild(session: Session, expected: Optional[Aggregates] = None) -> None:
+    """Replace the aggregate tables with a full recompute, or with expected if it was already made."""
+    if expected is None:
+        expected = recompute(finished_rows(session))
+    session.execute(delete(model.PlayerStats))
+    session.execute(delete(model.PlayerFactionStats))
+    session.execute(delete(model.HeadToHeadStats))
+    for player_id, stats in expected.players.items():
+        session.add(model.PlayerStats(
+            player_id=player_id,
+            games=stats.games,
+            wins=stats.wins,
+            points=stats.points,
+            best_placement=stats.best_placement,
+            current_streak=stats.current_streak,
+        ))
+    for (player_id, faction), played in expected.factions.items():
+        session.add(model.PlayerFactionStats(player_id=player_id, faction=faction, played=played))
+    for (winner_id, loser_id), wins in expected.pairs.items():
+        session.add(model.HeadToHeadStats(winner_id=winner_id, loser_id=loser_id, wins=wins))
+    session.flush()
+
+
+def verify_and_repair(session: Session, expected: Optional[Aggregates] = None) -> List[str]:
+    """Rebuild the aggregate tables if they differ from expected, by default a recompute done here."""
+    if expected is None:
+        expected = recompute(finished_rows(session))
+    problems = compare(expected, actual(session))
+    if problems:
+        logging.warning(
+            "Aggregate tables are out of sync (%d problem(s)), rebuilding. First: %s",
+            len(problems),
+            problems[0],
+        )
+        rebuild(session, expected)
+    return problems
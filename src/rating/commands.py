@@ -1,18 +1,60 @@
+import asyncio
 import logging
 
-from . import ratinglogic
+from functools import partial
+
+from . import aggregates, ratinglogic
 
 from discord.ext import commands
-from sqlalchemy import Engine
+from ..compute import ComputeService
+from ..shards import Shard, ShardRouter
 
 from ..typing import *
-from typing import Optional
+from typing import List, Optional, Set, Tuple
 
 class Rating(commands.Cog):
     """Cog containing rating related commands."""
 
-    def __init__(self, engine: Engine) -> None:
-        self.logic = ratinglogic.RatingLogic(engine)
+    def __init__(self, shards: ShardRouter, compute: ComputeService) -> None:
+        self.shards = shards
+        self.compute = compute
+        # Shards whose stats were checked since the bot started, by guild id.
+        self._checked: Set[Optional[int]] = set()
+        self._checks: Set[asyncio.Task] = set()
+
+    @staticmethod
+    def _open(shard: Shard) -> ratinglogic.RatingLogic:
+        logic = ratinglogic.RatingLogic(shard.engine)
+        # Only the games finished since the last start are rated.
+        logic.refresh_ratings()
+        return logic
+
+    async def __logic(self, ctx: commands.Context) -> Tuple[Shard, ratinglogic.RatingLogic]:
+        shard = await self.shards.shard(ctx.guild)
+        logic = await shard.service("rating", self._open)
+        if shard.guild_id not in self._checked:
+            # Check the stats once per start, in the background, so the first command doesn't wait on it.
+            self._checked.add(shard.guild_id)
+            task = asyncio.create_task(self.__check_on_start(shard, logic), name="verify-stats")
+            self._checks.add(task)
+            task.add_done_callback(self._checks.discard)
+        return shard, logic
+
+    async def __verify(self, shard: Shard, logic: ratinglogic.RatingLogic) -> Optional[List[str]]:
+        """Check the stats tables against a full recompute, and repair them. None if a game finished meanwhile."""
+        # The recompute is a long Python loop over every finished game, so it runs in a worker process.
+        snapshot = await shard.database.run(logic.stats_snapshot)
+        expected = await self.compute.run(aggregates.RECOMPUTE, snapshot.rows)
+        return await shard.database.write(logic.repair_stats, snapshot, expected)
+
+    async def __check_on_start(self, shard: Shard, logic: ratinglogic.RatingLogic) -> None:
+        try:
+            problems = await self.__verify(shard, logic)
+        except Exception:
+            logging.exception("Failed to verify stats of shard %s", shard.guild_id)
+            return
+        if problems:
+            logging.warning("Repaired %d stats inconsistencies in shard %s", len(problems), shard.guild_id)
 
     @commands.Cog.listener()
     async def on_ready(self) -> None:
@@ -21,14 +63,15 @@ class Rating(commands.Cog):
     @commands.command()
     async def stats(self, ctx: commands.Context, *, name: Optional[str]) -> None:
         """Returns stats for you."""
+        shard, logic = await self.__logic(ctx)
         id = ctx.author.id
         if name:
-            id = self.logic.player_id_from_name(name)
+            id = await shard.database.run(logic.player_id_from_name, name)
             if not id:
                 await ctx.send("Can't find anyone with that name")
                 return
 
-        match self.logic.stats(id):
+        match await shard.database.run(logic.stats, id):
             case Ok(s):
                 await ctx.send(embed=s.card_view())
             case Err(s):
@@ -37,31 +80,102 @@ class Rating(commands.Cog):
     @commands.command()
     async def wins(self, ctx: commands.Context) -> None:
         """Returns wins leaderboard."""
-        await ctx.send(self.logic.wins())
+        shard, logic = await self.__logic(ctx)
+        match await shard.database.run(logic.wins_page):
+            case Ok(page) if page.rows:
+                await ratinglogic.leaderboard_menu(ctx, page, partial(shard.database.run, logic.wins_page)).start()
+            case Ok(_):
+                await ctx.send("No players found.")
+            case Err(s):
+                await ctx.send(s)
+
+    @staticmethod
+    def _parse_season(season: str) -> Optional[int]:
+        season = season.strip().lower().removeprefix("season:").strip()
+        return int(season) if season.isdigit() else None
+
+    @commands.command()
+    async def leaderboard(self, ctx: commands.Context, *, season: Optional[str] = None) -> None:
+        """Returns ratings leaderboard. Usage !leaderboard or !leaderboard season:{number}"""
+        shard, logic = await self.__logic(ctx)
+        if not season:
+            match await shard.database.run(logic.rating_page):
+                case Ok(page) if page.rows:
+                    await ratinglogic.leaderboard_menu(ctx, page, partial(shard.database.run, logic.rating_page)).start()
+                case Ok(_):
+                    await ctx.send("No players found.")
+                case Err(s):
+                    await ctx.send(s)
+            return
+
+        season_id = self._parse_season(season)
+        if season_id is None:
+            await ctx.send("Usage: !leaderboard season:{number}. Type !seasons to list the seasons.")
+            return
+        await ctx.send(await shard.database.run(logic.ratings, season_id))
+
+    @commands.command()
+    async def rank(self, ctx: commands.Context) -> None:
+        """Shows your position on the leaderboard and the players around you."""
+        shard, logic = await self.__logic(ctx)
+        await ctx.send(await shard.database.run(logic.rank, ctx.author.id))
 
     @commands.command()
-    async def leaderboard(self, ctx: commands.Context) -> None:
-        """Returns ratings leaderboard."""
-        await ctx.send(self.logic.ratings())
+    async def seasons(self, ctx: commands.Context) -> None:
+        """Lists all seasons."""
+        shard, logic = await self.__logic(ctx)
+        await ctx.send(await shard.database.run(logic.seasons))
+
+    @commands.command()
+    async def new_season(self, ctx: commands.Context, *, name: str) -> None:
+        """Admin command to end the current season and start a new one."""
+        if not ctx.author.guild_permissions.administrator:
+            await ctx.send("Admin only command")
+            return
+        shard, logic = await self.__logic(ctx)
+        await ctx.send(await shard.database.write(logic.start_season, name))
 
     @commands.command()
     async def picture(self, ctx: commands.Context, *, url: str) -> None:
         """Set a profile picture using an https url."""
-        await ctx.send(self.logic.set_pic(ctx.author.id, url))
+        shard, logic = await self.__logic(ctx)
+        await ctx.send(await shard.database.write(logic.set_pic, ctx.author.id, url))
 
     @commands.command()
     async def description(self, ctx: commands.Context, *, description: str) -> None:
         """Set a profile description."""
-        await ctx.send(self.logic.set_description(ctx.author.id, description))
+        shard, logic = await self.__logic(ctx)
+        await ctx.send(await shard.database.write(logic.set_description, ctx.author.id, description))
 
     @commands.command()
     async def update_ratings(self, ctx: commands.Context) -> None:
         """Admin command to update the ratings on a finished game."""
+        shard, logic = await self.__logic(ctx)
         if not ctx.author.guild_permissions.administrator:
             await ctx.send("Admin only command")
         try:
-            self.logic.update_rating(None, ctx.channel.id)
+            await shard.database.write(logic.update_rating, None, ctx.channel.id)
             await ctx.send("Ratings updated")
         except Exception as e:
             logging.exception("update_rating")
             await ctx.send("Something went wrong")
+
+    @commands.command()
+    async def verify_stats(self, ctx: commands.Context) -> None:
+        """Admin command to check the stats tables against a full recompute."""
+        if not ctx.author.guild_permissions.administrator:
+            await ctx.send("Admin only command")
+            return
+        shard, logic = await self.__logic(ctx)
+        try:
+            problems = await self.__verify(shard, logic)
+            if problems is None:
+                await ctx.send("A game finished while checking, try again")
+                return
+            if not problems:
+                await ctx.send("Stats are consistent")
+                return
+            await ctx.send(f"Found and repaired {len(problems)} inconsistencies")
+        except Exception:
+            logging.exception("verify_stats")
+            await ctx.send("Something went wrong")
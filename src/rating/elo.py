@@ -0,0 +1,38 @@
+from collections import defaultdict
+from itertools import combinations
+from typing import Dict, List, Tuple
+
+
+def expectations(a: float, b: float) -> Tuple[float, float]:
+    scale_constant = 400
+    e_ab = 1 / (1 + 10 ** ((a - b) / scale_constant))
+    return e_ab, 1 - e_ab
+
+
+def game_deltas(
+    points: Dict[int, int], ratings: Dict[int, float], k_game: float
+) -> Dict[int, float]:
+    """Rating delta per player for one game, given everyone's points and rating before the game.
+
+    Every pair of players is scored as a head-to-head match. Returns an empty dict for solo games.
+    """
+    deltas: Dict[int, List[float]] = defaultdict(list)
+    for p1, p2 in combinations(points, 2):
+        e_ab, e_ba = expectations(ratings[p1], ratings[p2])
+        if points[p1] < points[p2]:
+            deltas[p1].append(0 - e_ab)
+            deltas[p2].append(1 - e_ba)
+        elif points[p1] > points[p2]:
+            deltas[p1].append(1 - e_ab)
+            deltas[p2].append(0 - e_ba)
+        else:
+            deltas[p1].append(0.5 - e_ab)
+            deltas[p2].append(0.5 - e_ba)
+
+    if len(deltas) <= 1:
+        # Solo game.
+        return {}
+    return {
+        player_id: sum(d) / (len(deltas) - 1) * k_game
+        for player_id, d in deltas.items()
+    }
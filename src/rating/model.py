@@ -1,7 +1,8 @@
 from datetime import datetime
 
-from sqlalchemy import ForeignKey, DateTime, Float, String, Integer
+from sqlalchemy import DDL, ForeignKey, DateTime, Float, Index, String, Integer, event
 from sqlalchemy.orm import Mapped, relationship, mapped_column
+from typing import Optional
 
 from .. import models
 from ..game import model as game_model
@@ -10,6 +11,8 @@ from ..game import model as game_model
 # Bookkeeping table.
 class OutcomeLedger(models.Base):
     __tablename__ = "outcome_ledger"
+    # A player's rating history.
+    __table_args__ = (Index("ix_outcome_ledger_player_time", "player_id", "match_time"),)
     game_id: Mapped[int] = mapped_column(
         ForeignKey("game.game_id", ondelete="CASCADE"), primary_key=True
     )
@@ -26,6 +29,8 @@ class OutcomeLedger(models.Base):
 
 class MatchPlayer(models.Base):
     __tablename__ = "match_player"
+    # Keyset for the leaderboard pages and the !rank window.
+    __table_args__ = (Index("ix_match_player_rating", "rating", "player_id"),)
     player_id: Mapped[int] = mapped_column(
         ForeignKey("player.player_id", ondelete="CASCADE"), primary_key=True
     )
@@ -41,6 +46,11 @@ class MatchPlayer(models.Base):
 
 class WinnerHeadToHead(models.Base):
     __tablename__ = "winner_head_to_head"
+    __table_args__ = (
+        # Wins of one player over another, for the head to head achievements.
+        Index("ix_winner_head_to_head_pair", "winner_id", "loser_id"),
+        Index("ix_winner_head_to_head_loser", "loser_id"),
+    )
     game_id: Mapped[int] = mapped_column(
         ForeignKey("game.game_id", ondelete="CASCADE"), primary_key=True
     )
@@ -60,3 +70,193 @@ class WinnerHeadToHead(models.Base):
         "MatchPlayer",
         foreign_keys=[loser_id],
     )
+
+
+class Season(models.Base):
+    __tablename__ = "season"
+    season_id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    name: Mapped[str] = mapped_column(String)
+
+    start_time: Mapped[datetime] = mapped_column(DateTime)
+    # Open ended while the season is running.
+    end_time: Mapped[Optional[datetime]] = mapped_column(DateTime, nullable=True)
+
+
+# Per-season rating snapshot. A new season starts without any rows, so a rollover
+# never touches the previous seasons or the global rating.
+class SeasonPlayer(models.Base):
+    __tablename__ = "season_player"
+    season_id: Mapped[int] = mapped_column(
+        ForeignKey("season.season_id", ondelete="CASCADE"), primary_key=True
+    )
+    player_id: Mapped[int] = mapped_column(
+        ForeignKey("player.player_id", ondelete="CASCADE"), primary_key=True
+    )
+
+    rating: Mapped[float] = mapped_column(Float, default=1500)
+    games: Mapped[int] = mapped_column(Integer, default=0)
+    wins: Mapped[int] = mapped_column(Integer, default=0)
+
+    player: Mapped[game_model.Player] = relationship(
+        "Player",
+    )
+
+
+# Bookkeeping table for the season ratings.
+class SeasonOutcomeLedger(models.Base):
+    __tablename__ = "season_outcome_ledger"
+    season_id: Mapped[int] = mapped_column(
+        ForeignKey("season.season_id", ondelete="CASCADE"), primary_key=True
+    )
+    game_id: Mapped[int] = mapped_column(
+        ForeignKey("game.game_id", ondelete="CASCADE"), primary_key=True
+    )
+    player_id: Mapped[int] = mapped_column(
+        ForeignKey("player.player_id", ondelete="CASCADE"), primary_key=True
+    )
+
+    match_time: Mapped[datetime] = mapped_column(DateTime)
+
+    rating_before: Mapped[float] = mapped_column(Float)
+    rating_after: Mapped[float] = mapped_column(Float)
+    rating_delta: Mapped[float] = mapped_column(Float)
+
+
+# Aggregates over game_result, maintained by the triggers below so that stats
+# and leaderboards are primary key lookups instead of scans over game_player.
+# game_result is rewritten whenever a game is finished or re-finished, which
+# makes it the one place where game state changes have to be observed.
+class PlayerStats(models.Base):
+    __tablename__ = "player_stats"
+    __table_args__ = (Index("ix_player_stats_wins", "wins", "player_id"),)
+    player_id: Mapped[int] = mapped_column(
+        ForeignKey("player.player_id", ondelete="CASCADE"), primary_key=True
+    )
+
+    games: Mapped[int] = mapped_column(Integer, default=0)
+    wins: Mapped[int] = mapped_column(Integer, default=0)
+    points: Mapped[int] = mapped_column(Integer, default=0)
+    best_placement: Mapped[Optional[int]] = mapped_column(Integer, nullable=True)
+    # Wins since the most recent finished game that wasn't a win.
+    current_streak: Mapped[int] = mapped_column(Integer, default=0)
+
+    player: Mapped[game_model.Player] = relationship(
+        "Player",
+    )
+
+
+class PlayerFactionStats(models.Base):
+    __tablename__ = "player_faction_stats"
+    player_id: Mapped[int] = mapped_column(
+        ForeignKey("player.player_id", ondelete="CASCADE"), primary_key=True
+    )
+    faction: Mapped[str] = mapped_column(String, primary_key=True)
+
+    played: Mapped[int] = mapped_column(Integer, default=0)
+
+
+class HeadToHeadStats(models.Base):
+    __tablename__ = "head_to_head_stats"
+    # Nemesis of a player in !stats.
+    __table_args__ = (Index("ix_head_to_head_stats_loser", "loser_id", "wins"),)
+    winner_id: Mapped[int] = mapped_column(
+        ForeignKey("player.player_id", ondelete="CASCADE"), primary_key=True
+    )
+    loser_id: Mapped[int] = mapped_column(
+        ForeignKey("player.player_id", ondelete="CASCADE"), primary_key=True
+    )
+
+    # Number of finished games where the winner finished with more points than the loser.
+    wins: Mapped[int] = mapped_column(Integer, default=0)
+
+    winner: Mapped[game_model.Player] = relationship(
+        "Player",
+        foreign_keys=[winner_id],
+    )
+    loser: Mapped[game_model.Player] = relationship(
+        "Player",
+        foreign_keys=[loser_id],
+    )
+
+
+# Best placement and streak only depend on the player's own results, so they are
+# recomputed for that one player instead of being adjusted.
+_PLAYER_PROFILE_UPDATE = """
+    UPDATE player_stats SET
+        best_placement = (
+            SELECT MIN(placement) FROM game_result WHERE player_id = {player}
+        ),
+        current_streak = (
+            SELECT COUNT(*) FROM game_result AS r JOIN game AS g ON g.game_id = r.game_id
+            WHERE r.player_id = {player} AND r.winner AND g.game_finish_time > COALESCE((
+                SELECT MAX(g2.game_finish_time) FROM game_result AS r2 JOIN game AS g2 ON g2.game_id = r2.game_id
+                WHERE r2.player_id = {player} AND NOT r2.winner
+            ), '')
+        )
+    WHERE player_id = {player};
+"""
+
+STATS_TRIGGERS = [
+    DDL("""
+CREATE TRIGGER IF NOT EXISTS game_result_stats_insert AFTER INSERT ON game_result
+BEGIN
+    INSERT INTO player_stats (player_id, games, wins, points, current_streak)
+    VALUES (NEW.player_id, 1, NEW.winner, NEW.points, 0)
+    ON CONFLICT (player_id) DO UPDATE SET
+        games = games + 1,
+        wins = wins + excluded.wins,
+        points = points + excluded.points;
+""" + _PLAYER_PROFILE_UPDATE.format(player="NEW.player_id") + """
+    INSERT INTO player_faction_stats (player_id, faction, played)
+    SELECT NEW.player_id, NEW.faction, 1 WHERE NEW.faction IS NOT NULL
+    ON CONFLICT (player_id, faction) DO UPDATE SET played = played + 1;
+
+    INSERT INTO head_to_head_stats (winner_id, loser_id, wins)
+    SELECT NEW.player_id, other.player_id, 1 FROM game_result AS other
+    WHERE other.game_id = NEW.game_id AND other.points < NEW.points
+    ON CONFLICT (winner_id, loser_id) DO UPDATE SET wins = wins + 1;
+
+    INSERT INTO head_to_head_stats (winner_id, loser_id, wins)
+    SELECT other.player_id, NEW.player_id, 1 FROM game_result AS other
+    WHERE other.game_id = NEW.game_id AND other.points > NEW.points
+    ON CONFLICT (winner_id, loser_id) DO UPDATE SET wins = wins + 1;
+END
+"""),
+    # Rows are deleted one at a time, so every pair is decremented exactly once:
+    # when the first of the two rows goes away.
+    DDL("""
+CREATE TRIGGER IF NOT EXISTS game_result_stats_delete AFTER DELETE ON game_result
+BEGIN
+    UPDATE player_stats SET
+        games = games - 1,
+        wins = wins - OLD.winner,
+        points = points - OLD.points
+    WHERE player_id = OLD.player_id;
+""" + _PLAYER_PROFILE_UPDATE.format(player="OLD.player_id") + """
+    UPDATE player_faction_stats SET played = played - 1
+    WHERE player_id = OLD.player_id AND faction = OLD.faction;
+
+    DELETE FROM player_faction_stats
+    WHERE player_id = OLD.player_id AND played <= 0;
+
+    UPDATE head_to_head_stats SET wins = wins - 1
+    WHERE winner_id = OLD.player_id AND loser_id IN (
+        SELECT player_id FROM game_result
+        WHERE game_id = OLD.game_id AND points < OLD.points
+    );
+
+    UPDATE head_to_head_stats SET wins = wins - 1
+    WHERE loser_id = OLD.player_id AND winner_id IN (
+        SELECT player_id FROM game_result
+        WHERE game_id = OLD.game_id AND points > OLD.points
+    );
+
+    DELETE FROM head_to_head_stats
+    WHERE wins <= 0 AND (winner_id = OLD.player_id OR loser_id = OLD.player_id);
+END
+"""),
+]
+
+for trigger in STATS_TRIGGERS:
+    # CREATE TRIGGER IF NOT EXISTS makes this safe on every create_all.
+    event.listen(models.Base.metadata, "after_create", trigger.execute_if(dialect="sqlite"))
@@ -1,20 +1,25 @@
+import json
 import logging
 import discord
 
 from . import model as model
+from . import elo
+from . import aggregates
 from ..game import model as game_model
+from .. import database
 
-from collections import defaultdict
+from datetime import datetime
 from itertools import combinations
-from sqlalchemy import Engine, select, func, text, Row, text
-from sqlalchemy.orm import Session
+from sqlalchemy import Engine, bindparam, select, func, or_, tuple_
+from sqlalchemy.orm import Session, aliased, selectinload
+from reactionmenu import ViewMenu, ViewButton
 from tabulate import tabulate
-from typing import Tuple, Optional, List, Sequence
+from typing import Any, Awaitable, Callable, Tuple, Optional, List
 from ..typing import *
 from dataclasses import dataclass
 
 
-@dataclass
+@dataclass(frozen=True, slots=True)
 class Profile:
     name: str
     description: str
@@ -26,6 +31,8 @@ class Profile:
     thumbnail: str
     nemesis: Tuple[str, int]|None
     pinata: Tuple[str, int]|None
+    best_finish: int|None = None
+    streak: int = 0
 
     def text_view(self) -> str:
         lines = [
@@ -49,6 +56,8 @@ class Profile:
         embed.add_field(name="Games", value=self.games, inline=True)
         embed.add_field(name="Wins", value=self.wins, inline=True)
         embed.add_field(name="Win rate", value=f"{self.wins/self.games*100:.2f}%" if self.games !=0 else "N/A", inline=True)
+        embed.add_field(name="Best finish", value=self.best_finish if self.best_finish else "N/A", inline=True)
+        embed.add_field(name="Win streak", value=self.streak, inline=True)
         embed.add_field(name="Average points/game", value=f"{self.points_per_game:.2f}", inline=False)
         favorite_factions = "\n".join([f"{p[0]} (played {p[1]} time(s))" for p in self.favorite_factions[:3]])
         embed.add_field(name="Favorite factions", value=favorite_factions, inline=False)
@@ -61,20 +70,204 @@ class Profile:
             embed.set_thumbnail(url=self.thumbnail)
         return embed
 
+PAGE_SIZE = 15
+
+
+@dataclass(frozen=True, slots=True)
+class LeaderboardPage:
+    headers: List[str]
+    rows: List[List[Any]]
+    first_rank: int
+    # Sort key of the last row, to continue from. None on the last page.
+    next_key: Optional[Tuple[Any, int]]
+
+    def text_view(self) -> str:
+        table = tabulate(self.rows, headers=self.headers, tablefmt="double_outline")
+        return f"```\n{table}\n```"
+
+
+def leaderboard_menu(
+    ctx, first: LeaderboardPage, fetch: Callable[[Tuple[Any, int], int], Awaitable[Result[LeaderboardPage]]]
+) -> ViewMenu:
+    """Menu that loads one page at a time. Visited pages are kept so going back doesn't query again."""
+    pages = [first]
+    menu = ViewMenu(ctx, menu_type=ViewMenu.TypeText, show_page_director=False)
+    menu.add_page(first.text_view())
+
+    async def back() -> None:
+        if len(pages) > 1:
+            pages.pop()
+            await menu.update(new_pages=[pages[-1].text_view()], new_buttons=None)
+
+    async def forward() -> None:
+        current = pages[-1]
+        if current.next_key is None:
+            return
+        match await fetch(current.next_key, current.first_rank + len(current.rows)):
+            case Ok(page) if page.rows:
+                pages.append(page)
+                await menu.update(new_pages=[page.text_view()], new_buttons=None)
+            case _:
+                return
+
+    for label, callback in [("Back", back), ("Next", forward)]:
+        menu.add_button(ViewButton(
+            label=label,
+            custom_id=ViewButton.ID_CALLER,
+            followup=ViewButton.Followup(details=ViewButton.Followup.set_caller_details(callback)),
+        ))
+    return menu
+
+
+# The hot statements are built once, with bound parameters, so every call reuses the compiled SQL
+# without rebuilding the statement or its cache key.
+
+_PLAYER_ID_BY_NAME = select(game_model.Player.player_id).where(game_model.Player.name == bindparam("name"))
+
+
+def _profile_statement():
+    opponent = aliased(game_model.Player)
+    h2h = model.HeadToHeadStats
+    nemesis = (
+        select(func.json_array(opponent.name, h2h.wins))
+        .select_from(h2h)
+        .join(opponent, opponent.player_id == h2h.winner_id)
+        .where(h2h.loser_id == game_model.Player.player_id, h2h.wins > 0)
+        .order_by(h2h.wins.desc())
+        .limit(1)
+        .scalar_subquery()
+    )
+    pinata = (
+        select(func.json_array(opponent.name, h2h.wins))
+        .select_from(h2h)
+        .join(opponent, opponent.player_id == h2h.loser_id)
+        .where(h2h.winner_id == game_model.Player.player_id, h2h.wins > 0)
+        .order_by(h2h.wins.desc())
+        .limit(1)
+        .scalar_subquery()
+    )
+    factions = (
+        select(func.json_group_array(
+            func.json_array(model.PlayerFactionStats.faction, model.PlayerFactionStats.played)
+        ))
+        .where(model.PlayerFactionStats.player_id == game_model.Player.player_id)
+        .scalar_subquery()
+    )
+    return (
+        select(
+            game_model.Player.name,
+            model.MatchPlayer.rating,
+            model.MatchPlayer.description,
+            model.MatchPlayer.thumbnail_url,
+            model.PlayerStats.games,
+            model.PlayerStats.wins,
+            model.PlayerStats.points,
+            model.PlayerStats.best_placement,
+            model.PlayerStats.current_streak,
+            nemesis.label("nemesis"),
+            pinata.label("pinata"),
+            factions.label("factions"),
+        )
+        .outerjoin(model.MatchPlayer, model.MatchPlayer.player_id == game_model.Player.player_id)
+        .outerjoin(model.PlayerStats, model.PlayerStats.player_id == game_model.Player.player_id)
+        .where(game_model.Player.player_id == bindparam("player_id"))
+    )
+
+
+_PROFILE = _profile_statement()
+
+_RATING_PAGE = (
+    select(
+        model.MatchPlayer.player_id,
+        model.MatchPlayer.rating,
+        game_model.Player.name,
+        model.PlayerStats.wins,
+    )
+    .join(model.MatchPlayer.player)
+    .outerjoin(model.PlayerStats, model.PlayerStats.player_id == model.MatchPlayer.player_id)
+    .order_by(model.MatchPlayer.rating.desc(), model.MatchPlayer.player_id.desc())
+    .limit(bindparam("limit"))
+)
+_RATING_PAGE_AFTER = _RATING_PAGE.where(
+    tuple_(model.MatchPlayer.rating, model.MatchPlayer.player_id)
+    < tuple_(bindparam("after_rating"), bindparam("after_player_id"))
+)
+
+_WINS_PAGE = (
+    select(
+        game_model.Player.player_id,
+        game_model.Player.name,
+        model.PlayerStats.wins,
+    )
+    .join(model.PlayerStats.player)
+    .where(model.PlayerStats.wins > 0)
+    .order_by(model.PlayerStats.wins.desc(), model.PlayerStats.player_id.desc())
+    .limit(bindparam("limit"))
+)
+_WINS_PAGE_AFTER = _WINS_PAGE.where(
+    tuple_(model.PlayerStats.wins, model.PlayerStats.player_id)
+    < tuple_(bindparam("after_wins"), bindparam("after_player_id"))
+)
+
+
+_RANK_KEY = tuple_(model.MatchPlayer.rating, model.MatchPlayer.player_id)
+_rank_at = tuple_(bindparam("rating"), bindparam("player_id"))
+
+_RANK_RATING = select(model.MatchPlayer.rating).where(model.MatchPlayer.player_id == bindparam("player_id"))
+# Players ahead of this one. A range over the rating index, so it only goes as far as the player.
+_RANK_AHEAD = select(func.count()).select_from(model.MatchPlayer).where(_RANK_KEY > _rank_at)
+_RANK_NEIGHBOURS = (
+    select(model.MatchPlayer.player_id, model.MatchPlayer.rating, game_model.Player.name)
+    .join(model.MatchPlayer.player)
+    .limit(bindparam("limit"))
+)
+# Closest first.
+_RANK_ABOVE = _RANK_NEIGHBOURS.where(_RANK_KEY > _rank_at).order_by(
+    model.MatchPlayer.rating.asc(), model.MatchPlayer.player_id.asc()
+)
+# The player, then the ones below.
+_RANK_BELOW = _RANK_NEIGHBOURS.where(_RANK_KEY <= _rank_at).order_by(
+    model.MatchPlayer.rating.desc(), model.MatchPlayer.player_id.desc()
+)
+
+# Solo games never get a ledger row, so they are replayed every time; there is nothing to rate in them.
+_UNRATED_GAMES = (
+    select(game_model.Game)
+    .where(
+        game_model.Game.game_state == game_model.GameState.FINISHED,
+        ~select(model.OutcomeLedger.game_id)
+        .where(model.OutcomeLedger.game_id == game_model.Game.game_id)
+        .exists(),
+    )
+    .options(selectinload(game_model.Game.game_players))
+    .order_by(game_model.Game.game_finish_time.asc())
+)
+
+_season_time = bindparam("time")
+_SEASON_AT = (
+    select(model.Season)
+    .where(
+        model.Season.start_time <= _season_time,
+        or_(model.Season.end_time.is_(None), model.Season.end_time > _season_time),
+    )
+    .order_by(model.Season.start_time.desc())
+    .limit(1)
+)
+
+
 class RatingLogic:
     """Cog containing rating related commands."""
 
     def __init__(self, engine: Engine) -> None:
         self.engine = engine
         self.k_game = 50  # Boundedness of updates
-        self._refresh_ratings()
 
         # Let's not auto update the ratings until we allow rollbacks or implement a proper refresh command
         # I.e. clear the ledger and reset ratings before recalculating the ratings.
         # signal("finish").connect(self.update_rating)
 
     def update_rating(self, _, game_id: int):
-        with Session(self.engine) as session:
+        with database.session(self.engine) as session:
             game = session.scalar(
                 select(game_model.Game).filter_by(
                     game_id=game_id, game_state=game_model.GameState.FINISHED
@@ -85,12 +278,6 @@ class RatingLogic:
             self._update_game_rating(session, game)
             session.commit()
 
-    @staticmethod
-    def _expectations(a, b) -> Tuple[float, float]:
-        scale_constant = 400
-        e_ab = 1 / (1 + 10 ** ((a - b) / scale_constant))
-        return e_ab, 1 - e_ab
-
     def __match_player(
         self, session: Session, game_player: game_model.GamePlayer
     ) -> model.MatchPlayer:
@@ -103,64 +290,27 @@ class RatingLogic:
             session.flush()
         return p
 
-    # Rewrite this using relationships now
-    def __wins_statement(self):
-        sq = (
-            select(
-                game_model.GamePlayer.game_id,
-                func.max(game_model.GamePlayer.points).label("max_points"),
-            )
-            .group_by(game_model.GamePlayer.game_id)
-            .where(
-                game_model.GamePlayer.game.has(game_state=game_model.GameState.FINISHED)
-            )
-            .subquery()
-        )
-        return (
-            select(
-                game_model.Player.player_id,
-                game_model.Player.name,
-                func.count("*").label("wins"),
-            )
-            .select_from(game_model.GamePlayer)
-            .group_by(game_model.Player.player_id)
-            .join(
-                sq,
-                (sq.c.game_id == game_model.GamePlayer.game_id)
-                & (sq.c.max_points == game_model.GamePlayer.points),
-            )
-            .join(
-                game_model.Player,
-                game_model.Player.player_id == game_model.GamePlayer.player_id,
-            )
-            .order_by(text("wins desc"))
-        )
-
-    def __deltas(self, session: Session, game: game_model.Game):
-        deltas = defaultdict(list)
+    def __head_to_head(self, session: Session, game: game_model.Game) -> None:
         for p1, p2 in combinations(game.game_players, 2):
-            a = self.__match_player(session, p1)
-            b = self.__match_player(session, p2)
-            e_ab, e_ba = self._expectations(a.rating, b.rating)
             if p1.points < p2.points:
                 wh = model.WinnerHeadToHead(game_id = game.game_id, loser_id = p1.player_id, winner_id=p2.player_id)
                 session.merge(wh)
-                deltas[p1.player_id].append(0 - e_ab)
-                deltas[p2.player_id].append(1 - e_ba)
             elif p1.points > p2.points:
                 wh = model.WinnerHeadToHead(game_id = game.game_id, loser_id = p2.player_id, winner_id=p1.player_id)
                 session.merge(wh)
-                deltas[p1.player_id].append(1 - e_ab)
-                deltas[p2.player_id].append(0 - e_ba)
-            else:
-                deltas[p1.player_id].append(0.5 - e_ab)
-                deltas[p2.player_id].append(0.5 - e_ba)
-        return deltas
 
     def _update_game_rating(self, session, game):
-        deltas = self.__deltas(session, game)
+        self._update_season_rating(session, game)
+
+        points = {player.player_id: player.points for player in game.game_players}
+        ratings = {
+            player.player_id: self.__match_player(session, player).rating
+            for player in game.game_players
+        }
+        self.__head_to_head(session, game)
+        deltas = elo.game_deltas(points, ratings, self.k_game)
 
-        if len(deltas) <= 1:
+        if not deltas:
             ## Solo game.
             return
 
@@ -170,7 +320,7 @@ class RatingLogic:
                 # Already processed this before
                 continue
             p = self.__match_player(session, player)
-            delta = sum(deltas[p.player_id]) / (len(deltas) - 1) * self.k_game
+            delta = deltas[p.player_id]
 
             ol = model.OutcomeLedger(
                 game_id=game.game_id,
@@ -185,183 +335,312 @@ class RatingLogic:
             p.rating += delta
             session.merge(p)
 
-    def _refresh_ratings(self):
-        with Session(self.engine) as session:
-            games = session.scalars(
-                select(game_model.Game)
-                .filter_by(game_state=game_model.GameState.FINISHED)
-                .order_by(game_model.Game.game_finish_time.asc())
-            )
+    @staticmethod
+    def _season_at(session: Session, time: datetime) -> Optional[model.Season]:
+        return session.scalar(_SEASON_AT, {"time": time})
+
+    def __season_player(
+        self, session: Session, season: model.Season, player_id: int
+    ) -> model.SeasonPlayer:
+        sp = session.get(model.SeasonPlayer, (season.season_id, player_id))
+        if not sp:
+            sp = model.SeasonPlayer(season_id=season.season_id, player_id=player_id)
+            session.add(sp)
+            session.flush()
+        return sp
+
+    def _update_season_rating(self, session: Session, game: game_model.Game) -> None:
+        """Apply a finished game to the snapshot of the season it was finished in."""
+        season = self._season_at(session, game.game_finish_time)
+        if season is None:
+            return
+
+        processed = session.scalar(
+            select(model.SeasonOutcomeLedger.game_id)
+            .filter_by(season_id=season.season_id, game_id=game.game_id)
+            .limit(1)
+        )
+        if processed is not None:
+            return
 
+        points = {player.player_id: player.points for player in game.game_players}
+        standings = {
+            player_id: self.__season_player(session, season, player_id)
+            for player_id in points
+        }
+        deltas = elo.game_deltas(
+            points, {player_id: sp.rating for player_id, sp in standings.items()}, self.k_game
+        )
+        if not deltas:
+            return
+
+        max_points = max(points.values())
+        for player_id, sp in standings.items():
+            delta = deltas[player_id]
+            session.add(model.SeasonOutcomeLedger(
+                season_id=season.season_id,
+                game_id=game.game_id,
+                player_id=player_id,
+                rating_before=sp.rating,
+                rating_delta=delta,
+                rating_after=sp.rating + delta,
+                match_time=game.game_finish_time,
+            ))
+            sp.rating += delta
+            sp.games += 1
+            if points[player_id] == max_points:
+                sp.wins += 1
+
+    def refresh_ratings(self) -> int:
+        """Rate the finished games that aren't in the ledger yet, oldest first. Returns how many there were.
+
+        Games already rated are skipped by the query, so this only replays what finished since the last run.
+        """
+        with database.session(self.engine) as session:
+            games = session.scalars(_UNRATED_GAMES).all()
             for game in games:
                 self._update_game_rating(session, game)
-                session.commit()
+            session.commit()
+            return len(games)
+
+    def verify_stats(self) -> List[str]:
+        """Check the trigger-maintained aggregates against a full recompute and rebuild them if needed."""
+        with database.session(self.engine) as session:
+            problems = aggregates.verify_and_repair(session)
+            session.commit()
+            return problems
+
+    def stats_snapshot(self) -> aggregates.Snapshot:
+        """What verify_stats recomputes from, for running the recompute in a compute.ComputeService."""
+        with database.session(self.engine) as session:
+            return aggregates.snapshot(session)
+
+    def repair_stats(self, snapshot: aggregates.Snapshot, expected: aggregates.Aggregates) -> Optional[List[str]]:
+        """verify_stats with the aggregates recomputed from snapshot.
+
+        Returns None, without touching anything, if a game changed since the snapshot was taken.
+        """
+        with database.session(self.engine) as session:
+            if aggregates.games_token(session) != snapshot.token:
+                return None
+            problems = aggregates.verify_and_repair(session, expected)
+            session.commit()
+            return problems
 
     def player_id_from_name(self, name: str) -> Optional[int]:
-        with Session(self.engine) as session:
-            return session.scalar(
-                select(game_model.Player.player_id).filter_by(name=name)
-            )
+        with database.session(self.engine) as session:
+            return session.scalar(_PLAYER_ID_BY_NAME, {"name": name})
 
     def stats(self, player_id: int) -> Result[Profile]:
-        """Retrieve the ratings for all players"""
+        """Retrieve the profile of a player in a single query over the stats tables."""
         try:
-            with Session(self.engine) as session:
-                # Find player info
-                mp = session.get(model.MatchPlayer, player_id)
-                if not mp:
-                    mp = session.merge(model.MatchPlayer(player_id=player_id))
-                    session.commit()
-
-                pp: Sequence[Row[Tuple[str|None, int]]] = session.execute(
-                    select(game_model.GamePlayer.faction, func.count("*").label("played_count"))
-                    .group_by(game_model.GamePlayer.faction)
-                    .filter_by(player_id=player_id)
-                    .where(
-                        game_model.GamePlayer.game.has(
-                            game_state=game_model.GameState.FINISHED
-                        )
-                    )
-                ).all()
-
-                games = session.execute(
-                    select(func.count("*"))
-                    .select_from(game_model.GamePlayer)
-                    .filter_by(player_id=player_id)
-                    .where(
-                        game_model.GamePlayer.game.has(
-                            game_state=game_model.GameState.FINISHED
-                        )
-                    )
-                ).scalar()
-                sq = (
-                    select(
-                        game_model.GamePlayer.game_id,
-                        func.max(game_model.GamePlayer.points).label("max_points"),
-                    )
-                    .group_by(game_model.GamePlayer.game_id)
-                    .where(
-                        game_model.GamePlayer.game.has(
-                            game_state=game_model.GameState.FINISHED
-                        )
-                    )
-                    .subquery()
-                )
-                stmt = (
-                    select(func.count("*"))
-                    .select_from(game_model.GamePlayer)
-                    .filter_by(player_id=player_id)
-                    .join(
-                        sq,
-                        (sq.c.game_id == game_model.GamePlayer.game_id)
-                        & (sq.c.max_points == game_model.GamePlayer.points),
-                    )
-                )
-
-                wins = session.execute(stmt).scalar()
-                points_per_game = session.scalar(
-                    select(func.sum(game_model.GamePlayer.points) / func.count("*"))
-                    .filter_by(player_id=player_id)
-                    .where(
-                        game_model.GamePlayer.game.has(
-                            game_state=game_model.GameState.FINISHED
-                        )
-                    )
+            with database.session(self.engine) as session:
+                row = session.execute(_PROFILE, {"player_id": player_id}).one_or_none()
+                if row is None:
+                    return Err("Player not found.")
+
+                games = row.games or 0
+                favorite_factions: List[Tuple[str, int]] = sorted(
+                    (tuple(f) for f in json.loads(row.factions)),
+                    key=lambda f: f[1],
+                    reverse=True,
                 )
-                nemesis = session.execute(
-                    select(model.WinnerHeadToHead, func.count("*").label("wins")).select_from(model.WinnerHeadToHead)
-                    .group_by(model.WinnerHeadToHead.winner_id)
-                    .filter_by(loser_id=player_id)
-                    .order_by(text("wins desc"))
-                ).first()
-                pinata = session.execute(
-                    select(model.WinnerHeadToHead, func.count("*").label("losses")).select_from(model.WinnerHeadToHead)
-                    .group_by(model.WinnerHeadToHead.loser_id)
-                    .filter_by(winner_id=player_id)
-                    .order_by(text("losses desc"))
-                ).first()
-                factions: List[Tuple[str,int]] = [(p.faction, p.played_count) for p in pp]
                 return Ok(
                     Profile(
-                        thumbnail=mp.thumbnail_url,
-                        name=mp.player.name,
-                        description=mp.description,
-                        rating=mp.rating,
-                        games=games if games else 0,
-                        wins=wins if wins else 0,
-                        nemesis=(nemesis.WinnerHeadToHead.winner.player.name, nemesis.wins) if nemesis else None,
-                        pinata=(pinata.WinnerHeadToHead.loser.player.name, pinata.losses) if pinata else None,
-                        favorite_factions=factions,
-                        points_per_game=float(points_per_game) if points_per_game else 0,
+                        thumbnail=row.thumbnail_url or "",
+                        name=row.name,
+                        description=row.description or "",
+                        rating=row.rating if row.rating is not None else 1500,
+                        games=games,
+                        wins=row.wins or 0,
+                        nemesis=tuple(json.loads(row.nemesis)) if row.nemesis else None,
+                        pinata=tuple(json.loads(row.pinata)) if row.pinata else None,
+                        favorite_factions=favorite_factions,
+                        points_per_game=row.points / games if games else 0.0,
+                        best_finish=row.best_placement,
+                        streak=row.current_streak or 0,
                     )
                 )
         except Exception as e:
             logging.exception(f"stats")
             return Err("Something went wrong.")
 
-    def ratings(self) -> str:
+    def ratings(self, season_id: Optional[int] = None) -> str:
         """Retrieve the ratings for all players in a table format"""
+        if season_id is not None:
+            return self.season_ratings(season_id)
+        match self.rating_page():
+            case Ok(page) if page.rows:
+                return page.text_view()
+            case Ok(_):
+                return "No players found."
+            case Err(msg):
+                return msg
+
+    def rating_page(
+        self, after: Optional[Tuple[float, int]] = None, first_rank: int = 1, page_size: int = PAGE_SIZE
+    ) -> Result[LeaderboardPage]:
+        """One page of the ratings leaderboard, continuing after the (rating, player_id) key."""
         try:
-            with Session(self.engine) as session:
-                sq = self.__wins_statement().subquery()
-                players = session.execute(
-                    select(model.MatchPlayer, sq.c.wins)
-                    .select_from(model.MatchPlayer)
-                    .order_by(model.MatchPlayer.rating.desc())
-                    .outerjoin(sq, sq.c.player_id == model.MatchPlayer.player_id)
-                ).all()
+            with database.session(self.engine) as session:
+                if after is None:
+                    players = session.execute(_RATING_PAGE, {"limit": page_size + 1}).all()
+                else:
+                    players = session.execute(_RATING_PAGE_AFTER, {
+                        "limit": page_size + 1, "after_rating": after[0], "after_player_id": after[1],
+                    }).all()
+
+                page = players[:page_size]
+                return Ok(LeaderboardPage(
+                    headers=["#", "Player", "Rating", "Wins"],
+                    rows=[
+                        [first_rank + i, row.name, int(row.rating), row.wins or 0]
+                        for i, row in enumerate(page)
+                    ],
+                    first_rank=first_rank,
+                    next_key=(page[-1].rating, page[-1].player_id) if len(players) > page_size else None,
+                ))
+        except Exception as e:
+            logging.exception("rating_page")
+            return Err("Something went wrong.")
 
-                if not players:
-                    return "No players found."
+    def rank(self, player_id: int, radius: int = 2) -> str:
+        """The player's position on the ratings leaderboard along with their neighbours."""
+        try:
+            with database.session(self.engine) as session:
+                rating = session.scalar(_RANK_RATING, {"player_id": player_id})
+                if rating is None:
+                    return "You are not on the leaderboard yet."
 
-                # Prepare table data
-                table_data = []
-                for i, row in enumerate(players):
-                    player = row[0]
-                    wins = row[1] if row[1] else 0
-                    table_data.append([i + 1, player.player.name, int(player.rating), wins])
+                key = {"rating": rating, "player_id": player_id}
+                ahead = session.scalar(_RANK_AHEAD, key)
+                above = session.execute(_RANK_ABOVE, {**key, "limit": radius}).all()
+                below = session.execute(_RANK_BELOW, {**key, "limit": radius + 1}).all()
+                first = ahead - len(above) + 1
 
-                # Generate table using tabulate
                 table = tabulate(
-                    table_data,
-                    headers=["#", "Player", "Rating", "Wins"],
+                    [
+                        [first + i, f"> {row.name}" if row.player_id == player_id else row.name, int(row.rating)]
+                        for i, row in enumerate([*reversed(above), *below])
+                    ],
+                    headers=["#", "Player", "Rating"],
                     tablefmt="double_outline",
                 )
-
-                # Send as Discord code block (triple backticks)
                 return f"```\n{table}\n```"
-
         except Exception as e:
-            logging.exception(f"ratings")
+            logging.exception("rank")
             return "Something went wrong."
 
-    def wins(self) -> str:
+    def season_ratings(self, season_id: int) -> str:
+        """Retrieve the leaderboard of a season from its rating snapshot."""
         try:
-            with Session(self.engine) as session:
-                players = session.execute(self.__wins_statement()).all()
-                # Prepare table data
-                table_data = []
-                for i, player in enumerate(players):
-                    table_data.append([i + 1, player.name, int(player.wins)])
-
-                # Generate table using tabulate
+            with database.session(self.engine) as session:
+                season = session.get(model.Season, season_id)
+                if not season:
+                    return "Season not found."
+
+                players = session.execute(
+                    select(game_model.Player.name, model.SeasonPlayer.rating, model.SeasonPlayer.wins, model.SeasonPlayer.games)
+                    .join(model.SeasonPlayer.player)
+                    .filter(model.SeasonPlayer.season_id == season_id)
+                    .order_by(model.SeasonPlayer.rating.desc())
+                ).all()
+
+                if not players:
+                    return f"No games have been rated in season {season.name} yet."
+
+                table_data = [
+                    [i + 1, row.name, int(row.rating), row.wins, row.games]
+                    for i, row in enumerate(players)
+                ]
                 table = tabulate(
                     table_data,
-                    headers=["#", "Player", "Wins"],
+                    headers=["#", "Player", "Rating", "Wins", "Games"],
                     tablefmt="double_outline",
                 )
+                return f"Season {season.season_id}: {season.name}\n```\n{table}\n```"
 
-                # Send as Discord code block (triple backticks)
-                return f"```\n{table}\n```"
         except Exception as e:
-            logging.exception("wins")
+            logging.exception("season_ratings")
+            return "Something went wrong."
+
+    def seasons(self) -> str:
+        try:
+            with database.session(self.engine) as session:
+                seasons = session.scalars(
+                    select(model.Season).order_by(model.Season.start_time.asc())
+                ).all()
+                if not seasons:
+                    return "No seasons found."
+
+                lines = []
+                for season in seasons:
+                    end = season.end_time.strftime("%Y-%m-%d") if season.end_time else "ongoing"
+                    lines.append(
+                        f"{season.season_id}. {season.name} ({season.start_time.strftime('%Y-%m-%d')} - {end})"
+                    )
+                return "\n".join(lines)
+        except Exception as e:
+            logging.exception("seasons")
             return "Something went wrong."
 
+    def start_season(self, name: str, start_time: Optional[datetime] = None) -> str:
+        """Close the running season and open a new one starting now.
+
+        The new season starts without any snapshot rows, so the rollover does not recompute anything.
+        """
+        start_time = start_time or datetime.now()
+        try:
+            with database.session(self.engine) as session:
+                current = self._season_at(session, start_time)
+                if current is not None:
+                    current.end_time = start_time
+                season = model.Season(name=name, start_time=start_time)
+                session.add(season)
+                session.commit()
+                return f"Season {season.season_id} ({season.name}) has started."
+        except Exception as e:
+            logging.exception("start_season")
+            return "Something went wrong."
+
+    def wins(self) -> str:
+        match self.wins_page():
+            case Ok(page) if page.rows:
+                return page.text_view()
+            case Ok(_):
+                return "No players found."
+            case Err(msg):
+                return msg
+
+    def wins_page(
+        self, after: Optional[Tuple[int, int]] = None, first_rank: int = 1, page_size: int = PAGE_SIZE
+    ) -> Result[LeaderboardPage]:
+        """One page of the wins leaderboard, continuing after the (wins, player_id) key."""
+        try:
+            with database.session(self.engine) as session:
+                if after is None:
+                    players = session.execute(_WINS_PAGE, {"limit": page_size + 1}).all()
+                else:
+                    players = session.execute(_WINS_PAGE_AFTER, {
+                        "limit": page_size + 1, "after_wins": after[0], "after_player_id": after[1],
+                    }).all()
+
+                page = players[:page_size]
+                return Ok(LeaderboardPage(
+                    headers=["#", "Player", "Wins"],
+                    rows=[[first_rank + i, row.name, int(row.wins)] for i, row in enumerate(page)],
+                    first_rank=first_rank,
+                    next_key=(page[-1].wins, page[-1].player_id) if len(players) > page_size else None,
+                ))
+        except Exception as e:
+            logging.exception("wins_page")
+            return Err("Something went wrong.")
+
     def set_pic(self, player_id: int, url:str) -> str:
         if not url.startswith("https://"):
             return "Start the URL with https://"
         try:
-            with Session(self.engine) as session:
+            with database.session(self.engine) as session:
                 mp = session.get(model.MatchPlayer, player_id)
                 if not mp:
                     mp = model.MatchPlayer(player_id=player_id)
@@ -375,7 +654,7 @@ class RatingLogic:
 
     def set_description(self, player_id: int, description:str) -> str:
         try:
-            with Session(self.engine) as session:
+            with database.session(self.engine) as session:
                 mp = session.get(model.MatchPlayer, player_id)
                 if not mp:
                     mp = model.MatchPlayer(player_id=player_id)
@@ -0,0 +1,137 @@
+import pytest
+from datetime import datetime
+from sqlalchemy import create_engine, delete, event
+from sqlalchemy.orm import sessionmaker
+from src.game import model as game_model
+from src.game.controller import GameController
+from src.rating import aggregates, model, ratinglogic
+from src.models import Base
+
+
+@pytest.fixture(scope="function")
+def db():
+    engine = create_engine("sqlite:///:memory:")
+    Base.metadata.create_all(engine)
+    SessionLocal = sessionmaker(bind=engine)
+    session = SessionLocal()
+    for player_id in range(1, 4):
+        session.add(game_model.Player(player_id=player_id, name=f"P{player_id}"))
+    session.commit()
+    yield session, engine
+    session.close()
+
+
+def finish(session, game_id, points, factions=None):
+    game = session.get(game_model.Game, game_id)
+    if not game:
+        game = game_model.Game(
+            game_id=game_id,
+            game_state=game_model.GameState.FINISHED,
+            name=f"G{game_id}",
+            game_finish_time=datetime(2025, 1, game_id),
+        )
+        session.add(game)
+        for player_id in points:
+            faction = (factions or {}).get(player_id)
+            session.add(game_model.GamePlayer(game_id=game_id, player_id=player_id, faction=faction))
+        session.flush()
+    for gp in game.game_players:
+        gp.points = points[gp.player_id]
+    GameController().record_result(session, game)
+    session.commit()
+
+
+def test_triggers_maintain_aggregates(db):
+    session, _ = db
+    finish(session, 1, {1: 10, 2: 5, 3: 7})
+    finish(session, 2, {1: 3, 2: 9})
+
+    assert (session.get(model.PlayerStats, 1).games, session.get(model.PlayerStats, 1).wins) == (2, 1)
+    assert session.get(model.PlayerStats, 2).points == 14
+    assert session.get(model.HeadToHeadStats, (1, 2)).wins == 1
+    assert session.get(model.HeadToHeadStats, (2, 1)).wins == 1
+    assert session.get(model.HeadToHeadStats, (3, 2)).wins == 1
+    assert aggregates.verify(session) == []
+
+
+def test_refinish_replaces_contribution(db):
+    session, _ = db
+    finish(session, 1, {1: 10, 2: 5, 3: 7})
+    finish(session, 1, {1: 2, 2: 5, 3: 7})
+
+    session.expire_all()
+    assert session.get(model.PlayerStats, 1).wins == 0
+    assert session.get(model.PlayerStats, 3).wins == 1
+    assert session.get(model.HeadToHeadStats, (1, 2)) is None
+    assert aggregates.verify(session) == []
+
+
+def test_verify_detects_and_repairs_drift(db):
+    session, engine = db
+    finish(session, 1, {1: 10, 2: 5})
+    logic = ratinglogic.RatingLogic(engine)
+    session.execute(delete(model.HeadToHeadStats))
+    session.commit()
+
+    assert aggregates.verify(session) == ["head_to_head_stats (1, 2): expected 1, found None"]
+    assert logic.verify_stats() == ["head_to_head_stats (1, 2): expected 1, found None"]
+    assert session.get(model.HeadToHeadStats, (1, 2)).wins == 1
+    assert logic.verify_stats() == []
+
+
+def test_stats_reads_aggregates(db):
+    session, engine = db
+    finish(session, 1, {1: 10, 2: 5})
+    finish(session, 2, {1: 10, 2: 6})
+    logic = ratinglogic.RatingLogic(engine)
+
+    profile = logic.stats(2).value
+    assert (profile.games, profile.wins, profile.points_per_game) == (2, 0, 5.5)
+    assert profile.nemesis == ("P1", 2)
+    assert profile.pinata is None
+    assert "P1" in logic.wins()
+
+
+def test_stats_profile_is_one_statement(db):
+    session, engine = db
+    finish(session, 1, {1: 4, 2: 5, 3: 7}, {1: "The Winnu", 2: "The Arborec"})
+    finish(session, 2, {1: 10, 2: 6}, {1: "The Winnu", 2: "Sardakk N'orr"})
+    finish(session, 3, {1: 10, 3: 6}, {1: "The Arborec"})
+    logic = ratinglogic.RatingLogic(engine)
+
+    statements = []
+    event.listen(engine, "before_cursor_execute", lambda *args: statements.append(args[2]))
+    profile = logic.stats(1).value
+    assert len(statements) == 1
+
+    assert (profile.games, profile.wins, profile.best_finish, profile.streak) == (3, 2, 1, 2)
+    assert profile.favorite_factions == [("The Winnu", 2), ("The Arborec", 1)]
+    assert profile.pinata in [("P2", 1), ("P3", 1)]
+    assert profile.nemesis in [("P2", 1), ("P3", 1)]
+    assert session.get(model.PlayerStats, 2).best_placement == 2
+    assert aggregates.verify(session) == []
+
+    # Losing ends the streak.
+    finish(session, 3, {1: 1, 3: 6})
+    session.expire_all()
+    assert session.get(model.PlayerStats, 1).current_streak == 0
+    assert session.get(model.PlayerFactionStats, (1, "The Arborec")) is not None
+    assert logic.stats(4).msg == "Player not found."
+
+
+def test_repair_from_a_recompute_made_elsewhere(db):
+    session, engine = db
+    finish(session, 1, {1: 10, 2: 5})
+    logic = ratinglogic.RatingLogic(engine)
+    session.execute(delete(model.HeadToHeadStats))
+    session.commit()
+
+    snapshot = logic.stats_snapshot()
+    expected = aggregates.recompute(snapshot.rows)
+    finish(session, 2, {1: 3, 2: 9})
+    # The recompute missed game 2, so it isn't applied.
+    assert logic.repair_stats(snapshot, expected) is None
+
+    snapshot = logic.stats_snapshot()
+    assert len(logic.repair_stats(snapshot, aggregates.recompute(snapshot.rows))) == 1
+    assert session.get(model.HeadToHeadStats, (1, 2)).wins == 1
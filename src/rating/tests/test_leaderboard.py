@@ -0,0 +1,61 @@
+import pytest
+from sqlalchemy import create_engine, text
+from sqlalchemy.orm import sessionmaker
+from src.game import model as game_model
+from src.rating import model, ratinglogic
+from src.models import Base
+
+
+@pytest.fixture(scope="function")
+def db():
+    engine = create_engine("sqlite:///:memory:")
+    Base.metadata.create_all(engine)
+    SessionLocal = sessionmaker(bind=engine)
+    session = SessionLocal()
+    for player_id in range(1, 24):
+        session.add(game_model.Player(player_id=player_id, name=f"P{player_id}"))
+        # Plenty of ties so the player_id part of the key matters.
+        session.add(model.MatchPlayer(player_id=player_id, rating=1500 + 10 * (player_id % 5)))
+    session.commit()
+    logic = ratinglogic.RatingLogic(engine)
+    yield session, logic
+    session.close()
+
+
+def test_rating_pages_cover_every_player_once(db):
+    _, logic = db
+    seen, ratings = [], []
+    page = logic.rating_page(page_size=5).value
+    while True:
+        seen.extend(row[1] for row in page.rows)
+        ratings.extend(row[2] for row in page.rows)
+        if page.next_key is None:
+            break
+        page = logic.rating_page(page.next_key, page.first_rank + len(page.rows), page_size=5).value
+
+    assert len(seen) == len(set(seen)) == 23
+    assert page.rows[-1][0] == 23
+    assert ratings == sorted(ratings, reverse=True)
+
+
+def test_rank_shows_neighbours(db):
+    _, logic = db
+    table = logic.rank(1)
+    # Same numbering as the leaderboard pages.
+    assert "║  19 ║ > P1 " in table
+    assert len([line for line in table.splitlines() if "P" in line and "Player" not in line]) == 5
+    assert "not on the leaderboard" in logic.rank(99)
+
+
+def test_wins_without_players(db):
+    _, logic = db
+    assert logic.wins() == "No players found."
+
+
+def test_rating_page_uses_index(db):
+    session, _ = db
+    plan = session.execute(text(
+        "EXPLAIN QUERY PLAN SELECT player_id FROM match_player "
+        "WHERE (rating, player_id) < (1520, 7) ORDER BY rating DESC, player_id DESC LIMIT 6"
+    )).all()
+    assert any("ix_match_player_rating" in row[-1] for row in plan)
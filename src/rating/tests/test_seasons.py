@@ -0,0 +1,99 @@
+import pytest
+from datetime import datetime
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from src.game import model as game_model
+from src.rating import ratinglogic, model
+from src.models import Base
+
+
+@pytest.fixture(scope="function")
+def db():
+    engine = create_engine("sqlite:///:memory:")
+    Base.metadata.create_all(engine)
+    SessionLocal = sessionmaker(bind=engine)
+    session = SessionLocal()
+    logic = ratinglogic.RatingLogic(engine)
+    yield session, logic
+    session.close()
+
+
+def finished_game(session, game_id, finish_time, points):
+    game = game_model.Game(
+        game_id=game_id,
+        game_state=game_model.GameState.FINISHED,
+        name=f"G{game_id}",
+        game_finish_time=finish_time,
+    )
+    session.add(game)
+    for player_id, p in points.items():
+        if not session.get(game_model.Player, player_id):
+            session.add(game_model.Player(player_id=player_id, name=f"P{player_id}"))
+        session.add(game_model.GamePlayer(game_id=game_id, player_id=player_id, points=p))
+    session.commit()
+
+
+def test_season_snapshot_is_separate_from_global_rating(db):
+    session, logic = db
+    session.add(model.Season(season_id=1, name="Spring", start_time=datetime(2025, 1, 1), end_time=datetime(2025, 6, 1)))
+    session.add(model.Season(season_id=2, name="Autumn", start_time=datetime(2025, 6, 1)))
+    session.commit()
+
+    finished_game(session, 1, datetime(2025, 2, 1), {1: 10, 2: 5})
+    finished_game(session, 2, datetime(2025, 7, 1), {1: 4, 2: 10})
+    logic.update_rating(None, 1)
+    logic.update_rating(None, 2)
+
+    spring = session.get(model.SeasonPlayer, (1, 1))
+    autumn = session.get(model.SeasonPlayer, (2, 1))
+    assert (spring.games, spring.wins) == (1, 1)
+    assert (autumn.games, autumn.wins) == (1, 0)
+    # Both seasons start from a fresh rating.
+    assert spring.rating > 1500 > autumn.rating
+    assert session.get(model.MatchPlayer, 1).rating != autumn.rating
+
+    # Reprocessing is a no-op.
+    logic.update_rating(None, 2)
+    session.expire_all()
+    assert session.get(model.SeasonPlayer, (2, 1)).games == 1
+
+
+def test_season_leaderboard(db):
+    session, logic = db
+    session.add(model.Season(season_id=1, name="Spring", start_time=datetime(2025, 1, 1)))
+    session.commit()
+    finished_game(session, 1, datetime(2025, 2, 1), {1: 10, 2: 5})
+    logic.update_rating(None, 1)
+
+    board = logic.ratings(1)
+    assert "Spring" in board
+    assert board.index("P1") < board.index("P2")
+    assert "Season not found." == logic.ratings(5)
+
+
+def test_start_season_closes_current_season(db):
+    session, logic = db
+    assert "has started" in logic.start_season("First")
+    assert "has started" in logic.start_season("Second")
+
+    seasons = session.query(model.Season).order_by(model.Season.season_id).all()
+    assert seasons[0].end_time == seasons[1].start_time
+    assert seasons[1].end_time is None
+    assert "No games have been rated" in logic.ratings(seasons[1].season_id)
+
+
+def test_refresh_only_rates_new_games(db):
+    session, logic = db
+    finished_game(session, 1, datetime(2025, 2, 1), {1: 10, 2: 5})
+    finished_game(session, 2, datetime(2025, 3, 1), {1: 4, 2: 10})
+    assert logic.refresh_ratings() == 2
+    rating = session.get(model.MatchPlayer, 1).rating
+
+    assert logic.refresh_ratings() == 0
+    session.expire_all()
+    assert session.get(model.MatchPlayer, 1).rating == rating
+
+    finished_game(session, 3, datetime(2025, 4, 1), {1: 10, 2: 5})
+    assert logic.refresh_ratings() == 1
+    session.expire_all()
+    assert session.get(model.MatchPlayer, 1).rating > rating
@@ -0,0 +1,141 @@
+import asyncio
+import os
+
+from dataclasses import dataclass, field, replace
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Mapping, Optional, TypeVar
+
+import discord
+
+from . import database, models, outbox
+from .database import Database
+from .storage import StorageConfig
+
+T = TypeVar("T")
+
+# Give every guild its own database file in this directory. Unset, all guilds share the storage path.
+SHARD_DIR_ENV = "TI4_SHARD_DIR"
+
+
+@dataclass
+class Shard:
+    """One database file and everything bound to it."""
+
+    # None for the shared database: direct messages, and every guild when sharding is off.
+    guild_id: Optional[int]
+    database: Database
+    # Delivers the events written to this shard's outbox.
+    outbox: outbox.Dispatcher
+    _services: Dict[str, Any] = field(default_factory=dict)
+    _lock: asyncio.Lock = field(default_factory=asyncio.Lock)
+
+    @property
+    def engine(self):
+        return self.database.engine
+
+    async def service(self, key: str, factory: Callable[["Shard"], T]) -> T:
+        """The shard's instance of a logic class, made by factory the first time it is asked for.
+
+        Logic classes read and repair their tables when they are made, so that runs on the shard's writer.
+        """
+        async with self._lock:
+            if key not in self._services:
+                self._services[key] = await self.database.write(factory, self)
+            return self._services[key]
+
+
+class ShardRouter:
+    """Maps each guild to its own SQLite file with the full schema, so one busy guild's writes never wait on another's.
+
+    Shards are opened on first use, on a thread, as that creates the engines and the tables.
+    Without a directory there is a single shard, the one at the storage path. Use it from the event loop.
+    """
+
+    def __init__(self, config: StorageConfig, directory: Optional[str] = None) -> None:
+        self.config = config
+        self.directory = Path(directory) if directory else None
+        self._shards: Dict[Optional[int], Shard] = {}
+        # Shards being opened. Whoever asks for one meanwhile waits for the same opening.
+        self._opening: Dict[Optional[int], asyncio.Future] = {}
+        # Outbox handlers, shared by every shard's dispatcher.
+        self.subscribers = outbox.Subscribers()
+        self._started = False
+        if self.directory is not None:
+            self.directory.mkdir(parents=True, exist_ok=True)
+
+    @classmethod
+    def from_env(cls, config: StorageConfig, env: Mapping[str, str] = os.environ) -> "ShardRouter":
+        return cls(config, env.get(SHARD_DIR_ENV))
+
+    async def shard(self, guild: Optional[discord.abc.Snowflake | int]) -> Shard:
+        """The shard of ctx.guild, or of a guild id."""
+        guild_id = guild if isinstance(guild, int) or guild is None else guild.id
+        if self.directory is None:
+            guild_id = None
+        shard = self._shards.get(guild_id)
+        if shard is not None:
+            return shard
+
+        opening = self._opening.get(guild_id)
+        if opening is None:
+            opening = self._opening[guild_id] = asyncio.ensure_future(self._open_async(guild_id))
+        # A caller giving up doesn't cancel the opening for the others.
+        return await asyncio.shield(opening)
+
+    def start(self) -> None:
+        """Start delivering outbox events, of the open shards and of every shard opened from now on.
+
+        Call it once the handlers are subscribed.
+        """
+        self._started = True
+        for shard in self._shards.values():
+            shard.outbox.start()
+
+    async def shards(self) -> List[Shard]:
+        """Every shard, including the ones on disk that haven't been used since startup."""
+        if self.directory is not None:
+            paths = await asyncio.to_thread(lambda: list(self.directory.glob("*.db")))
+            await asyncio.gather(*(self.shard(int(path.stem)) for path in paths if path.stem.isdigit()))
+        return list(self._shards.values())
+
+    def opened(self) -> List[Shard]:
+        """The shards opened since startup."""
+        return list(self._shards.values())
+
+    async def fan_out(self, fn: Callable[..., T], *args) -> Dict[Optional[int], T]:
+        """Call fn(shard, *args) as a read on every shard at once. Results are keyed by guild id."""
+        shards = await self.shards()
+        results = await asyncio.gather(*(shard.database.run(fn, shard, *args) for shard in shards))
+        return {shard.guild_id: result for shard, result in zip(shards, results)}
+
+    def close(self) -> None:
+        shards, self._shards = list(self._shards.values()), {}
+        for shard in shards:
+            shard.outbox.stop()
+            shard.database.close()
+            shard.engine.dispose()
+
+    async def _open_async(self, guild_id: Optional[int]) -> Shard:
+        try:
+            shard = await asyncio.to_thread(self._open, guild_id)
+        finally:
+            del self._opening[guild_id]
+        self._shards[guild_id] = shard
+        if self._started:
+            shard.outbox.start()
+        return shard
+
+    def _open(self, guild_id: Optional[int]) -> Shard:
+        config = self.config
+        if guild_id is not None:
+            config = replace(config, path=str(self.directory / f"{guild_id}.db"))
+        engine = config.create_engine()
+        models.create_all(engine)
+        read_engine = config.create_read_engine()
+        database.instrument(engine)
+        database.instrument(read_engine)
+        db = Database(engine, read_engine=read_engine)
+        # Every guild's dispatcher sleeps until its writer commits an event. Only the shared database,
+        # the one other processes may write to, is also polled.
+        interval = 1.0 if guild_id is None else None
+        return Shard(guild_id, db, outbox.Dispatcher(db, self.subscribers, interval=interval))
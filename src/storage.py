@@ -0,0 +1,99 @@
+import os
+
+from dataclasses import dataclass, replace
+from sqlalchemy import Engine, create_engine, event
+from typing import Dict, List, Mapping
+
+# Pick a preset with TI4_STORAGE=durable|balanced|fast and move the database with TI4_DB_PATH.
+STORAGE_ENV = "TI4_STORAGE"
+DB_PATH_ENV = "TI4_DB_PATH"
+
+
+@event.listens_for(Engine, "connect")
+def enable_foreign_keys(dbapi_connection, connection_record):
+    # Cascades rely on it, so it holds for every connection, not just the bot's.
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA foreign_keys=ON")
+    cursor.close()
+
+
+@dataclass(frozen=True)
+class StorageConfig:
+    """How the bot's SQLite database is opened. See https://sqlite.org/pragma.html for the settings."""
+
+    path: str = "app.db"
+    journal_mode: str = "WAL"
+    # OFF, NORMAL or FULL. NORMAL in WAL mode can lose the last commits on power loss, never corrupts.
+    synchronous: str = "NORMAL"
+    # Pages if positive, KiB if negative.
+    cache_size: int = -16_000
+    # Bytes of the file to memory map. 0 turns it off.
+    mmap_size: int = 0
+    # DEFAULT, FILE or MEMORY.
+    temp_store: str = "DEFAULT"
+    # Milliseconds a connection waits on a locked database before failing.
+    busy_timeout: int = 15_000
+
+    # Connections kept by the read-only engine, one per database worker. Up to as many again are
+    # opened for reads that nest a session, like !game reading the settings.
+    read_pool_size: int = 4
+
+    def pragmas(self, read_only: bool = False) -> List[str]:
+        if read_only:
+            # The journal mode is kept in the file; the read-write engine sets it.
+            return [*self.pragmas()[1:], "PRAGMA query_only=ON"]
+        return [
+            f"PRAGMA journal_mode={self.journal_mode}",
+            f"PRAGMA synchronous={self.synchronous}",
+            f"PRAGMA cache_size={self.cache_size}",
+            f"PRAGMA mmap_size={self.mmap_size}",
+            f"PRAGMA temp_store={self.temp_store}",
+            f"PRAGMA busy_timeout={self.busy_timeout}",
+        ]
+
+    def create_engine(self) -> Engine:
+        return self._engine(self.pragmas())
+
+    def create_read_engine(self) -> Engine:
+        """An engine with its own pool of query_only connections, for Database reads."""
+        return self._engine(self.pragmas(read_only=True), pool_size=self.read_pool_size, max_overflow=self.read_pool_size)
+
+    def _engine(self, pragmas: List[str], **kwargs) -> Engine:
+        engine = create_engine(
+            f"sqlite:///{self.path}", connect_args={"timeout": self.busy_timeout / 1000}, **kwargs
+        )
+
+        @event.listens_for(engine, "connect")
+        def apply_pragmas(dbapi_connection, connection_record):
+            cursor = dbapi_connection.cursor()
+            for pragma in pragmas:
+                cursor.execute(pragma)
+            cursor.close()
+
+        return engine
+
+
+PRESETS: Dict[str, StorageConfig] = {
+    # Every commit is synced to disk before it returns, as SQLite does by default.
+    "durable": StorageConfig(synchronous="FULL"),
+    # WAL checkpoints are synced, commits in between are not.
+    "balanced": StorageConfig(),
+    # Leaves syncing to the OS and keeps more of the database in memory. A crash of the machine can lose recent commits.
+    "fast": StorageConfig(
+        synchronous="OFF",
+        cache_size=-64_000,
+        mmap_size=256 * 1024 * 1024,
+        temp_store="MEMORY",
+    ),
+}
+
+
+def from_env(env: Mapping[str, str] = os.environ) -> StorageConfig:
+    """The preset named by TI4_STORAGE (balanced by default) at TI4_DB_PATH (app.db by default)."""
+    name = env.get(STORAGE_ENV, "balanced")
+    if name not in PRESETS:
+        raise ValueError(f"Unknown storage preset {name!r}. Choose one of {', '.join(PRESETS)}.")
+    config = PRESETS[name]
+    if DB_PATH_ENV in env:
+        config = replace(config, path=env[DB_PATH_ENV])
+    return config
@@ -0,0 +1,139 @@
+import asyncio
+import bisect
+import logging
+import os
+import sys
+import threading
+import time
+import traceback
+
+from dataclasses import dataclass, field
+from types import FrameType
+from typing import ClassVar, List, Mapping, Optional
+
+# Log the event loop thread's stack once it has been blocked this long.
+THRESHOLD_ENV = "TI4_LOOP_LAG_THRESHOLD_MS"
+DEFAULT_THRESHOLD = 0.25
+
+# Upper bounds of the lag histogram's buckets, in seconds. The last bucket takes everything above.
+LAG_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+
+@dataclass
+class LagHistogram:
+    bounds: ClassVar[tuple] = LAG_BUCKETS
+    # counts[i] is the number of samples up to LAG_BUCKETS[i], and not in an earlier bucket.
+    counts: List[int] = field(default_factory=lambda: [0] * (len(LAG_BUCKETS) + 1))
+    count: int = 0
+    total: float = 0.0
+    max: float = 0.0
+
+    def observe(self, seconds: float) -> None:
+        self.counts[bisect.bisect_left(LAG_BUCKETS, seconds)] += 1
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+
+    def quantile(self, q: float) -> float:
+        """Upper bound of the bucket holding the q-th quantile. The max if it falls in the last bucket."""
+        rank, seen = q * self.count, 0
+        for bound, count in zip(LAG_BUCKETS, self.counts):
+            seen += count
+            if seen >= rank and seen:
+                return bound
+        return self.max
+
+    def summary(self) -> str:
+        return (
+            f"{self.count} samples, p50 <= {self.quantile(0.5) * 1000:.0f} ms, "
+            f"p99 <= {self.quantile(0.99) * 1000:.0f} ms, max {self.max * 1000:.0f} ms"
+        )
+
+
+def command_on_stack(frame: Optional[FrameType]) -> Optional[str]:
+    """The command whose code is running: the innermost frame with a commands.Context named ctx."""
+    while frame is not None:
+        command = getattr(getattr(frame.f_locals.get("ctx"), "command", None), "qualified_name", None)
+        if command:
+            return command
+        frame = frame.f_back
+    return None
+
+
+class LoopWatchdog:
+    """Measures how late the event loop runs a callback, and says what blocked it.
+
+    A task on the loop wakes up every interval and records how late it was in a histogram. A side
+    thread checks that the task keeps waking up; once it hasn't for threshold seconds, the loop
+    thread's stack is logged, with the command running on it, while the loop is still blocked.
+    """
+
+    def __init__(self, threshold: float = DEFAULT_THRESHOLD, interval: float = 0.1) -> None:
+        self.threshold = threshold
+        self.interval = interval
+        self.histogram = LagHistogram()
+        # Stacks logged, one per stall.
+        self.stalls = 0
+        self._last_beat = time.monotonic()
+        self._reported_beat: Optional[float] = None
+        self._loop_thread: Optional[int] = None
+        self._task: Optional[asyncio.Task] = None
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+
+    @classmethod
+    def from_env(cls, env: Mapping[str, str] = os.environ) -> "LoopWatchdog":
+        if THRESHOLD_ENV not in env:
+            return cls()
+        return cls(threshold=float(env[THRESHOLD_ENV]) / 1000)
+
+    def start(self) -> None:
+        """Start watching the running loop."""
+        if self._task is not None:
+            return
+        self._loop_thread = threading.get_ident()
+        self._last_beat = time.monotonic()
+        self._stop.clear()
+        self._task = asyncio.create_task(self._beat(), name="loop-watchdog")
+        self._thread = threading.Thread(target=self._watch, name="loop-watchdog", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    async def _beat(self) -> None:
+        while True:
+            expected = time.monotonic() + self.interval
+            await asyncio.sleep(self.interval)
+            self._last_beat = now = time.monotonic()
+            lag = max(now - expected, 0.0)
+            self.histogram.observe(lag)
+            if lag >= self.threshold:
+                logging.warning("Event loop was blocked for %.0f ms (%s)", lag * 1000, self.histogram.summary())
+
+    def _watch(self) -> None:
+        while not self._stop.wait(self.threshold / 4):
+            beat = self._last_beat
+            if time.monotonic() - beat < self.interval + self.threshold or beat == self._reported_beat:
+                continue
+            self._reported_beat = beat
+            self.stalls += 1
+            self._report()
+
+    def _report(self) -> None:
+        frame = sys._current_frames().get(self._loop_thread)
+        if frame is None:
+            return
+        command = command_on_stack(frame)
+        logging.warning(
+            "Event loop blocked for over %.0f ms (%s):\n%s",
+            self.threshold * 1000,
+            f"!{command}" if command else "no command",
+            "".join(traceback.format_stack(frame)),
+        )
@@ -2,6 +2,7 @@ import discord
 import discord.ext.test as dpytest
 import pytest
 import pytest_asyncio
+from discord.ext import commands
 from src.bot import Bot
 
 
@@ -33,3 +34,41 @@ async def test_factions():
     await dpytest.message("!factions 3")
     # The response should mention random factions and the number requested
     assert dpytest.verify().message().contains().content("Here are 3 random factions:")
+
+
+@pytest.mark.asyncio
+async def test_lobbies_reads_the_guild_database():
+    await dpytest.message("!lobbies")
+    assert dpytest.verify().message().content("No games found.")
+
+
+@pytest.mark.asyncio
+async def test_commands_are_measured(bot):
+    await dpytest.message("!hello")
+    assert dpytest.verify().message().content("Hello!")
+    await dpytest.message("!metrics")
+    assert dpytest.verify().message().content("Admin only command")
+
+    hello = bot.metrics.commands["hello"]
+    assert (hello.calls, hello.errors, hello.in_flight, hello.latency.count) == (1, 0, 0, 1)
+    assert bot.metrics.commands["metrics"].calls == 1
+    assert 'ti4_command_calls_total{command="hello"} 1' in bot.metrics.render().splitlines()
+
+
+@pytest.mark.asyncio
+async def test_failed_commands_are_counted_once(bot):
+    @bot.command()
+    async def boom(ctx):
+        raise RuntimeError("boom")
+
+    # Runs before_invoke, the command, after_invoke and then on_command_error, which dpytest re-raises.
+    with pytest.raises(commands.CommandInvokeError):
+        await dpytest.message("!boom")
+    # Rejected on its argument, so only on_command_error runs.
+    with pytest.raises(commands.BadArgument):
+        await dpytest.message("!factions many")
+
+    stats = bot.metrics.commands["boom"]
+    assert (stats.calls, stats.errors, stats.in_flight) == (1, 1, 0)
+    factions = bot.metrics.commands["factions"]
+    assert (factions.calls, factions.errors) == (0, 1)
@@ -0,0 +1,43 @@
+import time
+
+import pytest
+from datetime import datetime
+from src import compute
+from src.rating import aggregates
+
+
+@pytest.fixture
+def service():
+    service = compute.ComputeService(workers=1)
+    yield service
+    service.close()
+
+
+@pytest.mark.asyncio
+async def test_tasks_run_in_a_worker_and_are_timed(service):
+    rows = [
+        (1, 1, "The Winnu", 10, datetime(2025, 1, 1)),
+        (1, 2, None, 6, datetime(2025, 1, 1)),
+        (2, 2, "The Arborec", 9, datetime(2025, 1, 2)),
+        (2, 1, "The Winnu", 4, datetime(2025, 1, 2)),
+    ]
+
+    result = await service.run(aggregates.RECOMPUTE, rows)
+    assert result == aggregates.recompute(rows)
+    assert result.pairs == {(1, 2): 1, (2, 1): 1}
+    assert result.factions == {(1, "The Winnu"): 2, (2, "The Arborec"): 1}
+
+    stats = service.stats["recompute_aggregates"]
+    assert stats.runs == 1 and stats.seconds > 0 and stats.max_seconds == stats.seconds
+
+
+@pytest.mark.asyncio
+async def test_failures_and_timeouts_are_counted(service):
+    with pytest.raises(ValueError):
+        await service.run(compute.Task("parse", int), "not a number")
+    assert service.stats["parse"].failed == 1
+
+    sleep = compute.Task("sleep", time.sleep)
+    with pytest.raises(TimeoutError):
+        await service.run(sleep, 2, timeout=0.1)
+    assert service.stats["sleep"].cancelled == 1 and service.stats["sleep"].runs == 0
@@ -0,0 +1,152 @@
+import asyncio
+import contextvars
+import threading
+
+import pytest
+from sqlalchemy import create_engine, text
+from sqlalchemy.exc import OperationalError
+from src import database as database_module
+from src.database import Database
+from src.storage import StorageConfig
+
+current_command = contextvars.ContextVar("current_command", default=None)
+
+
+@pytest.mark.asyncio
+async def test_run_executes_off_the_event_loop_thread():
+    database = Database(create_engine("sqlite:///:memory:"))
+    loop_thread = threading.get_ident()
+
+    def work(value):
+        with database.engine.connect() as connection:
+            return threading.get_ident(), connection.execute(text("SELECT :v"), {"v": value}).scalar()
+
+    worker_thread, value = await database.run(work, 42)
+    assert worker_thread != loop_thread
+    assert value == 42
+    database.close()
+
+
+@pytest.mark.asyncio
+async def test_run_carries_context_variables():
+    database = Database(create_engine("sqlite:///:memory:"))
+    current_command.set("stats")
+    assert await database.run(current_command.get) == "stats"
+    database.close()
+
+
+@pytest.mark.asyncio
+async def test_writes_are_batched_and_failures_are_isolated(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'test.db'}")
+    with engine.begin() as connection:
+        connection.execute(text("CREATE TABLE item (value INTEGER)"))
+    database = Database(engine)
+
+    def insert(value):
+        with database_module.session(engine) as session:
+            session.execute(text("INSERT INTO item VALUES (:v)"), {"v": value})
+            session.commit()
+            if value < 0:
+                raise ValueError(value)
+            return threading.current_thread().name
+
+    results = await asyncio.gather(*(database.write(insert, v) for v in [1, -2, 3]), return_exceptions=True)
+    assert results[0] == results[2] == "db-writer"
+    assert isinstance(results[1], ValueError)
+
+    def values():
+        with engine.connect() as connection:
+            return sorted(connection.execute(text("SELECT value FROM item")).scalars())
+
+    assert await database.run(values) == [1, 3]
+    database.close()
+
+
+@pytest.mark.asyncio
+async def test_statements_are_counted_per_command_across_threads(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'test.db'}")
+    database_module.instrument(engine)
+    database = Database(engine)
+
+    def select_one():
+        with database_module.session(engine) as session:
+            return session.execute(text("SELECT 1")).scalar()
+
+    with database_module.count_statements("stats") as stats:
+        await database.run(select_one)
+        await database.write(select_one)
+        select_one()
+    # The session in the write job adds its SAVEPOINT and RELEASE.
+    assert (stats.command, stats.statements) == ("stats", 5)
+    assert stats.seconds > 0
+
+    select_one()
+    assert stats.statements == 5
+    database.close()
+
+
+def test_failing_statements_leave_nothing_on_the_connection():
+    engine = create_engine("sqlite:///:memory:")
+    database_module.instrument(engine)
+    with engine.connect() as connection, database_module.count_statements("broken") as stats:
+        for _ in range(3):
+            with pytest.raises(OperationalError):
+                connection.execute(text("SELECT * FROM missing"))
+        assert connection.execute(text("SELECT 1")).scalar() == 1
+        assert "statement_start" not in connection.info
+    assert stats.statements == 1
+
+
+@pytest.mark.asyncio
+async def test_reads_use_the_query_only_engine(tmp_path):
+    config = StorageConfig(path=str(tmp_path / "test.db"))
+    engine = config.create_engine()
+    with engine.begin() as connection:
+        connection.execute(text("CREATE TABLE item (value INTEGER)"))
+    database = Database(engine, read_engine=config.create_read_engine())
+
+    def insert(value):
+        with database_module.session(engine) as session:
+            session.execute(text("INSERT INTO item VALUES (:v)"), {"v": value})
+            session.commit()
+
+    def values():
+        with database_module.session(engine) as session:
+            assert session.get_bind() is database.read_engine
+            return session.execute(text("SELECT value FROM item")).scalars().all()
+
+    await database.write(insert, 1)
+    assert await database.run(values) == [1]
+    with pytest.raises(OperationalError, match="readonly"):
+        await database.run(insert, 2)
+
+    # Outside a worker a session can still be sent to the read engine explicitly.
+    with database_module.session(engine) as session:
+        assert session.get_bind() is engine
+    with database_module.session(engine, read_only=True) as session:
+        assert session.get_bind() is database.read_engine
+    database.close()
+
+
+def test_nested_sessions_share_the_outer_one(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'uow.db'}")
+    with engine.begin() as connection:
+        connection.execute(text("CREATE TABLE item (value INTEGER)"))
+
+    with database_module.session(engine) as outer:
+        with database_module.session(engine) as inner:
+            assert inner is outer
+            inner.execute(text("INSERT INTO item VALUES (1)"))
+        # Leaving the nested block neither closes nor commits.
+        with pytest.raises(RuntimeError):
+            with database_module.session(engine) as inner:
+                inner.execute(text("INSERT INTO item VALUES (2)"))
+                raise RuntimeError
+        # The exception rolled the whole unit back.
+        assert outer.execute(text("SELECT count(*) FROM item")).scalar() == 0
+        outer.execute(text("INSERT INTO item VALUES (3)"))
+        outer.commit()
+
+    with database_module.session(engine) as session:
+        assert session is not outer
+        assert session.execute(text("SELECT value FROM item")).scalars().all() == [3]
@@ -0,0 +1,61 @@
+import pytest
+from types import SimpleNamespace
+from src import database, metrics
+
+
+class Context:
+    def __init__(self, name, failed=False):
+        self.command = SimpleNamespace(qualified_name=name)
+        self.command_failed = failed
+
+
+@pytest.mark.asyncio
+async def test_hooks_record_latency_errors_and_time_in_the_database_and_discord():
+    registry = metrics.MetricsRegistry()
+
+    class Http:
+        async def request(self, route):
+            return route
+
+    http = Http()
+    registry.instrument_http(http)
+
+    with database.count_statements("draft") as stats:
+        ctx = Context("draft")
+        await registry.before_invoke(ctx)
+        assert registry.commands["draft"].in_flight == 1
+        assert await http.request("send") == "send"
+        stats.add(0.002)
+        await registry.after_invoke(ctx)
+
+    # The order discord.py calls them in: after_invoke runs before on_command_error.
+    failed = Context("draft", failed=True)
+    await registry.before_invoke(failed)
+    await registry.after_invoke(failed)
+    registry.rejected(failed)
+    registry.rejected(Context("ban"))
+
+    draft = registry.commands["draft"]
+    assert (draft.calls, draft.errors, draft.in_flight, draft.statements) == (2, 1, 0, 1)
+    assert draft.db_seconds == 0.002 and draft.discord_seconds > 0
+    assert registry.commands["ban"].errors == 1 and registry.commands["ban"].calls == 0
+
+
+def test_render_is_prometheus_text(tmp_path):
+    registry = metrics.MetricsRegistry()
+    registry.command('odd "name"').latency.observe(0.02)
+    registry.command('odd "name"').latency.observe(30)
+    registry.collect(lambda: metrics.family_lines("ti4_extra", "gauge", "Extra.") + [metrics.sample_line("ti4_extra", {}, 1.5)])
+
+    lines = registry.render().splitlines()
+    assert "# TYPE ti4_command_latency_seconds histogram" in lines
+    assert 'ti4_command_latency_seconds_bucket{command="odd \\"name\\"",le="0.01"} 0' in lines
+    assert 'ti4_command_latency_seconds_bucket{command="odd \\"name\\"",le="0.025"} 1' in lines
+    assert 'ti4_command_latency_seconds_bucket{command="odd \\"name\\"",le="+Inf"} 2' in lines
+    assert 'ti4_command_latency_seconds_count{command="odd \\"name\\""} 2' in lines
+    assert lines[-1] == "ti4_extra 1.5"
+
+    exporter = metrics.MetricsExporter(registry, str(tmp_path / "ti4.prom"))
+    exporter.write()
+    assert (tmp_path / "ti4.prom").read_text() == registry.render()
+    assert not (tmp_path / "ti4.prom.tmp").exists()
@@ -0,0 +1,32 @@
+from sqlalchemy import create_engine, inspect, text
+from sqlalchemy.orm import Session
+from src import models
+from src.game import model
+
+
+def test_create_all_adds_the_columns_missing_from_existing_tables(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'old.db'}")
+    models.create_all(engine)
+    with engine.begin() as connection:
+        # The game tables as they were before they were versioned, with a game in them.
+        connection.execute(text("ALTER TABLE game DROP COLUMN version"))
+        connection.execute(text("ALTER TABLE game_player DROP COLUMN version"))
+        connection.execute(text("INSERT INTO player (player_id, name) VALUES (1, 'P1')"))
+        connection.execute(text("INSERT INTO game (game_id, game_state, name, turn, map_string) VALUES (1, 'LOBBY', 'Old', 0, '[]')"))
+        connection.execute(text(
+            "INSERT INTO game_player (game_id, player_id, points, turn_order, factions) VALUES (1, 1, 0, 0, '[]')"
+        ))
+
+    models.create_all(engine)
+    columns = {column["name"]: column for column in inspect(engine).get_columns("game")}
+    assert columns["version"]["nullable"] is False
+
+    with Session(engine) as session:
+        game = session.get(model.Game, 1)
+        assert (game.version, game.game_players[0].version) == (1, 1)
+        game.name = "Renamed"
+        session.commit()
+        assert game.version == 2
+
+    # Nothing left to add the second time.
+    models.create_all(engine)
@@ -0,0 +1,181 @@
+import asyncio
+from datetime import datetime, timedelta
+
+import pytest
+import pytest_asyncio
+from sqlalchemy import func, select
+from sqlalchemy.orm import Session
+from src import outbox
+from src.achievements import listener
+from src.achievements.model import PlayerProgress
+from src.game import model
+from src.game.gamelogic import GameLogic
+from src.shards import ShardRouter
+from src.storage import StorageConfig
+from src.typing import *
+
+
+@pytest_asyncio.fixture
+async def shard(tmp_path):
+    router = ShardRouter(StorageConfig(path=str(tmp_path / "app.db")))
+    yield await router.shard(None)
+    router.close()
+
+
+def events(engine):
+    with Session(engine) as session:
+        return session.scalars(select(outbox.OutboxEvent).order_by(outbox.OutboxEvent.event_id)).all()
+
+
+def started_game(shard, game_id=1):
+    with Session(shard.engine) as session:
+        session.add(model.Game(game_id=game_id, game_state=model.GameState.STARTED, name=f"G{game_id}"))
+        for player_id in (1, 2):
+            session.add(model.Player(player_id=player_id, name=f"P{player_id}"))
+            session.add(model.GamePlayer(game_id=game_id, player_id=player_id, turn_order=player_id))
+        session.commit()
+
+
+@pytest.mark.asyncio
+async def test_finish_event_is_written_with_the_game(shard):
+    started_game(shard)
+    logic = GameLogic(bot=None, engine=shard.engine, database=shard.database)
+
+    assert isinstance(await shard.database.write(logic.finish, False, 1, None), Err)
+    assert events(shard.engine) == []
+
+    assert isinstance(await shard.database.write(logic.finish, False, 1, "10 6"), Ok)
+    event, = events(shard.engine)
+    assert event.topic == outbox.GAME_FINISHED and event.payload == {"game_id": 1}
+
+    # The counters of both players are brought up to date by the achievements handler.
+    shard.outbox.subscribers.subscribe(outbox.GAME_FINISHED, "achievements", listener.on_game_finished)
+    assert await shard.outbox.deliver() == 1
+    assert await shard.outbox.deliver() == 0
+    with Session(shard.engine) as session:
+        won = session.get(PlayerProgress, (1, "games_won"))
+        assert won is not None and won.value == 1
+        assert session.scalar(select(func.count()).select_from(PlayerProgress).filter_by(counter_key="games_played")) == 2
+
+
+@pytest.mark.asyncio
+async def test_failed_handlers_are_retried_alone(shard):
+    calls = []
+
+    async def fine(database, event):
+        calls.append(("fine", event.key))
+
+    async def flaky(database, event):
+        calls.append(("flaky", event.key))
+        if event.attempts < 1:
+            raise RuntimeError("not yet")
+
+    shard.outbox.subscribers.subscribe("test", "fine", fine)
+    shard.outbox.subscribers.subscribe("test", "flaky", flaky)
+    shard.outbox.backoff = 0
+
+    def write():
+        with Session(shard.engine) as session:
+            outbox.enqueue(session, "test", "test:1", {})
+            outbox.enqueue(session, "test", "test:1", {})
+            session.commit()
+
+    await shard.database.write(write)
+    assert await shard.outbox.deliver() == 1
+    assert shard.outbox.stats.lag_seconds >= 0 and shard.outbox.stats.retried == 1
+    event, = events(shard.engine)
+    assert event.attempts == 1 and "not yet" in event.last_error and event.delivered_at is None
+
+    assert await shard.outbox.deliver() == 1
+    assert calls == [("fine", "test:1"), ("flaky", "test:1"), ("flaky", "test:1")]
+    assert events(shard.engine)[0].delivered_at is not None
+    assert shard.outbox.stats.delivered == 1 and shard.outbox.stats.lag_seconds > 0
+    assert await shard.outbox.deliver() == 0
+    assert shard.outbox.stats.lag_seconds == 0
+
+
+@pytest.mark.asyncio
+async def test_events_give_up_after_max_attempts(shard):
+    async def broken(database, event):
+        raise RuntimeError("broken")
+
+    shard.outbox.subscribers.subscribe("test", "broken", broken)
+    shard.outbox.backoff = 0
+    shard.outbox.max_attempts = 2
+    await shard.database.write(lambda: _enqueue(shard.engine, "test:2"))
+
+    assert await shard.outbox.deliver() == 1
+    assert await shard.outbox.deliver() == 1
+    assert await shard.outbox.deliver() == 0
+    assert events(shard.engine)[0].failed_at is not None and shard.outbox.stats.failed == 1
+
+
+@pytest.mark.asyncio
+async def test_claim_makes_a_handler_run_once(shard):
+    await shard.database.write(lambda: _enqueue(shard.engine, "test:3"))
+    event, = await shard.database.run(lambda: [
+        outbox.Event(e.event_id, e.topic, e.idempotency_key, e.payload, e.attempts, e.created_at)
+        for e in events(shard.engine)
+    ])
+
+    def handle():
+        with Session(shard.engine) as session:
+            claimed = outbox.claim(session, event, "once")
+            session.commit()
+            return claimed
+
+    assert await shard.database.write(handle)
+    assert not await shard.database.write(handle)
+
+
+@pytest.mark.asyncio
+async def test_dispatcher_sleeps_until_an_event_is_committed(tmp_path):
+    router = ShardRouter(StorageConfig(path=str(tmp_path / "app.db")), directory=str(tmp_path / "shards"))
+    try:
+        shard = await router.shard(1)
+        delivered = asyncio.Event()
+
+        async def handle(database, event):
+            delivered.set()
+
+        router.subscribers.subscribe("test", "handle", handle)
+        router.start()
+        await asyncio.sleep(0.05)
+        # Nothing to deliver or retry, and a guild's database isn't polled.
+        assert shard.outbox.interval is None and shard.outbox._sleep() is None
+
+        await shard.database.write(lambda: _enqueue(shard.engine, "test:4"))
+        await asyncio.wait_for(delivered.wait(), 1)
+    finally:
+        router.close()
+
+
+@pytest.mark.asyncio
+async def test_delivered_events_are_deleted_after_retention(shard):
+    async def handle(database, event):
+        pass
+
+    shard.outbox.subscribers.subscribe("test", "handle", handle)
+    for key in ("test:5", "test:6"):
+        await shard.database.write(lambda: _enqueue(shard.engine, key))
+    assert await shard.outbox.deliver() == 2
+
+    def age(key):
+        with Session(shard.engine) as session:
+            session.query(outbox.OutboxEvent).filter_by(idempotency_key=key).update(
+                {"delivered_at": datetime.now() - timedelta(days=8)}
+            )
+            session.commit()
+
+    await shard.database.write(age, "test:5")
+    await shard.outbox._purge()
+    assert [event.idempotency_key for event in events(shard.engine)] == ["test:6"]
+    assert shard.outbox.stats.purged == 1
+    with Session(shard.engine) as session:
+        assert session.scalar(select(func.count()).select_from(outbox.OutboxDelivery)) == 1
+
+
+def _enqueue(engine, key):
+    with Session(engine) as session:
+        outbox.enqueue(session, "test", key, {})
+        session.commit()
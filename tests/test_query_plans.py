@@ -0,0 +1,144 @@
+import re
+from datetime import datetime
+
+import pytest
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import Session
+from src import models
+from src.achievements import listener
+from src.achievements import rules
+from src.game import model as game_model
+from src.game import readmodels
+from src.game.controller import GameController
+from src.rating.ratinglogic import RatingLogic
+
+# "SCAN game_player" reads the whole table and "SCAN game_player USING INDEX ..." walks all of an index,
+# unless a LIMIT stops it early. Hot queries should SEARCH.
+FULL_SCAN = re.compile(r"^SCAN (\w+)(?: AS \w+)?$")
+INDEX_WALK = re.compile(r"^SCAN (\w+)(?: AS \w+)? USING (?:COVERING )?INDEX")
+
+
+@pytest.fixture(scope="function")
+def engine():
+    engine = create_engine("sqlite:///:memory:")
+    models.create_all(engine)
+    with Session(engine) as session:
+        for player_id in range(1, 5):
+            session.add(game_model.Player(player_id=player_id, name=f"P{player_id}"))
+        for game_id in range(1, 6):
+            game = game_model.Game(
+                game_id=game_id,
+                game_state=game_model.GameState.FINISHED,
+                name=f"G{game_id}",
+                game_finish_time=datetime(2025, 1, game_id),
+            )
+            session.add(game)
+            for player_id in range(1, 4):
+                session.add(game_model.GamePlayer(
+                    game_id=game_id, player_id=player_id, faction=f"F{player_id}",
+                    points=(player_id + game_id) % 4 + 6, turn_order=player_id,
+                ))
+            session.flush()
+            GameController().record_result(session, game)
+        session.add(game_model.Game(game_id=6, game_state=game_model.GameState.LOBBY, name="Lobby"))
+        session.commit()
+    RatingLogic(engine).refresh_ratings()
+    yield engine
+
+
+@pytest.fixture(scope="function")
+def plans(engine):
+    """Runs fn and returns the full scans in the query plans of the statements it executed."""
+    statements = []
+
+    def collect(connection, cursor, statement, parameters, context, executemany):
+        if not executemany and statement.lstrip().upper().startswith(("SELECT", "WITH", "UPDATE", "DELETE")):
+            statements.append((statement, parameters))
+
+    def full_scans(fn):
+        statements.clear()
+        event.listen(engine, "before_cursor_execute", collect)
+        try:
+            fn()
+        finally:
+            event.remove(engine, "before_cursor_execute", collect)
+        assert statements, "nothing was executed"
+
+        scans = []
+        with engine.connect() as connection:
+            for statement, parameters in statements:
+                for row in connection.exec_driver_sql(f"EXPLAIN QUERY PLAN {statement}", parameters):
+                    match = FULL_SCAN.match(row.detail)
+                    if not match and " LIMIT " not in statement:
+                        match = INDEX_WALK.match(row.detail)
+                    if match and match.group(1) in models.Base.metadata.tables:
+                        scans.append(f"{row.detail}: {statement}")
+        return scans
+
+    return full_scans
+
+
+def test_controller(engine, plans):
+    ctrl = GameController()
+
+    def run():
+        with Session(engine) as session:
+            game = session.get(game_model.Game, 1)
+            ctrl.players_ordered_by_turn(session, game)
+            ctrl.players_ordered_by_points(session, game)
+            ctrl.winner(session, game)
+            ctrl.record_result(session, game)
+            session.commit()
+
+    assert plans(run) == []
+
+
+def test_ratinglogic(engine, plans):
+    logic = RatingLogic(engine)
+
+    def run():
+        logic.stats(1)
+        page = logic.rating_page(page_size=1).value
+        logic.rating_page(page.next_key, page_size=1)
+        page = logic.wins_page(page_size=1).value
+        logic.wins_page(page.next_key, page_size=1)
+        logic.player_id_from_name("P3")
+
+    assert plans(run) == []
+
+
+def test_readmodels(engine, plans):
+    def run():
+        with Session(engine) as session:
+            readmodels.lobbies(session)
+            readmodels.finished_games(session, 3)
+
+    assert plans(run) == []
+
+
+def test_rank_searches_the_rating_index(engine, plans):
+    logic = RatingLogic(engine)
+    assert plans(lambda: logic.rank(2)) == []
+
+
+@pytest.mark.parametrize("rule", [
+    {"type": "finish", "target": 1},
+    {"type": "finish", "target": 1, "filter": {"points": {"op": "gte", "target": 8}, "finish_date_after": "2025-01-02"}},
+    {"type": "finish", "target": 1, "filter": {"play_as_faction": "F1", "against_faction": "F2"}},
+    {"type": "finish", "target": 1, "filter": {"against_faction": {"F2": "winner", "F3": "loser"}}},
+    {"type": "finish", "target": 1, "filter": {"win_against": ["F2", "F3"]}},
+    {"type": "finish", "target": 1, "filter": {"lose_against": "F3"}},
+    {"type": "finish", "target": 1, "filter": {"player": {"P2": "winner", "P3": "loser"}}},
+    {"type": "head_to_head", "opponent_name": "P2", "target": 1},
+    {"type": "player", "target": "P1"},
+])
+def test_rules(engine, plans, rule):
+    def run():
+        with Session(engine) as session:
+            getattr(rules, rule["type"])(session, rule, 1)
+
+    assert plans(run) == []
+
+
+def test_listener(engine, plans):
+    assert plans(lambda: listener.sync_counters(engine, 1)) == []
@@ -0,0 +1,71 @@
+import asyncio
+import threading
+
+import pytest
+from src.game import model
+from src.game.gamelogic import GameLogic
+from src.shards import ShardRouter
+from src.storage import StorageConfig
+from src.typing import *
+
+
+def lobby(shard, game_id, name):
+    logic = GameLogic(bot=None, engine=shard.engine, database=shard.database)
+    logic._create_lobby(game_id, 1, "P1", name)
+    return logic
+
+
+@pytest.mark.asyncio
+async def test_guilds_get_their_own_database_and_fan_out(tmp_path):
+    router = ShardRouter(StorageConfig(path=str(tmp_path / "app.db")), str(tmp_path / "shards"))
+    first, second = await router.shard(1), await router.shard(2)
+    assert await router.shard(1) is first and first is not second
+    assert (tmp_path / "shards" / "1.db").exists()
+
+    logic = lobby(first, 10, "Only in guild 1")
+    assert "Only in guild 1" in logic.lobbies().value
+    assert isinstance(lobby(second, 20, "Guild 2").lobbies(), Ok)
+    assert "Only in guild 1" not in GameLogic(bot=None, engine=second.engine, database=second.database).lobbies().value
+
+    counts = await router.fan_out(lambda shard: GameLogic.state_counts(shard.engine))
+    assert counts == {1: {model.GameState.LOBBY: 1}, 2: {model.GameState.LOBBY: 1}}
+    router.close()
+
+    # Shards on disk are found again after a restart.
+    router = ShardRouter(StorageConfig(path=str(tmp_path / "app.db")), str(tmp_path / "shards"))
+    assert sorted(shard.guild_id for shard in await router.shards()) == [1, 2]
+    router.close()
+
+
+@pytest.mark.asyncio
+async def test_services_are_made_once_per_shard(tmp_path):
+    router = ShardRouter(StorageConfig(path=str(tmp_path / "app.db")))
+    made = []
+
+    def factory(shard):
+        made.append(shard.guild_id)
+        return object()
+
+    # Without a shard directory every guild shares the one database.
+    shard = await router.shard(1)
+    assert shard is await router.shard(2) and shard.guild_id is None
+    assert await shard.service("thing", factory) is await shard.service("thing", factory)
+    assert made == [None]
+    router.close()
+
+
+@pytest.mark.asyncio
+async def test_shards_are_opened_off_the_event_loop_once(tmp_path, monkeypatch):
+    router = ShardRouter(StorageConfig(path=str(tmp_path / "app.db")), str(tmp_path / "shards"))
+    loop_thread, opened = threading.get_ident(), []
+    open_shard = router._open
+
+    def spy(guild_id):
+        opened.append((guild_id, threading.get_ident() != loop_thread))
+        return open_shard(guild_id)
+
+    monkeypatch.setattr(router, "_open", spy)
+    first, again = await asyncio.gather(router.shard(1), router.shard(1))
+    assert first is again
+    assert opened == [(1, True)]
+    router.close()
@@ -0,0 +1,78 @@
+import pytest
+from sqlalchemy import create_engine, func, select
+from sqlalchemy.orm import Session, sessionmaker
+from src.achievements import listener as achievements_listener
+from src.achievements.achievementslogic import AchievementsLogic
+from src.achievements.model import Achievement
+from src.game import model
+from src.game.controller import GameController
+from src.database import Database
+from src.game.gamelogic import GameLogic
+from src.models import Base
+from src.rating.ratinglogic import RatingLogic
+from src.typing import *
+
+
+@pytest.fixture(scope="function")
+def engine():
+    engine = create_engine("sqlite:///:memory:")
+    Base.metadata.create_all(engine)
+    session = sessionmaker(bind=engine)()
+    for player_id in range(1, 4):
+        session.add(model.Player(player_id=player_id, name=f"P{player_id}"))
+    for game_id in range(1, 11):
+        game = model.Game(game_id=game_id, game_state=model.GameState.FINISHED, name=f"G{game_id}")
+        session.add(game)
+        for player_id in range(1, 4):
+            session.add(model.GamePlayer(game_id=game_id, player_id=player_id, points=player_id + game_id % 3, faction=f"F{player_id}"))
+        session.flush()
+        GameController().record_result(session, game)
+
+    settings = model.GameSettings(drafting_mode=model.DraftingMode.EXCLUSIVE_POOL, factions_per_player=2)
+    session.add(model.Game(game_id=20, game_state=model.GameState.DRAFT, name="Drafting", game_settings=settings))
+    session.add(model.Game(game_id=21, game_state=model.GameState.STARTED, name="Started"))
+    for player_id, factions in [(1, ["A", "B"]), (2, ["C", "D"])]:
+        session.add(model.GamePlayer(game_id=20, player_id=player_id, turn_order=player_id - 1, factions=factions))
+        session.add(model.GamePlayer(game_id=21, player_id=player_id, turn_order=player_id))
+    session.commit()
+    session.close()
+    yield engine
+
+
+@pytest.fixture(scope="function")
+def logic(engine):
+    logic = GameLogic(bot=None, engine=engine, database=Database(engine))
+    yield logic
+    logic.database.close()
+
+
+def test_draft(engine, logic, statement_budget):
+    # One of them sets the deadline of the next pick.
+    with statement_budget(engine, "draft", 9):
+        assert isinstance(logic.draft(1, 20, "A"), Ok)
+
+
+def test_finish(engine, logic, statement_budget):
+    with statement_budget(engine, "finish", 12):
+        assert isinstance(logic.finish(False, 21, "10 6"), Ok)
+
+
+def test_games(engine, logic, statement_budget):
+    with statement_budget(engine, "games", 3):
+        assert isinstance(logic.games(), Ok)
+
+
+def test_stats(engine, statement_budget):
+    logic = RatingLogic(engine)
+    with statement_budget(engine, "stats", 1):
+        assert isinstance(logic.stats(1), Ok)
+
+
+def test_achievements(engine, statement_budget):
+    achievements_listener.load_achievements(engine)
+    logic = AchievementsLogic(engine)
+    with Session(engine) as session:
+        active = session.scalar(select(func.count()).select_from(Achievement).where(Achievement.is_active.is_(True)))
+    # Each achievement is still checked on its own; keep it at that.
+    with statement_budget(engine, "achievements", 3 * active + 10):
+        assert isinstance(logic.achievements(1, "P1"), Ok)
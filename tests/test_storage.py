@@ -0,0 +1,24 @@
+import pytest
+from sqlalchemy import text
+from src import storage
+
+
+def test_preset_pragmas_are_applied(tmp_path):
+    config = storage.from_env({storage.STORAGE_ENV: "fast", storage.DB_PATH_ENV: str(tmp_path / "fast.db")})
+    engine = config.create_engine()
+    with engine.connect() as connection:
+        pragma = lambda name: connection.execute(text(f"PRAGMA {name}")).scalar()
+        assert pragma("journal_mode") == "wal"
+        assert pragma("synchronous") == 0
+        assert pragma("temp_store") == 2
+        assert pragma("cache_size") == -64_000
+        assert pragma("busy_timeout") == 15_000
+        assert pragma("foreign_keys") == 1
+    assert (tmp_path / "fast.db").exists()
+    engine.dispose()
+
+
+def test_from_env_defaults_and_rejects_unknown_presets():
+    assert storage.from_env({}) == storage.PRESETS["balanced"]
+    with pytest.raises(ValueError):
+        storage.from_env({storage.STORAGE_ENV: "reckless"})
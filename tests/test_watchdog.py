@@ -0,0 +1,40 @@
+import asyncio
+import logging
+import time
+import pytest
+from types import SimpleNamespace
+from src import watchdog
+
+
+def test_histogram_buckets_and_quantiles():
+    histogram = watchdog.LagHistogram()
+    for seconds in [0.0005] * 98 + [0.3, 7.0]:
+        histogram.observe(seconds)
+
+    assert histogram.counts[0] == 98 and histogram.counts[7] == 1 and histogram.counts[-1] == 1
+    assert histogram.quantile(0.5) == 0.001
+    assert histogram.quantile(0.99) == 0.5
+    assert histogram.quantile(1) == histogram.max == 7.0
+
+
+def blocking_command(ctx):
+    time.sleep(0.3)
+
+
+@pytest.mark.asyncio
+async def test_blocked_loop_logs_the_stack_and_the_command(caplog):
+    dog = watchdog.LoopWatchdog(threshold=0.05, interval=0.01)
+    dog.start()
+    try:
+        await asyncio.sleep(0.05)
+        with caplog.at_level(logging.WARNING):
+            blocking_command(SimpleNamespace(command=SimpleNamespace(qualified_name="draft")))
+            await asyncio.sleep(0.05)
+    finally:
+        dog.stop()
+
+    assert dog.stalls == 1
+    stack, = [r.getMessage() for r in caplog.records if "Event loop blocked for over" in r.getMessage()]
+    assert "(!draft)" in stack and "blocking_command" in stack
+    assert dog.histogram.max >= 0.25
+    assert any("Event loop was blocked for" in r.getMessage() for r in caplog.records)